@@ -1,6 +1,7 @@
 import logging
 from datetime import datetime
 from Library.Sqllite import IPTV_Database
+from Library.db_sync import use_local_copy
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -24,23 +25,11 @@ def read_mac_entries_from_file(filepath):
 def main(new_url_macs):
     mac_entries = read_mac_entries_from_file(r"D:\Tools\MacAttack_build\MacAttackOutput.txt")
 
+    entries = mac_entries + [(entry["url"], entry["mac"], entry["expiration"]) for entry in new_url_macs]
+    use_local_copy()
     with IPTV_Database() as db:
-        for url, mac, expiration in mac_entries:
-            if db.get_mac_id(url, mac):
-                #logging.info(f"EXISTS: {url} - {mac}")
-                continue
-            db.insert_mac(url, mac, expiration, None, None)
-            logging.info(f"ADDED: {url} - {mac} - {expiration}")
-
-        for entry in new_url_macs:
-            url = entry["url"]
-            mac = entry["mac"]
-            expiration = entry["expiration"]
-            if db.get_mac_id(url, mac):
-                logging.info(f"EXISTS: {url} - {mac}")
-                continue
-            db.insert_mac(url, mac, expiration, None, None)
-            logging.info(f"ADDED: {url} - {mac} - {expiration}")
+        inserted_count, skipped_count = db.bulk_insert_macs(entries)
+    logging.info(f"Inserted {inserted_count} new MACs, skipped {skipped_count} existing MACs.")
 
 if __name__ == "__main__":
     
@@ -0,0 +1,195 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from Library.Settings import Settings
+from Library.mock_portal import MockPortal
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# same order as the phase summary of CHECK_macs.py
+PHASES = ("mac", "login", "genres", "channels", "resolve", "probe", "vlc")
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_int_list(value):
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def start_portals(args):
+    # one portal per URL on its own loopback address, so --host-workers applies per portal
+    portals = []
+    for index in range(args.urls):
+        options = dict(
+            genres=args.genres,
+            relevant_genres=args.relevant_genres,
+            pages=args.pages,
+            page_size=args.page_size,
+            latency_ms=args.latency_ms,
+            latency_jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate,
+            dead_mac_rate=args.dead_mac_rate,
+            dead_stream_rate=args.dead_stream_rate,
+            undecided_stream_rate=args.undecided_stream_rate,
+            stream_format=args.stream_format,
+            need_profile=args.need_profile,
+            seed=index,
+        )
+        try:
+            portal = MockPortal(host=f"127.0.0.{index + 1}", **options).start()
+        except OSError:
+            # not every OS routes all of 127.0.0.0/8 - the portals then share one host
+            logging.warning(f"Cannot bind 127.0.0.{index + 1}, using 127.0.0.1 for portal {index + 1}")
+            portal = MockPortal(host="127.0.0.1", **options).start()
+        portals.append(portal)
+    return portals
+
+
+def seed_database(db_path, portals, macs_per_url):
+    from Library.Sqllite import IPTV_Database
+
+    Settings.DB_PATH = db_path
+    entries = [
+        (f"{portal.url}/c", f"00:1A:79:{portal_index:02X}:{mac_index // 256:02X}:{mac_index % 256:02X}", "2099-12-31")
+        for portal_index, portal in enumerate(portals)
+        for mac_index in range(macs_per_url)
+    ]
+    with IPTV_Database() as db:
+        db.bulk_insert_macs(entries)
+    logging.info(f"Seeded {len(portals) * macs_per_url} MACs on {len(portals)} mock portals into {db_path}")
+
+
+def run_check(work_dir, template_db, workers, vlc_workers, args):
+    # every run starts from a copy of the seeded database, so no run reuses tokens of another
+    name = f"w{workers}_v{vlc_workers}"
+    db_path = os.path.join(work_dir, f"{name}.db")
+    stats_path = os.path.join(work_dir, f"{name}.json")
+    log_path = os.path.join(work_dir, f"{name}.log")
+    shutil.copyfile(template_db, db_path)
+
+    command = [
+        sys.executable, os.path.join(SCRIPT_DIR, "CHECK_macs.py"),
+        "--workers", str(workers),
+        "--vlc-workers", str(vlc_workers),
+        "--host-workers", str(args.host_workers),
+        "--engine", args.engine,
+        "--stats-json", stats_path,
+    ]
+    if not args.first_working:
+        command.append("--process-all")
+
+    env = dict(os.environ, IPTV_DB_PATH=db_path)
+    start_time = time.perf_counter()
+    with open(log_path, "w", encoding="utf-8") as log_file:
+        result = subprocess.run(command, cwd=SCRIPT_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    wall_time = time.perf_counter() - start_time
+
+    if result.returncode != 0 or not os.path.exists(stats_path):
+        logging.error(f"CHECK_macs failed for {name} (exit code {result.returncode}), see {log_path}")
+        return None
+
+    with open(stats_path, encoding="utf-8") as stats_file:
+        stats = json.load(stats_file)
+    stats["wall_seconds"] = wall_time
+    stats["log"] = log_path
+    return stats
+
+
+def format_seconds(value):
+    return f"{value:.3f}" if value is not None else "-"
+
+
+def report(results):
+    logging.info("------------------------------------------------")
+    logging.info("Benchmark results (phase latency p50/p95 in seconds)")
+    header = f"{'workers':>7} {'vlc':>4} {'MACs':>5} {'sec':>7} {'MACs/s':>7}  " + "  ".join(f"{phase:>15}" for phase in PHASES)
+    logging.info(header)
+    for workers, vlc_workers, stats in results:
+        if stats is None:
+            logging.info(f"{workers:>7} {vlc_workers:>4} failed")
+            continue
+        timings = stats.get("timings", {})
+        checked = timings.get("mac", {}).get("count", 0)
+        elapsed = stats.get("elapsed_seconds") or stats["wall_seconds"]
+        phases = []
+        for phase in PHASES:
+            summary = timings.get(phase)
+            if summary and summary["count"]:
+                phases.append(f"{format_seconds(summary['p50'])}/{format_seconds(summary['p95']):>7}".rjust(15))
+            else:
+                phases.append(f"{'-':>15}")
+        logging.info(
+            f"{workers:>7} {vlc_workers:>4} {checked:>5} {elapsed:>7.1f} {checked / elapsed if elapsed else 0:>7.2f}  "
+            + "  ".join(phases)
+        )
+        status_counts = stats.get("status_counts", {})
+        logging.info(f"{'':>7} status: " + ", ".join(f"{state.lower()}={count}" for state, count in status_counts.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CHECK_macs.py against local mock Stalker portals (no live portal is contacted).')
+    parser.add_argument('--urls', type=int, default=4, help='Number of mock portals / URLs (default: 4).')
+    parser.add_argument('--macs', type=int, default=25, help='MACs per URL (default: 25).')
+    parser.add_argument('--workers', type=parse_int_list, default=[5, 10, 20], help='Comma separated --workers values to benchmark (default: 5,10,20).')
+    parser.add_argument('--vlc-workers', type=parse_int_list, default=[1, 2], help='Comma separated --vlc-workers values to benchmark (default: 1,2).')
+    parser.add_argument('--host-workers', type=int, default=3, help='--host-workers of CHECK_macs.py (default: 3).')
+    parser.add_argument('--engine', choices=['threads', 'asyncio', 'pipeline'], default='threads', help='--engine of CHECK_macs.py (default: threads).')
+    parser.add_argument('--first-working', action='store_true', help='Stop each URL at the first working MAC instead of checking all MACs.')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Latency of every mock request in milliseconds (default: 20).')
+    parser.add_argument('--jitter-ms', type=float, default=10, help='Random latency jitter in milliseconds (default: 10).')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of API requests answered with HTTP 500 (default: 0).')
+    parser.add_argument('--dead-mac-rate', type=float, default=0.2, help='Share of MACs without a handshake token (default: 0.2).')
+    parser.add_argument('--dead-stream-rate', type=float, default=0.1, help='Share of streams answered with HTTP 404 (default: 0.1).')
+    parser.add_argument('--undecided-stream-rate', type=float, default=0.0, help='Share of streams the probe cannot judge, they are validated by VLC (default: 0).')
+    parser.add_argument('--genres', type=int, default=8, help='Genres per portal (default: 8).')
+    parser.add_argument('--relevant-genres', type=int, default=3, help='German/Austrian/adult genres among them (default: 3).')
+    parser.add_argument('--pages', type=int, default=3, help='Channel pages per genre (default: 3).')
+    parser.add_argument('--page-size', type=int, default=14, help='Channels per page (default: 14).')
+    parser.add_argument('--stream-format', choices=['ts', 'hls'], default='ts', help='Stream format of the mock streams (default: ts).')
+    parser.add_argument('--need-profile', action='store_true', help='Tokens only work after get_profile, like portals that need the full login.')
+    parser.add_argument('--serve-only', action='store_true', help='Only start the mock portals and print their URLs until Ctrl+C.')
+    parser.add_argument('--work-dir', type=str, help='Directory for databases, logs and statistics (default: a new temporary directory).')
+    args = parser.parse_args()
+
+    portals = start_portals(args)
+    try:
+        if args.serve_only:
+            for portal in portals:
+                logging.info(f"Mock portal: {portal.url}/c")
+            logging.info("Press Ctrl+C to stop.")
+            while True:
+                time.sleep(1)
+
+        work_dir = args.work_dir or tempfile.mkdtemp(prefix="iptv_bench_")
+        os.makedirs(work_dir, exist_ok=True)
+        template_db = os.path.join(work_dir, "template.db")
+        seed_database(template_db, portals, args.macs)
+
+        results = []
+        for workers in args.workers:
+            for vlc_workers in args.vlc_workers:
+                logging.info(f"Running CHECK_macs.py with --workers {workers} --vlc-workers {vlc_workers} ({args.engine})...")
+                results.append((workers, vlc_workers, run_check(work_dir, template_db, workers, vlc_workers, args)))
+
+        report(results)
+        requests_total = {}
+        for portal in portals:
+            for action, count in portal.requests.items():
+                requests_total[action] = requests_total.get(action, 0) + count
+        logging.info("Mock portal requests: " + ", ".join(f"{action}={count}" for action, count in sorted(requests_total.items())))
+        logging.info(f"Databases, logs and statistics: {work_dir}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for portal in portals:
+            portal.stop()
+
+
+if __name__ == "__main__":
+    main()
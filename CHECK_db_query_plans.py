@@ -0,0 +1,30 @@
+import logging
+from Library.Sqllite import IPTV_Database
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def main():
+    # read-write on purpose: opening the database creates missing indexes
+    with IPTV_Database() as db:
+        results = db.explain_hot_queries()
+
+    logging.info("Query plans of the hot IPTV_Database queries")
+    logging.info("------------------------------------------------")
+    not_indexed = 0
+    for name, uses_index, plan in results:
+        if uses_index:
+            logging.info(f"OK       {name}")
+        else:
+            logging.warning(f"NO INDEX {name}")
+            not_indexed += 1
+        for line in plan:
+            logging.info(f"           {line}")
+
+    logging.info("------------------------------------------------")
+    logging.info(f"{len(results) - not_indexed} of {len(results)} queries use an index.")
+    return 1 if not_indexed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -2,95 +2,450 @@ import random
 import time
 import subprocess
 import argparse
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import json
+import queue
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
 from collections import deque
 from urllib.parse import quote, urlparse, urlunparse
 
 import requests
 from Library import IPTV_Database, STK_Server, Settings, VLCPlayer, STATUS, EPG_Server, configure_vlc_parallel
+from Library.scheduler import MAC_Scheduler, URL_Task
+from Library.channel_health import ChannelHealth
+from Library.circuit_breaker import LOGIN_FAILED_PREFIX
+from Library.db_sync import use_local_copy
+from Library.host_latency import host_latency
+from Library.pipeline import PipelineStage, init_validation_process, validate_in_process
+from Library.priority import mac_priority, url_priority
+from Library.stalker import clean_stream_url, validate_stream_url
+from Library.stream_cache import stream_cache
+from Library.stats import run_stats
 
 from colorama import init, Fore, Style
 
 import logging
 logging.basicConfig(level=Settings.LOG_LEVEL, format=Settings.LOG_FORMAT)
 
+# timed phases of a MAC check, see run_stats.timer
+PHASES = ("mac", "login", "genres", "channels", "resolve", "probe", "vlc")
+# waiting times in the queues of the pipeline engine, see PipelineStage
+QUEUE_WAITS = ("queue_portal", "queue_link", "queue_validate")
+
+
+def save_token(db, mac_item, server):
+    # keep the handshake token for the next run - a rejected or missing token is cleared
+    if mac_item is None:
+        return
+    if server.token != mac_item.token or server.token_timestamp != mac_item.token_timestamp:
+        db.queue_mac_token(mac_item.id, server.token, server.token_timestamp)
+
+
+def record_channel_result(db, url, genre, channel, status, validation_start, channel_health):
+    # Only channels that got a stream link count - a failing create_link is a problem of the MAC
+    if not channel.channel_url:
+        return
+    success = status == STATUS.SUCCESS
+    # a cached verdict says nothing about the startup time of the stream
+    startup_ms = None if channel.verdict_cached else (time.perf_counter() - validation_start) * 1000
+    # a direct cmd may carry the session of this MAC - only create_link cmds are tried by other MACs
+    cmd = channel.cmd if channel.needs_create_link(channel.cmd) else None
+    genre_id = str(genre.category_id) if cmd else None
+    channel_health.record(channel.name, success, startup_ms, cmd, genre_id)
+    db.queue_channel_result(
+        url, channel.name, success, startup_ms,
+        stream_url=clean_stream_url(channel.channel_url), real_url=channel.real_url,
+        logo=channel.logo, german=genre.is_german(), adult=genre.is_adult(), austrian=genre.is_austrian(),
+        cmd=cmd, genre_id=genre_id,
+    )
 
-def process_mac(db, url, mac):
-    
-    is_german = None
-    is_adult = None 
-    success = None
-    success_message = ""
-    # check if at least one random channel is working for MAC in a relevant genre
-    with STK_Server(url, mac) as server:
-        login_status, status_message = server.login()
+
+class MAC_Check:
+    # Genre and channel decisions of one MAC check - shared by all engines, which only do the
+    # requests and report their outcome here
+    def __init__(self, channel_health=None):
+        self.channel_health = channel_health or ChannelHealth()
+        self.genres = None
+        self.relevant_genres = 0
+        self.success = None
+        self.success_message = ""
+        self.is_german = None
+        self.is_adult = None
+        self.start_time = time.perf_counter()
+
+    def logged_in(self, login_status, status_message):
         if login_status == STATUS.SUCCESS:
-            logging.debug(f"Successfully logged in with MAC: {mac} for URL: {url}")
-            status, message, genres = server.get_genres()
-            if status == STATUS.SUCCESS and genres:
-                relevantGenreCounter = 0
-                for genre in genres:
-                    is_german = genre.is_german() or is_german
-                    is_adult = genre.is_adult() or is_adult
-                    # skip genre if working channel was already found with previous genre
-                    # process genre if it is relevant
-                    if genre.is_relevant() and success != STATUS.SUCCESS:
-                        # if still no success but MAX_FAILED_STATUS_ATTEMPTS is reached, the set to failed content and 
-                        # do not process any channels for the remaining genres
-                        relevantGenreCounter += 1
-                        if relevantGenreCounter > Settings.MAX_FAILED_STATUS_ATTEMPTS:
-                            if success == None:
-                                success = STATUS.CONTENT
-                                success_message = f"Reached maximum attempts for genre. "
-                                logging.debug(success_message)
-                            continue
-
-                        logging.debug(f"Processing genre [{relevantGenreCounter}/{Settings.MAX_FAILED_STATUS_ATTEMPTS}] '{genre.name}'...")
-
-                        # get channels for the genre
-                        status, message, channels = genre.get_channels()
-                        if status == STATUS.SUCCESS:
-                            if len(channels) == 0:
-                                success = STATUS.CONTENT
-                                success_message = f"No channels found for genre '{genre.name}'"
-                                logging.debug(Fore.RED + success_message)
-                            else:
-                                # process 5 random channels from the genre
-                                for i in range(Settings.MAX_FAILED_STATUS_ATTEMPTS):
-                                    random_index = random.randint(0, len(channels) - 1)
-                                    channel = channels[random_index]
-                                    logging.debug(f"[{i+1}/{Settings.MAX_FAILED_STATUS_ATTEMPTS}] Channel '{channel.name}'.....")
-                                    status, message = channel.validate_url()
-                                    if status == STATUS.SUCCESS:
-                                        success = STATUS.SUCCESS
-                                        success_message = ""
-                                        logging.debug("Channel is valid.")
-                                        # exit the loop if a working channel was found
-                                        break
-                                    else:
-                                        success = STATUS.ERROR
-                                        success_message = f"Channel validation failed: {message}"
-                                        logging.debug(success_message)
-                        else:
-                            success = STATUS.CONTENT
-                            success_message = f"Failed to get channels for genre '{genre.name}': {message}"
-                            logging.debug(success_message)                            
-
-
-                # If no relevant genres were found, set success to CONTENT because no relevant genres were found    
-                if success == None:
-                    success = STATUS.CONTENT
-                    success_message = f"No relevant genres found"
-                    logging.debug(success_message)
+            return True
+        self.success = login_status
+        self.success_message = f"{LOGIN_FAILED_PREFIX} - Status: {login_status}, Message: {status_message}"
+        return False
+
+    def genres_loaded(self, status, message, genres):
+        # True if there are genres to check - the relevant ones are checked in portal order.
+        # A failed request keeps its status: an unreachable portal is no content problem of the MAC.
+        if status != STATUS.SUCCESS:
+            self.success = status
+            self.success_message = message
+            logging.debug(self.success_message)
+            return False
+        if not genres:
+            self.success = STATUS.CONTENT
+            self.success_message = f"No genres found"
+            logging.debug(self.success_message)
+            return False
+        for genre in genres:
+            self.is_german = genre.is_german() or self.is_german
+            self.is_adult = genre.is_adult() or self.is_adult
+        self.genres = deque(genre for genre in genres if genre.is_relevant())
+        return True
+
+    def next_genre(self):
+        # None once a working channel was found or MAX_FAILED_STATUS_ATTEMPTS genres were checked
+        if self.success == STATUS.SUCCESS or not self.genres:
+            return None
+        self.relevant_genres += 1
+        if self.relevant_genres > Settings.MAX_FAILED_STATUS_ATTEMPTS:
+            if self.success is None:
+                self.success = STATUS.CONTENT
+                self.success_message = f"Reached maximum attempts for genre. "
+                logging.debug(self.success_message)
+            self.genres.clear()
+            return None
+        genre = self.genres.popleft()
+        logging.debug(f"Processing genre [{self.relevant_genres}/{Settings.MAX_FAILED_STATUS_ATTEMPTS}] '{genre.name}'...")
+        return genre
+
+    def channels_loaded(self, genre, status, message, channels):
+        # up to MAX_FAILED_STATUS_ATTEMPTS channels to validate, recently working channels first
+        if status == STATUS.UNREACHABLE:
+            # the portal went down during the check - no further genre is tried
+            self.success = status
+            self.success_message = message
+            self.genres.clear()
+            return []
+        if status != STATUS.SUCCESS:
+            self.success = STATUS.CONTENT
+            self.success_message = f"Failed to get channels for genre '{genre.name}': {message}"
+            logging.debug(self.success_message)
+            return []
+        if len(channels) == 0:
+            self.success = STATUS.CONTENT
+            self.success_message = f"No channels found for genre '{genre.name}'"
+            logging.debug(Fore.RED + self.success_message)
+            return []
+        # recently working channels the sampled pages missed are candidates too
+        known = self.channel_health.known_channels(genre.category_id, {channel.name for channel in channels})
+        return self.channel_health.pick(channels + genre.build_channels(known), Settings.MAX_FAILED_STATUS_ATTEMPTS)
+
+    def channel_validated(self, status, message):
+        # True if the channel works - no further channel has to be validated then
+        if status == STATUS.SUCCESS:
+            self.success = STATUS.SUCCESS
+            self.success_message = ""
+            logging.debug("Channel is valid.")
+            return True
+        self.success = STATUS.ERROR
+        self.success_message = f"Channel validation failed: {message}"
+        logging.debug(self.success_message)
+        return False
+
+    def token_unconfirmed(self, server):
+        # a SUCCESS needs one request the portal answered with the token of this MAC - after a fast
+        # login with cached listings and direct stream URLs there may have been none
+        return self.success == STATUS.SUCCESS and not server.authenticated
+
+    def finish(self, db, mac_item, server):
+        save_token(db, mac_item, server)
+        run_stats.record("mac", time.perf_counter() - self.start_time)
+
+    def result(self):
+        # If no relevant genres were found, set success to CONTENT because no relevant genres were found
+        if self.success is None:
+            self.success = STATUS.CONTENT
+            self.success_message = f"No relevant genres found"
+        return self.success, self.success_message, self.is_german, self.is_adult
+
+
+def stored_token(mac_item):
+    if mac_item is None:
+        return None, None
+    return mac_item.token, mac_item.token_timestamp
+
+
+def process_mac(db, url, mac, mac_item=None, channel_health=None):
+    check = MAC_Check(channel_health)
+    # check if at least one random channel is working for MAC in a relevant genre
+    with STK_Server(url, mac, *stored_token(mac_item)) as server:
+        with run_stats.timer("login"):
+            login_status, status_message = server.login()
+        if check.logged_in(login_status, status_message):
+            with run_stats.timer("genres"):
+                status, message, genres = server.get_genres()
+            if check.genres_loaded(status, message, genres):
+                while True:
+                    genre = check.next_genre()
+                    if genre is None:
+                        break
+                    with run_stats.timer("channels"):
+                        status, message, channels = genre.get_channels(sample_pages=Settings.CHANNEL_SAMPLE_PAGES)
+                    for channel in check.channels_loaded(genre, status, message, channels):
+                        validation_start = time.perf_counter()
+                        status, message = channel.validate_url()
+                        record_channel_result(db, url, genre, channel, status, validation_start, check.channel_health)
+                        if check.channel_validated(status, message):
+                            break
+            if check.token_unconfirmed(server):
+                check.logged_in(*server.confirm_token())
+        check.finish(db, mac_item, server)
+    return check.result()
+
+
+def run_threaded(scheduler, db):
+    # Threaded engine: one pool thread per MAC job, the scheduler decides what runs next
+    futures = {}
+
+    def fill():
+        while True:
+            job = scheduler.next_job()
+            if job is None:
+                return
+            logging.debug(f"{Fore.CYAN}START {job.url} {job.mac_item.mac} (id={job.mac_item.id}, failed={job.mac_item.failed})")
+            futures[executor.submit(process_mac, db, job.url, job.mac_item.mac, job.mac_item, job.task.channel_health)] = job
+
+    with ThreadPoolExecutor(max_workers=scheduler.max_workers) as executor:
+        fill()
+        while futures or scheduler.wait_seconds() is not None:
+            if not futures:
+                # only MACs of hosts in their cool-down are left
+                time.sleep(scheduler.wait_seconds() or 0)
+                fill()
+                continue
+            done, _ = wait(list(futures.keys()), timeout=scheduler.wait_seconds(), return_when=FIRST_COMPLETED)
+            for future in done:
+                job = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    result = (STATUS.ERROR, f"Unhandled error: {exc}", None, None)
+                scheduler.complete(job, result)
+            fill()
+
+
+async def process_mac_async(session, validation_slots, db, url, mac, mac_item=None, channel_health=None):
+    # asyncio twin of process_mac - only the requests differ
+    from Library.stalker_async import STK_AsyncServer
+
+    check = MAC_Check(channel_health)
+    async with STK_AsyncServer(session, url, mac, *stored_token(mac_item), validation_slots=validation_slots) as server:
+        with run_stats.timer("login"):
+            login_status, status_message = await server.login()
+        if check.logged_in(login_status, status_message):
+            with run_stats.timer("genres"):
+                status, message, genres = await server.get_genres()
+            if check.genres_loaded(status, message, genres):
+                while True:
+                    genre = check.next_genre()
+                    if genre is None:
+                        break
+                    with run_stats.timer("channels"):
+                        status, message, channels = await genre.get_channels(sample_pages=Settings.CHANNEL_SAMPLE_PAGES)
+                    for channel in check.channels_loaded(genre, status, message, channels):
+                        validation_start = time.perf_counter()
+                        status, message = await channel.validate_url()
+                        record_channel_result(db, url, genre, channel, status, validation_start, check.channel_health)
+                        if check.channel_validated(status, message):
+                            break
+            if check.token_unconfirmed(server):
+                check.logged_in(*await server.confirm_token())
+        check.finish(db, mac_item, server)
+    return check.result()
+
+
+async def run_async(scheduler, db):
+    # asyncio engine: one coroutine per MAC job on a single event loop
+    from Library.stalker_async import create_client_session
+
+    # VLC slots of this event loop - an asyncio.Semaphore must not outlive its loop
+    validation_slots = asyncio.Semaphore(max(1, Settings.VLC_MAX_PARALLEL))
+
+    async def run_job(job):
+        try:
+            return job, await process_mac_async(session, validation_slots, db, job.url, job.mac_item.mac, job.mac_item, job.task.channel_health)
+        except Exception as exc:
+            return job, (STATUS.ERROR, f"Unhandled error: {exc}", None, None)
+
+    async with create_client_session(scheduler.max_workers) as session:
+        pending = set()
+
+        def fill():
+            while True:
+                job = scheduler.next_job()
+                if job is None:
+                    return
+                pending.add(asyncio.create_task(run_job(job)))
+
+        fill()
+        while pending or scheduler.wait_seconds() is not None:
+            if not pending:
+                # only MACs of hosts in their cool-down are left
+                await asyncio.sleep(scheduler.wait_seconds() or 0)
+                fill()
+                continue
+            done, pending = await asyncio.wait(pending, timeout=scheduler.wait_seconds(), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                job, result = task.result()
+                scheduler.complete(job, result)
+            fill()
+
+
+class MAC_PipelineCheck(MAC_Check):
+    # state of one MAC job on its way through the stages of the pipeline engine
+    def __init__(self, job):
+        super().__init__(job.task.channel_health)
+        self.job = job
+        self.server = STK_Server(job.url, job.mac_item.mac, *stored_token(job.mac_item))
+        self.genre = None
+        self.candidates = deque()
+        self.channel = None
+        self.stream_url = None
+        self.validation_seconds = 0.0
+
+
+def run_pipeline(scheduler, db, args):
+    # Pipeline engine: the decisions of MAC_Check as in process_mac, but split into the stages
+    # portal (login, genres, channel list of the next relevant genre), link (stream link and real
+    # URL of the next candidate channel) and validate (probe/VLC, optionally in a process pool).
+    # Every stage has its own workers, so the network stages keep running while the validation is
+    # the bottleneck. A MAC check is in one queue at a time and at most --workers checks are in
+    # flight, so queues of that size never block a stage.
+    finished = queue.Queue()
+    validation_pool = None
+    if args.validate_processes:
+        validation_pool = ProcessPoolExecutor(
+            max_workers=max(1, args.validate_workers),
+            initializer=init_validation_process,
+            initargs=(Settings.LOG_LEVEL, Settings.LOG_FORMAT),
+        )
+
+    def finish(check):
+        check.finish(db, check.job.mac_item, check.server)
+        check.server.__exit__(None, None, None)
+        finished.put(check)
+
+    def next_genre(check):
+        server = check.server
+        if check.genres is None:
+            with run_stats.timer("login"):
+                login_status, status_message = server.login()
+            if not check.logged_in(login_status, status_message):
+                return finish(check)
+            with run_stats.timer("genres"):
+                status, message, genres = server.get_genres()
+            if not check.genres_loaded(status, message, genres):
+                return finish(check)
+
+        while True:
+            genre = check.next_genre()
+            if genre is None:
+                break
+            with run_stats.timer("channels"):
+                status, message, channels = genre.get_channels(sample_pages=Settings.CHANNEL_SAMPLE_PAGES)
+            candidates = check.channels_loaded(genre, status, message, channels)
+            if candidates:
+                check.genre = genre
+                check.candidates = deque(candidates)
+                return links.put(check)
+        if check.token_unconfirmed(server):
+            check.logged_in(*server.confirm_token())
+        finish(check)
+
+    def prepare_link(check):
+        check.channel = check.candidates.popleft()
+        start_time = time.perf_counter()
+        status, message, check.stream_url = check.channel.prepare_url()
+        check.validation_seconds = time.perf_counter() - start_time
+        if check.stream_url is None:
+            return channel_done(check, status, message)
+        validations.put(check)
+
+    def validate(check):
+        start_time = time.perf_counter()
+        if validation_pool is not None:
+            status, message, snapshot = validation_pool.submit(validate_in_process, check.stream_url).result()
+            run_stats.merge(snapshot)
+        else:
+            status, message = validate_stream_url(check.stream_url)
+        # the time in the queue is not part of the startup time of the stream
+        check.validation_seconds += time.perf_counter() - start_time
+        check.channel.cache_verdict(status, message)
+        channel_done(check, status, message)
+
+    def channel_done(check, status, message):
+        validation_start = time.perf_counter() - check.validation_seconds
+        record_channel_result(db, check.job.url, check.genre, check.channel, status, validation_start, check.channel_health)
+        if check.channel_validated(status, message):
+            if check.token_unconfirmed(check.server):
+                # the token check is a portal request
+                portal.put(check)
             else:
-                success = STATUS.CONTENT
-                success_message = f"No genres found"
-                logging.debug(success_message)
+                finish(check)
+        # next candidate of the genre, otherwise the next relevant genre
+        elif check.candidates:
+            links.put(check)
         else:
-            success = login_status
-            success_message = f"Login failed - Status: {login_status}, Message: {status_message}"
+            portal.put(check)
+
+    def on_error(check, exc):
+        check.success = STATUS.ERROR
+        check.success_message = f"Unhandled error: {exc}"
+        finish(check)
+
+    queue_size = scheduler.max_workers
+    portal = PipelineStage("portal", next_genre, args.portal_workers, queue_size, on_error)
+    links = PipelineStage("link", prepare_link, args.link_workers, queue_size, on_error)
+    validations = PipelineStage("validate", validate, args.validate_workers, queue_size, on_error)
+    stages = (portal, links, validations)
+    for stage in stages:
+        stage.start()
+
+    in_flight = 0
+    last_progress = time.monotonic()
+    try:
+        while True:
+            while True:
+                job = scheduler.next_job()
+                if job is None:
+                    break
+                logging.debug(f"{Fore.CYAN}START {job.url} {job.mac_item.mac} (id={job.mac_item.id}, failed={job.mac_item.failed})")
+                portal.put(MAC_PipelineCheck(job))
+                in_flight += 1
+            if not in_flight:
+                delay = scheduler.wait_seconds()
+                if delay is None:
+                    break
+                # only MACs of hosts in their cool-down are left
+                time.sleep(delay)
+                continue
+
+            try:
+                check = finished.get(timeout=1)
+            except queue.Empty:
+                check = None
+            if check is not None:
+                in_flight -= 1
+                scheduler.complete(check.job, check.result())
+
+            if time.monotonic() - last_progress >= Settings.PIPELINE_PROGRESS_SECONDS:
+                last_progress = time.monotonic()
+                logging.info(f"{Fore.WHITE}Pipeline: " + "; ".join(stage.status() for stage in stages) + f"; MACs in flight: {in_flight}")
+    finally:
+        for stage in stages:
+            stage.stop()
+        if validation_pool is not None:
+            validation_pool.shutdown()
+
+    logging.info(f"{Fore.WHITE}Pipeline max queue depth: " + ", ".join(f"{stage.name}={stage.max_depth}" for stage in stages))
 
-    return success, success_message, is_german, is_adult
 
 
 def normalize_status(status_value):
@@ -104,14 +459,26 @@ def log_run_settings(args, skip_statuses):
     logging.info("Run settings:")
     logging.info(f"  url filter: {args.url if args.url else 'ALL'}")
     logging.info(f"  process all MACs: {args.process_all}")
+    logging.info(f"  engine: {args.engine}")
     logging.info(f"  workers: {max(1, args.workers)}")
+    logging.info(f"  host workers: {max(1, args.host_workers)}")
     logging.info(f"  vlc workers: {max(1, args.vlc_workers)}")
+    if args.engine == 'pipeline':
+        logging.info(f"  pipeline workers: portal {max(1, args.portal_workers)}, link {max(1, args.link_workers)}, validate {max(1, args.validate_workers)} ({'processes' if args.validate_processes else 'threads'})")
+    logging.info(f"  priority order: {Settings.PRIORITY_ENABLED}, time budget: {f'{args.budget_minutes} minutes' if args.budget_minutes else 'none'}")
     logging.info(f"  skip existing statuses: {', '.join(sorted(skip_statuses)) if skip_statuses else 'none'}")
     logging.info(f"  db path: {Settings.DB_PATH}")
     logging.info(f"  max failed status attempts: {Settings.MAX_FAILED_STATUS_ATTEMPTS}")
     logging.info(f"  vlc semaphore timeout seconds: {Settings.VLC_SEMAPHORE_TIMEOUT_SECONDS}")
     logging.info(f"  vlc playback check attempts: {Settings.VLC_PLAYBACK_CHECK_ATTEMPTS}")
     logging.info(f"  vlc playback check interval seconds: {Settings.VLC_PLAYBACK_CHECK_INTERVAL_SECONDS}")
+    logging.info(f"  portal cache: {Settings.PORTAL_CACHE_ENABLED} (ttl seconds: {Settings.PORTAL_CACHE_TTL_SECONDS}, fingerprint: {Settings.PORTAL_CACHE_FINGERPRINT})")
+    logging.info(f"  stream cache: {Settings.STREAM_CACHE_ENABLED} (ttl seconds: {Settings.STREAM_CACHE_TTL_SECONDS}, failures: {Settings.STREAM_CACHE_FAILURE_TTL_SECONDS}, persisted: {Settings.STREAM_CACHE_PERSIST})")
+    logging.info(f"  channel pages: sample {Settings.CHANNEL_SAMPLE_PAGES} random pages (0 = all), {Settings.CHANNEL_PAGE_WORKERS} parallel requests")
+    logging.info(f"  adaptive timeouts: {Settings.HOST_TIMEOUT_ADAPTIVE} (read {Settings.HOST_TIMEOUT_FACTOR} x p95 in {Settings.HOST_TIMEOUT_MIN_SECONDS}-{Settings.HOST_TIMEOUT_MAX_SECONDS}s, connect {Settings.HOST_CONNECT_TIMEOUT_FACTOR} x ewma in {Settings.HOST_CONNECT_TIMEOUT_MIN_SECONDS}-{Settings.HOST_CONNECT_TIMEOUT_MAX_SECONDS}s)")
+    logging.info(f"  circuit breaker: {Settings.CIRCUIT_BREAKER_ENABLED} (unreachable: {Settings.CIRCUIT_BREAKER_FAILURES}, same login errors: {Settings.CIRCUIT_BREAKER_SAME_ERRORS}, cool-down seconds: {Settings.CIRCUIT_BREAKER_COOLDOWN_SECONDS})")
+    logging.info(f"  fast login: {Settings.LOGIN_FAST_MODE}, reuse stored tokens: {Settings.TOKEN_REUSE_ENABLED} (max age seconds: {Settings.TOKEN_MAX_AGE_SECONDS})")
+    logging.info(f"  stream probe: {Settings.STREAM_PROBE_ENABLED} (max bytes: {Settings.STREAM_PROBE_MAX_BYTES}, timeout seconds: {Settings.STREAM_PROBE_TIMEOUT_SECONDS})")
     logging.info(f"  verbose subprocess output: {Settings.VERBOSE_SUBPROCESS_OUTPUT}")
     logging.info(f"  log level: {logging.getLevelName(Settings.LOG_LEVEL)}")
     logging.info(f"  log format: {Settings.LOG_FORMAT}")
@@ -126,10 +493,19 @@ def main():
     parser.add_argument('--url', type=str, help='Optional URL to check MACs for. If not provided, all URLs will be processed.')
     parser.add_argument('--process-all', action='store_true', help='Process all MACs regardless of finding a working one. By default, remaining MACs are skipped after finding a working MAC.')
     parser.add_argument('--workers', type=int, default=10, help='Number of parallel workers for MAC checks (default: 10).')
+    parser.add_argument('--host-workers', type=int, default=3, help='Maximum number of parallel MAC checks against the same host (default: 3). --workers is the global cap over all URLs.')
+    parser.add_argument('--engine', choices=['threads', 'asyncio', 'pipeline'], default='threads', help='Check engine: one thread per MAC (threads), coroutines on one event loop (asyncio) or stages with their own workers for portal requests, stream links and validation (pipeline). The asyncio engine can keep thousands of MACs in flight, e.g. --workers 1000 (default: threads).')
+    parser.add_argument('--portal-workers', type=int, default=10, help='pipeline engine: threads for login, genres and channel lists (default: 10).')
+    parser.add_argument('--link-workers', type=int, default=10, help='pipeline engine: threads for stream links and real stream URLs (default: 10).')
+    parser.add_argument('--validate-workers', type=int, default=4, help='pipeline engine: parallel stream validations (probe and VLC, default: 4). VLC itself is still limited by --vlc-workers.')
+    parser.add_argument('--validate-processes', action='store_true', help='pipeline engine: validate in a pool of --validate-workers processes with one VLC player each instead of threads.')
     parser.add_argument('--vlc-workers', type=int, default=Settings.VLC_MAX_PARALLEL, help=f'Number of parallel VLC stream validations (default: {Settings.VLC_MAX_PARALLEL}).')
     parser.add_argument('--skip-login', action='store_true', help='Skip MACs already marked with status LOGIN.')
     parser.add_argument('--skip-error', action='store_true', help='Skip MACs already marked with status ERROR.')
     parser.add_argument('--skip-content', action='store_true', help='Skip MACs already marked with status CONTENT.')
+    parser.add_argument('--budget-minutes', type=float, help='Optional time budget of the run: the most valuable MACs are checked first and no further check is started when the budget is used up.')
+    parser.add_argument('--resume', action='store_true', help='Continue the newest unfinished run: MACs it already checked are not checked again.')
+    parser.add_argument('--stats-json', type=str, help='Optional file to write the run statistics (status counts, counters, phase timings) to as JSON.')
     args = parser.parse_args()
 
     configure_vlc_parallel(args.vlc_workers)
@@ -145,6 +521,8 @@ def main():
     if skip_statuses:
         logging.info(f"Skipping MACs with existing status: {', '.join(sorted(skip_statuses))}")
 
+    # optional local working copy of the database, written back in snapshots
+    use_local_copy()
     log_run_settings(args, skip_statuses)
 
     # Remember start time
@@ -168,153 +546,152 @@ def main():
         else:
             urls = db.get_all_urls()
 
-        # Iterate through each URL and fetch its MACs
+        if Settings.PRIORITY_ENABLED:
+            # most valuable portals first - stale data, working MACs and a good portal history
+            url_history = db.get_url_history()
+            urls = sorted(urls, key=lambda url: url_priority(url_history.get(url)), reverse=True)
+
+        if Settings.HOST_TIMEOUT_ADAPTIVE:
+            host_latency.load(db.get_host_latencies())
+
+        if Settings.STREAM_CACHE_ENABLED and Settings.STREAM_CACHE_PERSIST:
+            loaded = stream_cache.load(db.iter_recent_working_streams(Settings.STREAM_CACHE_TTL_SECONDS))
+            logging.info(f"Stream cache: {loaded} working streams of earlier runs loaded")
+
+        # run journal: every MAC result is recorded with the run id, so an interrupted run can be resumed
+        run = db.get_unfinished_run() if args.resume else None
+        if run is not None:
+            run_id = run.id
+            run_macs = db.get_run_macs(run_id)
+            logging.info(f"Resuming run {run_id} started at {run.started} with {len(run_macs)} MACs already done (parameters: {run.parameters})")
+        else:
+            if args.resume:
+                logging.info("No unfinished run to resume, starting a new run")
+            run_id = db.start_run(json.dumps({name: value for name, value in vars(args).items() if name != 'resume'}, sort_keys=True))
+            run_macs = {}
+        logging.info(f"Run id: {run_id}")
+
         total_urls = len(urls)
-        global_status_counts = {
-            STATUS.SUCCESS.value: 0,
-            STATUS.LOGIN.value: 0,
-            STATUS.ERROR.value: 0,
-            STATUS.CONTENT.value: 0,
-            STATUS.SKIPPED.value: 0,
-        }
+        finished_urls = 0
         logging.info(f"Found {total_urls} URLs to process.")
-        for urlCounter, url in enumerate(urls, start=1):
+
+        def load_task(urlCounter, url):
             URLPREFIX = f"URL[{urlCounter}/{total_urls}]"
             url_progress_percent = (urlCounter / total_urls) * 100 if total_urls else 100
-            success = None
-            status_counts = {
-                STATUS.SUCCESS.value: 0,
-                STATUS.LOGIN.value: 0,
-                STATUS.ERROR.value: 0,
-                STATUS.CONTENT.value: 0,
-                STATUS.SKIPPED.value: 0,
-            }
             logging.info(f"{Fore.CYAN}{URLPREFIX} ------------------------------------------------------------------------")
             logging.info(f"{Fore.CYAN}{URLPREFIX} ({url_progress_percent:.0f}%) {url}")
-            
 
-            # First check the newest working MAC for the URL
+            # First check the newest working MAC for the URL, the remaining MACs wait for its result
+            known_mac = None
             mac_id = db.get_newest_working_mac_for_url(url)
             if mac_id:
-                mac = db.get_mac_by_id(mac_id).mac
-                logging.debug(f"{Fore.YELLOW}{URLPREFIX}Known good MAC check: {mac}")
-                success, success_message, is_german, is_adult = process_mac(db, url, mac)
-                logging.debug(f"{Fore.YELLOW}{URLPREFIX}Known good MAC result: {success}")
-                db.update_mac_status(mac_id, success, success_message, is_german, is_adult)
-                if success == STATUS.SUCCESS:
-                    logging.info(f"{Fore.GREEN}{URLPREFIX} Known good MAC result: {success} - {success_message}")
-                else:
-                    logging.info(f"{Fore.RED}{URLPREFIX} Known good MAC result: {success} - {success_message}")
-
-                # Processing the remaining MACs
+                known_mac = db.get_mac_by_id(mac_id)
+                logging.debug(f"{Fore.YELLOW}{URLPREFIX}Known good MAC check: {known_mac.mac}")
                 macs = db.get_all_other_macs_by_url(url, mac_id)
             else:
                 macs = db.get_all_macs_by_url(url)
 
+            # resumed run: MACs with a result in the journal are done, unreachable ones are checked again
+            url_success = False
+            if run_macs:
+                url_success = any(run_macs.get(macItem.id) == STATUS.SUCCESS.value for macItem in macs + ([known_mac] if known_mac else []))
+                done = {done_id for done_id, done_status in run_macs.items() if done_status != STATUS.UNREACHABLE.value}
+                if known_mac is not None and known_mac.id in done:
+                    known_mac = None
+                original_count = len(macs)
+                macs = [macItem for macItem in macs if macItem.id not in done]
+                if original_count - len(macs):
+                    logging.info(f"{Fore.YELLOW}{URLPREFIX} already done in run {run_id}: {original_count - len(macs)}")
+
+            if Settings.PRIORITY_ENABLED:
+                macs.sort(key=mac_priority, reverse=True)
+
             if skip_statuses:
                 original_count = len(macs)
-                new_macs = []
-                for macItem in macs:
-                    if normalize_status(macItem.status) not in skip_statuses:
-                        new_macs.append(macItem)
-                    
-                macs = new_macs
+                macs = [macItem for macItem in macs if normalize_status(macItem.status) not in skip_statuses]
                 filtered_out_count = original_count - len(macs)
                 if filtered_out_count:
                     logging.info(
                         f"{Fore.YELLOW}{URLPREFIX} skipped by status filter: {filtered_out_count}"
                     )
-            	
-            total_macs = len(macs)
-            logging.info(f"{Fore.WHITE}{URLPREFIX} MACs to check: {total_macs}, workers: {max(1, args.workers)}")
-
-            if success == STATUS.SUCCESS and not args.process_all:
-                for macCounter, macItem in enumerate(macs, start=1):
-                    MACPREFIX = f"{URLPREFIX} MAC[{macCounter}/{total_macs}]"
-                    mac_progress_percent = (macCounter / total_macs) * 100 if total_macs else 100
-                    logging.info(f"{Fore.YELLOW}{MACPREFIX} ({mac_progress_percent:.0f}%) SKIP (already working): {macItem.mac}")
-                    status_counts[STATUS.SKIPPED.value] += 1
-                    db.update_mac_status(macItem.id, STATUS.SKIPPED, "")
-            else:
-                max_workers = max(1, args.workers)
-                available_workers = deque(range(1, max_workers + 1))
-                mac_entries = list(enumerate(macs, start=1))
-                mac_iter = iter(mac_entries)
-                futures = {}
-                stop_submitting = False
-                completed_macs = 0
-
-                def submit_next():
-                    try:
-                        macCounter, macItem = next(mac_iter)
-                    except StopIteration:
-                        return False
-
-                    if not available_workers:
-                        return False
-
-                    worker_id = available_workers.popleft()
-                    MACPREFIX = f"{URLPREFIX} MAC[{macCounter}/{total_macs}]"
-                    logging.debug(f"{Fore.CYAN}W{worker_id} START {url} {macItem.mac} (id={macItem.id}, failed={macItem.failed})")
-                    future = executor.submit(process_mac, db, url, macItem.mac)
-                    futures[future] = (macCounter, macItem, MACPREFIX, worker_id)
-                    return True
-
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    while len(futures) < max_workers and submit_next():
-                        pass
-
-                    while futures:
-                        for future in as_completed(list(futures.keys())):
-                            macCounter, macItem, MACPREFIX, worker_id = futures.pop(future)
-                            try:
-                                result_success, success_message, is_german, is_adult = future.result()
-                            except Exception as exc:
-                                result_success = STATUS.ERROR
-                                success_message = f"Unhandled error: {exc}"
-                                is_german = None
-                                is_adult = None
-
-                            if result_success == STATUS.SUCCESS:
-                                success = STATUS.SUCCESS
-                                if not args.process_all:
-                                    stop_submitting = True
-
-                            completed_macs += 1
-                            mac_progress_percent = (completed_macs / total_macs) * 100 if total_macs else 100
-                            color = Fore.GREEN if result_success == STATUS.SUCCESS else (Fore.YELLOW if result_success == STATUS.SKIPPED else Fore.RED)
-                            logging.info(f"{color}{MACPREFIX} ({completed_macs}/{total_macs}, {mac_progress_percent:.0f}%) -> {result_success} - {success_message}")
-                            result_key = normalize_status(result_success)
-                            if result_key in status_counts:
-                                status_counts[result_key] += 1
-                            db.update_mac_status(macItem.id, result_success, success_message, is_german, is_adult)
-                            available_workers.append(worker_id)
-
-                            if not stop_submitting:
-                                submit_next()
-
-                if stop_submitting and not args.process_all:
-                    for macCounter, macItem in mac_iter:
-                        completed_macs += 1
-                        MACPREFIX = f"{URLPREFIX} MAC[{macCounter}/{total_macs}]"
-                        mac_progress_percent = (completed_macs / total_macs) * 100 if total_macs else 100
-                        logging.info(f"{Fore.YELLOW}{MACPREFIX} ({completed_macs}/{total_macs}, {mac_progress_percent:.0f}%) SKIP (already working): {macItem.mac}")
-                        status_counts[STATUS.SKIPPED.value] += 1
-                        db.update_mac_status(macItem.id, STATUS.SKIPPED, "")
 
+            logging.info(f"{Fore.WHITE}{URLPREFIX} MACs to check: {len(macs)}, workers: {max(1, args.workers)}, host workers: {max(1, args.host_workers)}")
+            task = URL_Task(urlCounter, total_urls, url, known_mac, macs)
+            task.channel_health = ChannelHealth(db.get_channel_health_by_url(url))
+            if url_success:
+                task.success = STATUS.SUCCESS
+            return task
+
+        def on_result(job, result):
+            result_success, success_message, is_german, is_adult = result
+            task = job.task
+            if job.known_good:
+                logging.debug(f"{Fore.YELLOW}{job.prefix}Known good MAC result: {result_success}")
+                color = Fore.GREEN if result_success == STATUS.SUCCESS else Fore.RED
+                logging.info(f"{color}{job.prefix} Known good MAC result: {result_success} - {success_message}")
+            else:
+                mac_progress_percent = (task.completed / task.total_macs) * 100 if task.total_macs else 100
+                color = Fore.GREEN if result_success == STATUS.SUCCESS else (Fore.YELLOW if result_success in (STATUS.SKIPPED, STATUS.UNREACHABLE) else Fore.RED)
+                logging.info(f"{color}{job.prefix} ({task.completed}/{task.total_macs}, {mac_progress_percent:.0f}%) -> {result_success} - {success_message}")
+            db.queue_mac_status(job.mac_item.id, result_success, success_message, is_german, is_adult)
+            db.queue_run_mac(run_id, job.mac_item.id, result_success, job.known_good)
+
+        def on_skipped(job):
+            task = job.task
+            mac_progress_percent = (task.completed / task.total_macs) * 100 if task.total_macs else 100
+            logging.info(f"{Fore.YELLOW}{job.prefix} ({task.completed}/{task.total_macs}, {mac_progress_percent:.0f}%) SKIP (already working): {job.mac_item.mac}")
+            db.queue_mac_status(job.mac_item.id, STATUS.SKIPPED, "")
+            db.queue_run_mac(run_id, job.mac_item.id, STATUS.SKIPPED)
+
+        def on_finished(task):
+            nonlocal finished_urls
+            finished_urls += 1
+            status_counts = task.status_counts
             total_counted = sum(status_counts.values())
-            for state, count in status_counts.items():
-                global_status_counts[state] += count
             logging.info(
-                f"{Fore.WHITE}{URLPREFIX} summary: "
+                f"{Fore.WHITE}{task.prefix} summary ({finished_urls}/{total_urls} URLs done): "
                 f"success={status_counts[STATUS.SUCCESS.value]}, "
                 f"login={status_counts[STATUS.LOGIN.value]}, "
                 f"error={status_counts[STATUS.ERROR.value]}, "
                 f"content={status_counts[STATUS.CONTENT.value]}, "
                 f"skipped={status_counts[STATUS.SKIPPED.value]}, "
+                f"unreachable={status_counts[STATUS.UNREACHABLE.value]}, "
                 f"total={total_counted}"
             )
 
+        scheduler = MAC_Scheduler(
+            urls,
+            load_task,
+            max_workers=args.workers,
+            max_per_host=args.host_workers,
+            process_all=args.process_all,
+            on_result=on_result,
+            on_skipped=on_skipped,
+            on_finished=on_finished,
+            deadline=time.monotonic() + args.budget_minutes * 60 if args.budget_minutes else None,
+        )
+        if args.engine == 'asyncio':
+            asyncio.run(run_async(scheduler, db))
+        elif args.engine == 'pipeline':
+            run_pipeline(scheduler, db, args)
+        else:
+            run_threaded(scheduler, db)
+
+        # the next run starts with the timeouts learned in this one
+        db.save_host_latencies(host_latency.rows())
+
+        # the global summary comes from the journal, so it covers all parts of a resumed run
+        global_status_counts = {state.value: 0 for state in STATUS}
+        global_status_counts.update(db.get_run_status_counts(run_id))
+        if scheduler.budget_exhausted:
+            # the run stays unfinished, --resume continues it
+            logging.info(
+                f"{Fore.YELLOW}Time budget of {args.budget_minutes} minutes used up: "
+                f"{scheduler.pending_macs()} MACs of started URLs and {len(scheduler.urls)} URLs left for --resume"
+            )
+        else:
+            db.finish_run(run_id)
+
     # Calculate and log the total time taken
     end_time = time.time()
     total_time = end_time - start_time
@@ -331,8 +708,50 @@ def main():
         f"error={global_status_counts[STATUS.ERROR.value]}, "
         f"content={global_status_counts[STATUS.CONTENT.value]}, "
         f"skipped={global_status_counts[STATUS.SKIPPED.value]}, "
+        f"unreachable={global_status_counts[STATUS.UNREACHABLE.value]}, "
         f"total={global_total_counted}"
     )
+    logging.info(
+        f"{Fore.WHITE}Validation decided by: "
+        f"probe={run_stats.get('validation_probe')}, "
+        f"vlc={run_stats.get('validation_vlc')}"
+    )
+    logging.info(
+        f"{Fore.WHITE}Portal listing cache: "
+        f"hits={run_stats.get('portal_cache_hit')}, "
+        f"misses={run_stats.get('portal_cache_miss')}, "
+        f"channel pages loaded={run_stats.get('channel_pages')}"
+    )
+    logging.info(
+        f"{Fore.WHITE}Stream cache: "
+        f"hits={run_stats.get('stream_cache_hit')} "
+        f"(create_link saved={run_stats.get('stream_link_hit')}), "
+        f"misses={run_stats.get('stream_cache_miss')}"
+    )
+    logging.info(
+        f"{Fore.WHITE}Logins: "
+        f"stored token={run_stats.get('login_token_reused')}, "
+        f"fast={run_stats.get('login_fast')}, "
+        f"full={run_stats.get('login_full')}, "
+        f"renewed={run_stats.get('login_renewed')}"
+    )
+    for phase in PHASES + QUEUE_WAITS:
+        summary = run_stats.timing_summary(phase)
+        if summary["count"]:
+            logging.info(
+                f"{Fore.WHITE}Phase {phase}: "
+                f"count={summary['count']}, "
+                f"p50={summary['p50']:.3f}s, "
+                f"p95={summary['p95']:.3f}s"
+            )
+    if args.stats_json:
+        with open(args.stats_json, "w", encoding="utf-8") as stats_file:
+            json.dump({
+                "elapsed_seconds": total_time,
+                "status_counts": global_status_counts,
+                **run_stats.as_dict(),
+            }, stats_file, indent=2)
+        logging.info(f"Run statistics written to: {args.stats_json}")
     logging.info(f"Started at: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))}")
     logging.info(f"Finished at: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(end_time))}")
     logging.info(f"Total time taken: {int(hours)} hours, {int(minutes)} minutes, {int(seconds)} seconds")
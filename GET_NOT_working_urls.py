@@ -3,24 +3,23 @@ from Library.Sqllite import IPTV_Database
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-db = IPTV_Database()
+db = IPTV_Database(read_only=True)
 
 logging.info("Fetching not working URLs from the database...")
 logging.info("------------------------------------------------")
 
-not_working_macs = db.get_urls_without_working_mac()
-
 # Print table header
 logging.info('URL')
 logging.info('-----------------------------------------------------------')
 
 # Print each row
-for url in not_working_macs:
+not_working_count = 0
+for url in db.iter_urls_without_working_mac():
     logging.info(f"{url}")
+    not_working_count += 1
 
 # Get amount of working compared to toal URLs in the database
-all_urls = db.get_all_urls()
 logging.info('-----------------------------------------------------------')
-logging.info(f"{len(not_working_macs)} NOT working URLs of total {len(all_urls)} in the database.")
+logging.info(f"{not_working_count} NOT working URLs of total {db.get_url_count()} in the database.")
 
 db.close()
\ No newline at end of file
@@ -9,7 +9,7 @@ from Library.Sqllite import IPTV_Database
 logging.basicConfig(level=logging.INFO, handlers=[logging.FileHandler("working_macs.log", mode='w'), logging.StreamHandler()])
 
 
-db = IPTV_Database()
+db = IPTV_Database(read_only=True)
 
 # Create table header
 header = f"{'URL':60} | {'MAC':17} | {'Expiration':12} | {'German':6} | {'Adult':5} | {'Last Update':19}"
@@ -18,18 +18,17 @@ logging.info("")
 logging.info('#' * len(header))
 logging.info("")
 
-working_macs = db.get_url_and_newest_working_mac()
-
 logging.info(header)
 logging.info('-' * len(header))
 
 # Print each row
-for url, mac, expiration, german, adult, last_updated in working_macs:
+working_count = 0
+for url, mac, expiration, german, adult, last_updated in db.iter_url_and_newest_working_mac():
     logging.info(f"{url[:60]:60} | {mac:17} | {str(expiration):12} | {str(german):6} | {str(adult):5} | {str(last_updated):19}")
+    working_count += 1
 
 # Get amount of working compared to toal URLs in the database
-all_urls = db.get_all_urls()
 logging.info('-' * len(header))
-logging.info(f"{len(working_macs)} working URLs of total {len(all_urls)} in the database.")
+logging.info(f"{working_count} working URLs of total {db.get_url_count()} in the database.")
 
 db.close()
\ No newline at end of file
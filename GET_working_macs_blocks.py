@@ -29,7 +29,7 @@ def main():
     if args.show_skipped:
         excluded_statuses.discard('SKIPPED')
 
-    db = IPTV_Database()
+    db = IPTV_Database(read_only=True)
 
     logging.info("")
     logging.info("=" * 80)
@@ -41,10 +41,10 @@ def main():
         logging.info(f"Filtering out MAC output with status: {', '.join(sorted(excluded_statuses))}")
         logging.info("")
 
-    working_macs = db.get_url_and_newest_working_mac()
-
     # Print each entry as a block
-    for index, (url, mac, expiration, german, adult, last_updated) in enumerate(working_macs, 1):
+    working_count = 0
+    for index, (url, mac, expiration, german, adult, last_updated) in enumerate(db.iter_url_and_newest_working_mac(), 1):
+        working_count = index
         logging.info(f"Entry #{index}")
         logging.info("-" * 80)
         logging.info(f"URL:        {url}")
@@ -58,7 +58,7 @@ def main():
         logging.info("All working MACs for this URL:")
 
         visible_count = 0
-        for mac_entry in db.get_all_macs_by_url(url):
+        for mac_entry in db.iter_all_macs_by_url(url):
             status = normalize_status(mac_entry[3])
             if status in excluded_statuses:
                 continue
@@ -70,14 +70,14 @@ def main():
         logging.info("")
 
     # Get amount of working compared to total URLs in the database
-    all_urls = db.get_all_urls()
+    url_count = db.get_url_count()
     logging.info("")
     logging.info("=" * 80)
     logging.info("SUMMARY")
     logging.info("=" * 80)
-    logging.info(f"Working URLs: {len(working_macs)}")
-    logging.info(f"Total URLs:   {len(all_urls)}")
-    success_rate = (len(working_macs) / len(all_urls) * 100) if all_urls else 0
+    logging.info(f"Working URLs: {working_count}")
+    logging.info(f"Total URLs:   {url_count}")
+    success_rate = (working_count / url_count * 100) if url_count else 0
     logging.info(f"Success Rate: {success_rate:.2f}%")
     logging.info("=" * 80)
 
@@ -9,15 +9,94 @@ class STATUS(Enum):
     ERROR = "ERROR"
     CONTENT = "CONTENT"
     SKIPPED = "SKIPPED"
+    UNREACHABLE = "UNREACHABLE"
 
 class Settings:
     SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-    DB_PATH = "C:\\Users\\ahage\\OneDrive\\Sicherung\\IPTV.db"
+    # IPTV_DB_PATH points a run at another database, e.g. the throwaway one of BENCH_check_macs.py
+    DB_PATH = os.environ.get("IPTV_DB_PATH", "C:\\Users\\ahage\\OneDrive\\Sicherung\\IPTV.db")
     MAX_FAILED_STATUS_ATTEMPTS = 3
+    DB_WRITE_BATCH_SIZE = 200
+    DB_WRITE_FLUSH_INTERVAL_MS = 2000
+    # a locked batch is retried DB_WRITE_RETRIES times, the delay doubles from DB_WRITE_RETRY_DELAY_MS
+    DB_WRITE_RETRIES = 5
+    DB_WRITE_RETRY_DELAY_MS = 200
+    DB_JOURNAL_MODE = "WAL"
+    DB_SYNCHRONOUS = "NORMAL"
+    DB_BUSY_TIMEOUT_MS = 10000
+    DB_FETCH_SIZE = 500
+    # checker and scrapers work on a local copy of DB_PATH that is written back every
+    # DB_SNAPSHOT_INTERVAL_SECONDS and at exit, see Library/db_sync.py
+    DB_LOCAL_COPY_ENABLED = os.environ.get("IPTV_DB_LOCAL_COPY", "0") == "1"
+    DB_LOCAL_COPY_PATH = os.environ.get("IPTV_DB_LOCAL_PATH", os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "IPTV", "IPTV.db"))
+    DB_SNAPSHOT_INTERVAL_SECONDS = 300
+    # MAINTAIN_db.py moves dead MACs - failed MAX_FAILED_STATUS_ATTEMPTS times and not checked for
+    # DB_ARCHIVE_FAILED_DAYS, or expired DB_ARCHIVE_EXPIRED_DAYS ago - to DB_ARCHIVE_PATH
+    # (empty: IPTV_archive.db next to DB_PATH) and vacuums above DB_VACUUM_FREE_PERCENT free pages
+    DB_ARCHIVE_PATH = os.environ.get("IPTV_DB_ARCHIVE_PATH", "")
+    DB_ARCHIVE_FAILED_DAYS = 30
+    DB_ARCHIVE_EXPIRED_DAYS = 30
+    DB_PRUNE_RUNS_DAYS = 30
+    DB_VACUUM_FREE_PERCENT = 10
     VLC_MAX_PARALLEL = 1
     VLC_SEMAPHORE_TIMEOUT_SECONDS = 60
     VLC_PLAYBACK_CHECK_ATTEMPTS = 8
     VLC_PLAYBACK_CHECK_INTERVAL_SECONDS = 1
+    STREAM_PROBE_ENABLED = True
+    STREAM_PROBE_MAX_BYTES = 256 * 1024
+    STREAM_PROBE_TIMEOUT_SECONDS = 8
+    PORTAL_CACHE_ENABLED = True
+    PORTAL_CACHE_TTL_SECONDS = 1800
+    PORTAL_CACHE_FINGERPRINT = False
+    STREAM_RESOLVE_TIMEOUT_SECONDS = 5
+    STREAM_RESOLVE_MAX_REDIRECTS = 5
+    STREAM_RESOLVE_MAX_BODY_BYTES = 8 * 1024
+    STREAM_RESOLVE_CACHE_TTL_SECONDS = 300
+    STREAM_RESOLVE_CACHE_PER_HOST = 256
+    STREAM_CACHE_ENABLED = True
+    STREAM_CACHE_TTL_SECONDS = 600
+    STREAM_CACHE_FAILURE_TTL_SECONDS = 120
+    STREAM_CACHE_PERSIST = True
+    CHANNEL_PAGE_WORKERS = 4
+    CHANNEL_SAMPLE_PAGES = 2
+    CHANNEL_HEALTH_RECENT_HOURS = 48
+    CHANNEL_HEALTH_RECENT_WEIGHT = 20
+    HOST_TIMEOUT_ADAPTIVE = True
+    HOST_TIMEOUT_FACTOR = 3
+    HOST_TIMEOUT_MIN_SECONDS = 3
+    # the ceilings never exceed the fixed timeouts of the requests (15s get_token, 10s else)
+    HOST_TIMEOUT_MAX_SECONDS = 15
+    HOST_CONNECT_TIMEOUT_FACTOR = 3
+    HOST_CONNECT_TIMEOUT_MIN_SECONDS = 2
+    HOST_CONNECT_TIMEOUT_MAX_SECONDS = 10
+    HOST_LATENCY_ALPHA = 0.2
+    HOST_LATENCY_WINDOW = 50
+    HOST_LATENCY_MIN_SAMPLES = 5
+    CIRCUIT_BREAKER_ENABLED = True
+    CIRCUIT_BREAKER_FAILURES = 3
+    CIRCUIT_BREAKER_SAME_ERRORS = 5
+    CIRCUIT_BREAKER_COOLDOWN_SECONDS = 300
+    PRIORITY_ENABLED = True
+    PRIORITY_STALE_HOURS = 7 * 24
+    PRIORITY_WEIGHT_STALENESS = 4.0
+    PRIORITY_WEIGHT_STATUS = 3.0
+    PRIORITY_WEIGHT_FAILED = 2.0
+    PRIORITY_WEIGHT_EXPIRATION = 1.0
+    PRIORITY_WEIGHT_PORTAL = 2.0
+    QUEUE_LEASE_SECONDS = 120
+    QUEUE_HEARTBEAT_SECONDS = 30
+    QUEUE_POLL_SECONDS = 2
+    QUEUE_PROGRESS_SECONDS = 30
+    QUEUE_MAX_ATTEMPTS = 3
+    QUEUE_MAX_LEASES_PER_URL = 3
+    QUEUE_SERVICE_PORT = 8765
+    QUEUE_SERVICE_TOKEN = os.environ.get("IPTV_QUEUE_TOKEN", "")
+    QUEUE_SERVICE_TIMEOUT_SECONDS = 30
+    QUEUE_SERVICE_RETRIES = 5
+    PIPELINE_PROGRESS_SECONDS = 30
+    LOGIN_FAST_MODE = True
+    TOKEN_REUSE_ENABLED = True
+    TOKEN_MAX_AGE_SECONDS = 3600
 
     LOG_LEVEL = logging.INFO
     LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
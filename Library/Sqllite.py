@@ -1,32 +1,411 @@
+import atexit
+import logging
+import queue
 import sqlite3
+import threading
+import time
+import uuid
 from collections import namedtuple
-from datetime import datetime
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from functools import lru_cache
+from urllib.request import pathname2url
 
 from Library.Settings import STATUS, Settings
+from Library.migrations import MIGRATIONS, migrate, schema_version
+from Library.stream_cache import stream_key
+
+
+# one row class per column list - namedtuple() builds a new class, so it must not run per row
+@lru_cache(maxsize=256)
+def _row_class(fields):
+    return namedtuple('Row', fields)
+
+
+def connect_database(path, read_only=False):
+    if read_only:
+        conn = sqlite3.connect(f"file:{pathname2url(path)}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute(f"PRAGMA busy_timeout = {int(Settings.DB_BUSY_TIMEOUT_MS)}")
+    if not read_only:
+        # WAL lets readers and the writer work at the same time - the mode is stored in the file
+        conn.execute(f"PRAGMA journal_mode = {Settings.DB_JOURNAL_MODE}")
+        conn.execute(f"PRAGMA synchronous = {Settings.DB_SYNCHRONOUS}")
+    return conn
+
+
+
+# single thread owning the write connection: synchronous writes (execute) and write-behind rows
+# (queue_rows) flushed every DB_WRITE_BATCH_SIZE rows or DB_WRITE_FLUSH_INTERVAL_MS
+class DB_Writer(threading.Thread):
+    _STOP = object()
+
+    def __init__(self, path):
+        super().__init__(name="IPTV_DB_Writer", daemon=True)
+        self.path = path
+        self._queue = queue.Queue()
+        self._ready = threading.Event()
+        self._error = None
+        # set when queued rows could not be written - the run must not go on as if they were
+        self._write_error = None
+        self.start()
+        self._ready.wait()
+        if self._error:
+            raise self._error
+
+    def execute(self, func):
+        # run func(conn) inside one transaction on the writer thread and return its result
+        future = Future()
+        self._queue.put(("execute", func, future))
+        return future.result()
+
+    def queue_rows(self, sql, rows):
+        self.raise_write_error()
+        self._queue.put(("rows", sql, rows))
+
+    def flush(self):
+        future = Future()
+        self._queue.put(("flush", None, future))
+        future.result()
+        self.raise_write_error()
+
+    def close(self):
+        if self.is_alive():
+            self._queue.put((self._STOP, None, None))
+            self.join()
+        self.raise_write_error()
+
+    def raise_write_error(self):
+        if self._write_error is not None:
+            raise self._write_error
+
+    @staticmethod
+    def is_busy_error(error):
+        # locked or busy beyond busy_timeout, e.g. while a sync client holds the file
+        return isinstance(error, sqlite3.OperationalError) and ("locked" in str(error) or "busy" in str(error))
+
+    def run(self):
+        try:
+            conn = connect_database(self.path)
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+
+        pending = {}
+        pending_count = 0
+        pending_since = None
+
+        def flush_pending():
+            nonlocal pending_count, pending_since
+            if not pending_count:
+                return
+            for attempt in range(Settings.DB_WRITE_RETRIES + 1):
+                try:
+                    with conn:
+                        for sql, rows in pending.items():
+                            conn.executemany(sql, rows)
+                    break
+                except Exception as e:
+                    if self.is_busy_error(e) and attempt < Settings.DB_WRITE_RETRIES:
+                        delay = Settings.DB_WRITE_RETRY_DELAY_MS / 1000 * 2 ** attempt
+                        logging.warning(f"Writing {pending_count} queued database rows failed: {e} - retry in {delay:.1f}s")
+                        time.sleep(delay)
+                        continue
+                    logging.error(f"Writing {pending_count} queued database rows failed: {e}")
+                    self._write_error = sqlite3.OperationalError(f"{pending_count} queued database rows could not be written: {e}")
+                    break
+            pending.clear()
+            pending_count = 0
+            pending_since = None
+
+        try:
+            while True:
+                timeout = None
+                if pending_since is not None:
+                    timeout = max(0, pending_since + Settings.DB_WRITE_FLUSH_INTERVAL_MS / 1000 - time.monotonic())
+                try:
+                    kind, payload, extra = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    flush_pending()
+                    continue
+
+                if kind is self._STOP:
+                    flush_pending()
+                    break
+                elif kind == "rows":
+                    if pending_since is None:
+                        pending_since = time.monotonic()
+                    pending.setdefault(payload, []).extend(extra)
+                    pending_count += len(extra)
+                    if pending_count >= Settings.DB_WRITE_BATCH_SIZE:
+                        flush_pending()
+                elif kind == "flush":
+                    flush_pending()
+                    extra.set_result(None)
+                elif kind == "execute":
+                    # keep the order - queued rows are written before the synchronous write
+                    flush_pending()
+                    try:
+                        with conn:
+                            result = payload(conn)
+                    except Exception as e:
+                        extra.set_exception(e)
+                    else:
+                        # only answer after the commit, so the caller can read its own write
+                        extra.set_result(result)
+        finally:
+            conn.close()
 
 
 
 class IPTV_Database:
 
+    # failed is incremented inside the statement, SUCCESS and SKIPPED reset it
+    MAC_STATUS_UPDATE_SQL = """
+        UPDATE macs
+        SET status = ?, error = ?, german = ?, adult = ?,
+            failed = CASE WHEN ? THEN COALESCE(failed, 0) + 1 ELSE 0 END,
+            last_updated = ?
+        WHERE id = ?
+    """
+
+    MAC_UNREACHABLE_UPDATE_SQL = "UPDATE macs SET error = ? WHERE id = ?"
+
+    STREAM_RESULT_SQL = """
+        INSERT INTO streams (url, failed, last_success, last_checked, real_url)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(url) DO UPDATE SET
+            real_url = COALESCE(excluded.real_url, streams.real_url),
+            failed = CASE WHEN excluded.failed > 0 THEN COALESCE(streams.failed, 0) + 1 ELSE 0 END,
+            last_success = COALESCE(excluded.last_success, streams.last_success),
+            last_checked = excluded.last_checked
+    """
+
+    # startup_ms is a moving average, 3/4 old value and 1/4 new measurement
+    CHANNEL_RESULT_SQL = """
+        INSERT INTO channels (url_id, name, logo, german, adult, austrian, stream_id,
+                              success_count, failure_count, last_success, last_checked, startup_ms, cmd, genre_id)
+        VALUES (?, ?, ?, ?, ?, ?, (SELECT id FROM streams WHERE url = ?), ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(url_id, name) DO UPDATE SET
+            logo = COALESCE(excluded.logo, channels.logo),
+            cmd = COALESCE(excluded.cmd, channels.cmd),
+            genre_id = COALESCE(excluded.genre_id, channels.genre_id),
+            stream_id = COALESCE(excluded.stream_id, channels.stream_id),
+            success_count = COALESCE(channels.success_count, 0) + excluded.success_count,
+            failure_count = COALESCE(channels.failure_count, 0) + excluded.failure_count,
+            last_success = COALESCE(excluded.last_success, channels.last_success),
+            last_checked = excluded.last_checked,
+            startup_ms = CASE
+                WHEN excluded.startup_ms IS NULL THEN channels.startup_ms
+                WHEN channels.startup_ms IS NULL THEN excluded.startup_ms
+                ELSE (channels.startup_ms * 3 + excluded.startup_ms) / 4
+            END
+    """
+
+    CHANNEL_HEALTH_BY_URL_SQL = """
+        SELECT channels.name, channels.success_count, channels.failure_count,
+               channels.last_success, channels.startup_ms, channels.cmd, channels.genre_id
+        FROM channels
+        WHERE channels.url_id = ?
+    """
+
+    # the last check of the stream was a success - read once per run by the stream cache
+    RECENT_WORKING_STREAMS_SQL = """
+        SELECT streams.url, streams.real_url, streams.last_success
+        FROM streams
+        WHERE streams.last_success >= ? AND streams.last_success = streams.last_checked
+    """
+
+    HOST_LATENCY_UPDATE_SQL = """
+        INSERT INTO host_latency (host, ewma, p95, samples, last_updated)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(host) DO UPDATE SET
+            ewma = excluded.ewma,
+            p95 = excluded.p95,
+            samples = COALESCE(host_latency.samples, 0) + excluded.samples,
+            last_updated = excluded.last_updated
+    """
+
+    RUN_MAC_SQL = """
+        INSERT OR REPLACE INTO run_macs (run_id, mac_id, status, known_good, completed)
+        VALUES (?, ?, ?, ?, ?)
+    """
+
+    # history of every portal for the priority of a run, see Library/priority.py
+    URL_HISTORY_SQL = f"""
+        SELECT urls.url,
+               COUNT(macs.id) AS macs,
+               SUM(CASE WHEN macs.status = '{STATUS.SUCCESS.value}' THEN 1 ELSE 0 END) AS working_macs,
+               MAX(macs.last_updated) AS last_checked,
+               MAX(CASE WHEN macs.status = '{STATUS.SUCCESS.value}' THEN macs.last_updated END) AS last_success
+        FROM urls
+        LEFT JOIN macs ON macs.url_id = urls.id
+        GROUP BY urls.id
+    """
+
+    # Queue mode: PENDING -> LEASED -> DONE, HELD until the known good MAC of the URL is done,
+    # PAUSED while the circuit of the host is open, CANCELLED when the coordinator stops the URL. One UPDATE leases the best jobs, at most
+    # max_per_url leased jobs per URL over all workers.
+    QUEUE_LEASE_SQL = """
+        UPDATE queue_jobs
+        SET state = 'LEASED', worker = ?, lease_token = ?, lease_until = ?, attempts = attempts + 1
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT pending.id, pending.priority,
+                       ROW_NUMBER() OVER (PARTITION BY pending.url_id ORDER BY pending.priority DESC, pending.id) AS url_rank,
+                       (SELECT COUNT(*) FROM queue_jobs AS leased
+                        WHERE leased.run_id = pending.run_id AND leased.url_id = pending.url_id
+                        AND leased.state = 'LEASED') AS url_leased
+                FROM queue_jobs AS pending
+                WHERE pending.run_id = ? AND pending.state = 'PENDING'
+            )
+            WHERE url_rank + url_leased <= ?
+            ORDER BY priority DESC, id
+            LIMIT ?
+        )
+    """
+
+    MAC_COLUMNS = "macs.id, macs.mac, macs.expiration, macs.status, macs.error, macs.adult, macs.german, macs.failed, macs.last_updated, macs.token, macs.token_timestamp"
+
+    MAC_TOKEN_UPDATE_SQL = "UPDATE macs SET token = ?, token_timestamp = ? WHERE id = ?"
+
+    # cold table of MAINTAIN_db.py in the attached archive database, id is the former macs.id
+    ARCHIVE_TABLE_SQL = """
+        CREATE TABLE IF NOT EXISTS archive.macs_archive (
+            id INTEGER PRIMARY KEY,
+            url TEXT,
+            mac TEXT,
+            expiration DATE,
+            status TEXT,
+            error TEXT,
+            adult BOOLEAN,
+            german BOOLEAN,
+            last_updated TEXT,
+            failed INTEGER,
+            reason TEXT,
+            archived TEXT
+        )
+    """
+
+    # never a working MAC and never one with a job of an unfinished queue mode run
+    DEAD_MACS_WHERE = """
+        macs.status IS NOT ?
+        AND (
+            (macs.failed >= ? AND (macs.last_updated IS NULL OR macs.last_updated < ?))
+            OR (macs.expiration IS NOT NULL AND macs.expiration != '' AND macs.expiration < ?)
+        )
+        AND macs.id NOT IN (
+            SELECT queue_jobs.mac_id FROM queue_jobs
+            JOIN runs ON runs.id = queue_jobs.run_id
+            WHERE runs.status = 'RUNNING'
+        )
+    """
+
+    ARCHIVE_DEAD_MACS_SQL = f"""
+        INSERT OR REPLACE INTO archive.macs_archive
+            (id, url, mac, expiration, status, error, adult, german, last_updated, failed, reason, archived)
+        SELECT macs.id, urls.url, macs.mac, macs.expiration, macs.status, macs.error, macs.adult,
+            macs.german, macs.last_updated, macs.failed,
+            CASE WHEN macs.failed >= ? THEN 'FAILED' ELSE 'EXPIRED' END, ?
+        FROM macs
+        LEFT JOIN urls ON urls.id = macs.url_id
+        WHERE {DEAD_MACS_WHERE}
+    """
+
+    QUEUE_LEASED_JOBS_SQL = f"""
+        SELECT queue_jobs.id AS job_id, queue_jobs.known_good, urls.url, {MAC_COLUMNS}
+        FROM queue_jobs
+        JOIN macs ON queue_jobs.mac_id = macs.id
+        JOIN urls ON queue_jobs.url_id = urls.id
+        WHERE queue_jobs.lease_token = ?
+        ORDER BY queue_jobs.priority DESC, queue_jobs.id
+    """
+
+    ALL_MACS_BY_URL_SQL = f"""
+        SELECT {MAC_COLUMNS}
+        FROM macs
+        WHERE macs.url_id = ?
+        AND macs.failed < ?
+        ORDER BY macs.expiration DESC
+    """
+
+    ALL_OTHER_MACS_BY_URL_SQL = f"""
+        SELECT {MAC_COLUMNS}
+        FROM macs
+        WHERE macs.url_id = ?
+        AND macs.failed < ?
+        AND macs.id != ?
+        ORDER BY macs.expiration DESC
+    """
+
+    NEWEST_WORKING_MAC_FOR_URL_SQL = """
+        SELECT macs.id
+        FROM macs
+        WHERE macs.url_id = ?
+        AND macs.status = ?
+        ORDER BY
+            CASE WHEN macs.last_updated IS NULL THEN 1 ELSE 0 END,
+            macs.last_updated DESC,
+            macs.id DESC
+        LIMIT 1
+    """
+
+    # one pass with a window function instead of a correlated subquery per SUCCESS row
+    URL_AND_NEWEST_WORKING_MAC_SQL = """
+        SELECT url, mac, expiration, german, adult, last_updated
+        FROM (
+            SELECT urls.url, macs.mac, macs.expiration, macs.german, macs.adult, macs.last_updated,
+                ROW_NUMBER() OVER (
+                    PARTITION BY macs.url_id
+                    ORDER BY
+                        CASE WHEN macs.last_updated IS NULL THEN 1 ELSE 0 END,
+                        macs.last_updated DESC,
+                        macs.id DESC
+                ) AS newest
+            FROM macs
+            JOIN urls ON macs.url_id = urls.id
+            WHERE macs.status = ?
+        )
+        WHERE newest = 1
+        ORDER BY url
+    """
+
     @staticmethod
     def _current_timestamp():
         return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    def _column_exists(self, table_name, column_name):
-        cursor = self.conn.cursor()
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        return any(row[1] == column_name for row in cursor.fetchall())
-
     def __namedtuple_factory(self, cursor, row):
-        fields = [col[0] for col in cursor.description]
-        Row = namedtuple('Row', fields)
-        return Row(*row)
+        return _row_class(tuple(col[0] for col in cursor.description))(*row)
 
 
-    def __init__(self):
-        self.conn = sqlite3.connect(Settings.DB_PATH)
+    # rows of an executed cursor in batches of DB_FETCH_SIZE - for result sets that are only
+    # iterated once, e.g. by the reports, the whole table is never held in memory
+    @staticmethod
+    def _iter_rows(cursor):
+        while True:
+            rows = cursor.fetchmany(Settings.DB_FETCH_SIZE)
+            if not rows:
+                return
+            yield from rows
+
+
+    def __init__(self, read_only=False):
+        # Readers (reports, player) open the file read-only and never block the checker.
+        # In read-write mode all writes go through one writer thread started on first use.
+        self.read_only = read_only
+        self.conn = connect_database(Settings.DB_PATH, read_only=read_only)
         self.conn.row_factory = self.__namedtuple_factory
-        self.create_tables()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._url_ids = {}
+        if not read_only:
+            # a database on the current schema version only reads PRAGMA user_version
+            migrate(self.conn)
+            # flush queued status updates even if the caller never reaches close()
+            atexit.register(self.flush_mac_status)
 
     def __enter__(self):
         return self
@@ -36,57 +415,6 @@ class IPTV_Database:
 
     
 
-    def create_tables(self):
-        self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS urls (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                url TEXT UNIQUE
-            )
-        """)
-        self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS macs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                url_id INTEGER,
-                mac TEXT,
-                expiration DATE,
-                status TEXT,
-                error TEXT,
-                adult BOOLEAN,
-                german BOOLEAN,
-                last_updated TEXT,
-                failed INTEGER DEFAULT 0,
-                FOREIGN KEY(url_id) REFERENCES urls(id),
-                UNIQUE(url_id, mac)
-            )
-        """)
-        self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS channels (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                mac_id INTEGER,
-                stream_id INTEGER,
-                name TEXT,
-                logo TEXT,
-                german BOOLEAN,
-                adult BOOLEAN, 
-                austrian BOOLEAN,
-                FOREIGN KEY(mac_id) REFERENCES macs(id),
-                FOREIGN KEY(stream_id) REFERENCES streams(id),
-                UNIQUE(mac_id, name)
-            )
-        """)
-        self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS streams (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                url TEXT,
-                failed INTEGER DEFAULT 0,
-                UNIQUE(url)
-            )
-        """)
-        if not self._column_exists("macs", "last_updated"):
-            self.conn.execute("ALTER TABLE macs ADD COLUMN last_updated TEXT")
-        self.conn.commit()
-
-
     def get_clean_url(self, url):
         # Ensure no trailing slash
         if url.endswith('/'):
@@ -98,10 +426,18 @@ class IPTV_Database:
 
         url = self.get_clean_url(url)
 
+        # URLs are never renumbered, so known ids are cached for the lifetime of the connection
+        url_id = self._url_ids.get(url)
+        if url_id is not None:
+            return url_id
+
         cursor = self.conn.cursor()
         cursor.execute("SELECT id FROM urls WHERE url = ?", (url,))
         result = cursor.fetchone()
-        return result[0] if result else None
+        if result:
+            self._url_ids[url] = result[0]
+            return result[0]
+        return None
     
 
     def get_mac_id(self, url, mac):
@@ -109,14 +445,12 @@ class IPTV_Database:
         if url is None or mac is None:
             return None
         
-        url = self.get_clean_url(url)
+        url_id = self.get_url_id(url)
+        if url_id is None:
+            return None
 
         cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT macs.id FROM macs
-            JOIN urls ON macs.url_id = urls.id
-            WHERE urls.url = ? AND macs.mac = ?
-        """, (url, mac))
+        cursor.execute("SELECT id FROM macs WHERE url_id = ? AND mac = ?", (url_id, mac))
         result = cursor.fetchone()
         return result[0] if result else None
     
@@ -131,77 +465,371 @@ class IPTV_Database:
         return 0
 
 
+    def _mac_status_row(self, mac_id, status, error=None, german=None, adult=None):
+        count_failed = status != STATUS.SUCCESS and status != STATUS.SKIPPED
+        status_value = status.value if status is not None else None
+        return (status_value, error, german, adult, count_failed, self._current_timestamp(), mac_id)
+
+
+    def _get_writer(self):
+        if self.read_only:
+            raise sqlite3.OperationalError("IPTV_Database was opened read-only")
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = DB_Writer(Settings.DB_PATH)
+            return self._writer
+
+
+    # run func(conn) in one transaction on the writer thread
+    def _write(self, func):
+        return self._get_writer().execute(func)
+
+
     # Update the status and error of a MAC by its ID
     def update_mac_status(self, mac_id, status, error=None, german=None, adult=None):
+        if status == STATUS.UNREACHABLE:
+            self._write(lambda conn: conn.execute(self.MAC_UNREACHABLE_UPDATE_SQL, (error, mac_id)))
+            return
+        row = self._mac_status_row(mac_id, status, error, german, adult)
+        self._write(lambda conn: conn.execute(self.MAC_STATUS_UPDATE_SQL, row))
 
-        failed = 0
-        if status != STATUS.SUCCESS and status != STATUS.SKIPPED:
-            failed = self.get_failed_attempts(mac_id) + 1
-        
-        status_value = status.value if status is not None else None
-        last_updated = self._current_timestamp()
+
+    # Queue a status update - the writer thread writes queued updates in one transaction
+    # every DB_WRITE_BATCH_SIZE rows or DB_WRITE_FLUSH_INTERVAL_MS after the oldest queued row.
+    # Safe to call from worker threads.
+    def queue_mac_status(self, mac_id, status, error=None, german=None, adult=None):
+        if status == STATUS.UNREACHABLE:
+            # the portal was down - status and failed counter of the MAC stay as they are
+            self._get_writer().queue_rows(self.MAC_UNREACHABLE_UPDATE_SQL, [(error, mac_id)])
+            return
+        row = self._mac_status_row(mac_id, status, error, german, adult)
+        self._get_writer().queue_rows(self.MAC_STATUS_UPDATE_SQL, [row])
+
+
+    # Queue the handshake token of a MAC - reused by the next run until the portal rejects it
+    def queue_mac_token(self, mac_id, token, token_timestamp):
+        self._get_writer().queue_rows(self.MAC_TOKEN_UPDATE_SQL, [(token, token_timestamp, mac_id)])
+
+
+    # Queue the outcome of one channel validation on a portal - write-behind like the MAC status
+    # stream_url is the stream link of the channel, real_url where it redirected to
+    def queue_channel_result(self, url, name, success, startup_ms=None, stream_url=None, real_url=None,
+                             logo=None, german=None, adult=None, austrian=None, cmd=None, genre_id=None):
+        url_id = self.get_url_id(url)
+        if url_id is None:
+            return
+        now = self._current_timestamp()
+        last_success = now if success else None
+        stream_url_key = stream_key(stream_url)
+        writer = self._get_writer()
+        if stream_url_key:
+            writer.queue_rows(self.STREAM_RESULT_SQL, [(stream_url_key, 0 if success else 1, last_success, now, real_url)])
+        writer.queue_rows(self.CHANNEL_RESULT_SQL, [(
+            url_id, name, logo, german, adult, austrian, stream_url_key,
+            1 if success else 0, 0 if success else 1, last_success, now,
+            startup_ms if success else None, cmd, genre_id,
+        )])
+
+
+    # channel health rows of a portal: name, success_count, failure_count, last_success, startup_ms
+    def get_channel_health_by_url(self, url):
+        url_id = self.get_url_id(url)
+        if url_id is None:
+            return []
 
         cursor = self.conn.cursor()
-        cursor.execute("""
-            UPDATE macs
-            SET status = ?, error = ?, german = ?, adult = ?, failed = ?, last_updated = ?
-            WHERE id = ?
-        """, (status_value, error, german, adult, failed, last_updated, mac_id, ))
-        self.conn.commit()
+        cursor.execute(self.CHANNEL_HEALTH_BY_URL_SQL, (url_id,))
+        return cursor.fetchall()
+
+
+    # streams that worked at their last check within the last max_age_seconds
+    def get_recent_working_streams(self, max_age_seconds):
+        return list(self.iter_recent_working_streams(max_age_seconds))
+
+
+    def iter_recent_working_streams(self, max_age_seconds):
+        since = (datetime.now() - timedelta(seconds=max_age_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+        cursor = self.conn.cursor()
+        cursor.execute(self.RECENT_WORKING_STREAMS_SQL, (since,))
+        return self._iter_rows(cursor)
+
+
+    # Start a run of kind 'check' (CHECK_macs.py) or 'queue' (QUEUE_check_macs.py) - runs of the
+    # same kind left unfinished before can no longer be resumed
+    def start_run(self, parameters, kind='check'):
+        now = self._current_timestamp()
+
+        def insert(conn):
+            conn.execute("UPDATE runs SET status = 'ABANDONED' WHERE status = 'RUNNING' AND kind = ?", (kind,))
+            return conn.execute(
+                "INSERT INTO runs (started, status, parameters, kind) VALUES (?, 'RUNNING', ?, ?)",
+                (now, parameters, kind),
+            ).lastrowid
+
+        return self._write(insert)
+
+
+    # id, started, parameters of the newest run of the kind that did not finish, or None
+    def get_unfinished_run(self, kind='check'):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT id, started, parameters FROM runs WHERE status = 'RUNNING' AND kind = ? ORDER BY id DESC LIMIT 1", (kind,))
+        return cursor.fetchone()
+
+
+    def finish_run(self, run_id):
+        self.flush_mac_status()
+        self._write(lambda conn: conn.execute(
+            "UPDATE runs SET status = 'FINISHED', finished = ? WHERE id = ?",
+            (self._current_timestamp(), run_id),
+        ))
+
+
+    # Queue the result of a MAC in the journal of a run - written together with the MAC status
+    def queue_run_mac(self, run_id, mac_id, status, known_good=False):
+        status_value = status.value if isinstance(status, STATUS) else status
+        self._get_writer().queue_rows(self.RUN_MAC_SQL, [(run_id, mac_id, status_value, known_good, self._current_timestamp())])
+
+
+    # status per MAC id of the MACs a run has finished
+    def get_run_macs(self, run_id):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT mac_id, status FROM run_macs WHERE run_id = ?", (run_id,))
+        return {row.mac_id: row.status for row in cursor.fetchall()}
+
+
+    # MAC count per status of a run, without the known good MACs checked first - like the run summary
+    def get_run_status_counts(self, run_id):
+        self.flush_mac_status()
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT status, COUNT(*) AS count FROM run_macs WHERE run_id = ? AND NOT known_good GROUP BY status",
+            (run_id,),
+        )
+        return {row.status: row.count for row in cursor.fetchall()}
+
+
+    # Queue mode - coordinator side
+    # jobs: (url_id, mac_id, priority, known_good, state) with state PENDING or HELD
+    def enqueue_jobs(self, run_id, jobs):
+        rows = [(run_id, url_id, mac_id, priority, known_good, state) for url_id, mac_id, priority, known_good, state in jobs]
+        self._write(lambda conn: conn.executemany(
+            "INSERT OR IGNORE INTO queue_jobs (run_id, url_id, mac_id, priority, known_good, state) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        ))
+
+
+    # Leases that were not renewed go back to PENDING, after max_attempts the job is given up
+    def reap_expired_leases(self, run_id, max_attempts):
+        now = time.time()
+
+        def reap(conn):
+            given_up = conn.execute(
+                "UPDATE queue_jobs SET state = 'DONE', status = ?, error = ?, worker = NULL, lease_token = NULL "
+                "WHERE run_id = ? AND state = 'LEASED' AND lease_until < ? AND attempts >= ?",
+                (STATUS.ERROR.value, f"Lease expired {max_attempts} times", run_id, now, max_attempts),
+            ).rowcount
+            released = conn.execute(
+                "UPDATE queue_jobs SET state = 'PENDING', worker = NULL, lease_token = NULL "
+                "WHERE run_id = ? AND state = 'LEASED' AND lease_until < ?",
+                (run_id, now),
+            ).rowcount
+            return released, given_up
+
+        return self._write(reap)
+
+
+    # Finished jobs not seen by the coordinator yet - marked as collected
+    def collect_job_results(self, run_id):
+        def collect(conn):
+            cursor = conn.cursor()
+            cursor.row_factory = self.__namedtuple_factory
+            rows = cursor.execute(
+                "SELECT queue_jobs.id AS job_id, queue_jobs.url_id, queue_jobs.mac_id, queue_jobs.known_good, "
+                "queue_jobs.status, queue_jobs.error, queue_jobs.german, queue_jobs.adult, queue_jobs.worker, urls.url, macs.mac "
+                "FROM queue_jobs JOIN urls ON queue_jobs.url_id = urls.id JOIN macs ON queue_jobs.mac_id = macs.id "
+                "WHERE queue_jobs.run_id = ? AND queue_jobs.state = 'DONE' AND NOT queue_jobs.collected "
+                "ORDER BY queue_jobs.id",
+                (run_id,),
+            ).fetchall()
+            conn.executemany("UPDATE queue_jobs SET collected = 1 WHERE id = ?", [(row.job_id,) for row in rows])
+            return rows
+
+        return self._write(collect)
+
+
+    # Stop the jobs of a URL in one of states that were not leased yet - returns the mac ids
+    def cancel_url_jobs(self, run_id, url_id, status, states=('PENDING', 'HELD', 'PAUSED')):
+        placeholders = ", ".join("?" for _ in states)
+
+        def cancel(conn):
+            mac_ids = [row[0] for row in conn.execute(
+                f"SELECT mac_id FROM queue_jobs WHERE run_id = ? AND url_id = ? AND state IN ({placeholders})",
+                (run_id, url_id, *states),
+            ).fetchall()]
+            conn.execute(
+                f"UPDATE queue_jobs SET state = 'CANCELLED', status = ? WHERE run_id = ? AND url_id = ? AND state IN ({placeholders})",
+                (status.value, run_id, url_id, *states),
+            )
+            return mac_ids
+
+        return self._write(cancel)
+
+
+    # hold the pending jobs of the URLs of a host in its cool-down - returns the number of paused jobs
+    def pause_url_jobs(self, run_id, url_ids):
+        return self._write(lambda conn: sum(conn.execute(
+            "UPDATE queue_jobs SET state = 'PAUSED' WHERE run_id = ? AND url_id = ? AND state = 'PENDING'",
+            (run_id, url_id),
+        ).rowcount for url_id in url_ids))
+
+
+    # make paused jobs of the URLs leasable again, the best first - limit 1 for the probe of a host
+    def resume_url_jobs(self, run_id, url_ids, limit=-1):
+        placeholders = ", ".join("?" for _ in url_ids)
+        return self._write(lambda conn: conn.execute(
+            "UPDATE queue_jobs SET state = 'PENDING' WHERE id IN ("
+            f"SELECT id FROM queue_jobs WHERE run_id = ? AND url_id IN ({placeholders}) AND state = 'PAUSED' "
+            "ORDER BY priority DESC, id LIMIT ?)",
+            (run_id, *url_ids, limit),
+        ).rowcount)
+
+
+    def release_held_jobs(self, run_id, url_id):
+        self._write(lambda conn: conn.execute(
+            "UPDATE queue_jobs SET state = 'PENDING' WHERE run_id = ? AND url_id = ? AND state = 'HELD'",
+            (run_id, url_id),
+        ))
+
+
+    # job count per state of a run
+    def get_queue_counts(self, run_id):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT state, COUNT(*) AS count FROM queue_jobs WHERE run_id = ? GROUP BY state", (run_id,))
+        return {row.state: row.count for row in cursor.fetchall()}
+
+
+    # Queue mode - worker side
+    def lease_jobs(self, run_id, worker, count, max_per_url, lease_seconds):
+        lease_token = f"{worker}:{uuid.uuid4().hex}"
+
+        def lease(conn):
+            conn.execute(self.QUEUE_LEASE_SQL, (worker, lease_token, time.time() + lease_seconds, run_id, max_per_url, count))
+            cursor = conn.cursor()
+            cursor.row_factory = self.__namedtuple_factory
+            return cursor.execute(self.QUEUE_LEASED_JOBS_SQL, (lease_token,)).fetchall()
+
+        return self._write(lease)
+
+
+    def renew_job_leases(self, job_ids, worker, lease_seconds):
+        if not job_ids:
+            return
+        lease_until = time.time() + lease_seconds
+        self._write(lambda conn: conn.executemany(
+            "UPDATE queue_jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'LEASED'",
+            [(lease_until, job_id, worker) for job_id in job_ids],
+        ))
+
+
+    # Report the result of a leased job - False if the lease expired and the job went to another worker
+    def report_job(self, job_id, worker, status, error=None, german=None, adult=None):
+        status_value = status.value if isinstance(status, STATUS) else status
+        return self._write(lambda conn: conn.execute(
+            "UPDATE queue_jobs SET state = 'DONE', status = ?, error = ?, german = ?, adult = ?, lease_token = NULL "
+            "WHERE id = ? AND worker = ? AND state = 'LEASED'",
+            (status_value, error, german, adult, job_id, worker),
+        ).rowcount == 1)
+
+
+    def get_run_status(self, run_id):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT status FROM runs WHERE id = ?", (run_id,))
+        row = cursor.fetchone()
+        return row.status if row else None
+
+
+    # url -> row of macs, working_macs, last_checked, last_success
+    def get_url_history(self):
+        cursor = self.conn.cursor()
+        cursor.execute(self.URL_HISTORY_SQL)
+        return {row.url: row for row in cursor.fetchall()}
+
+
+    # learned latency per host: host, ewma, p95 (seconds)
+    def get_host_latencies(self):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT host, ewma, p95 FROM host_latency")
+        return cursor.fetchall()
+
+
+    # rows of host, ewma, p95, samples - written once at the end of a run
+    def save_host_latencies(self, rows):
+        now = self._current_timestamp()
+        rows = [(host, ewma, p95, samples, now) for host, ewma, p95, samples in rows]
+        if rows:
+            self._write(lambda conn: conn.executemany(self.HOST_LATENCY_UPDATE_SQL, rows))
+
+
+    def flush_mac_status(self):
+        if self._writer is not None:
+            self._writer.flush()
+
 
     # Get all MACs for a given URL order by expiration date descending
     def get_all_macs_by_url(self, url):
+        return list(self.iter_all_macs_by_url(url))
 
-        url = self.get_clean_url(url)
+
+    def iter_all_macs_by_url(self, url):
+
+        url_id = self.get_url_id(url)
+        if url_id is None:
+            return iter(())
 
         cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT macs.id, macs.mac, macs.expiration, macs.status, macs.error, macs.adult, macs.german, macs.failed, macs.last_updated
-            FROM macs
-            JOIN urls ON macs.url_id = urls.id
-            WHERE urls.url = ?
-            AND macs.failed < ?
-            ORDER BY macs.expiration DESC
-        """, (url, Settings.MAX_FAILED_STATUS_ATTEMPTS,))
-        return cursor.fetchall()
+        cursor.execute(self.ALL_MACS_BY_URL_SQL, (url_id, Settings.MAX_FAILED_STATUS_ATTEMPTS,))
+        return self._iter_rows(cursor)
     
 
     def get_all_other_macs_by_url(self, url, mac_id):
+        return list(self.iter_all_other_macs_by_url(url, mac_id))
 
-        url = self.get_clean_url(url)
+
+    def iter_all_other_macs_by_url(self, url, mac_id):
+
+        url_id = self.get_url_id(url)
+        if url_id is None:
+            return iter(())
 
         cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT macs.id, macs.mac, macs.expiration, macs.status, macs.error, macs.adult, macs.german, macs.failed, macs.last_updated
-            FROM macs
-            JOIN urls ON macs.url_id = urls.id
-            WHERE urls.url = ?
-            AND macs.failed < ?
-            AND macs.id != ?
-            ORDER BY macs.expiration DESC
-        """, (url, Settings.MAX_FAILED_STATUS_ATTEMPTS, mac_id))
-        return cursor.fetchall()
+        cursor.execute(self.ALL_OTHER_MACS_BY_URL_SQL, (url_id, Settings.MAX_FAILED_STATUS_ATTEMPTS, mac_id))
+        return self._iter_rows(cursor)
     
     
     def get_all_not_success_macs_by_url(self, url):
 
-        url = self.get_clean_url(url)
+        url_id = self.get_url_id(url)
+        if url_id is None:
+            return []
 
         cursor = self.conn.cursor()
         cursor.execute("""
             SELECT macs.id, macs.mac, macs.expiration, macs.status, macs.error, macs.adult, macs.german, macs.last_updated
             FROM macs
-            JOIN urls ON macs.url_id = urls.id
-            WHERE urls.url = ?
+            WHERE macs.url_id = ?
             AND macs.failed < ?
             AND macs.status != ?
             ORDER BY macs.expiration DESC
-        """, (url, Settings.MAX_FAILED_STATUS_ATTEMPTS, STATUS.SUCCESS.value))
+        """, (url_id, Settings.MAX_FAILED_STATUS_ATTEMPTS, STATUS.SUCCESS.value))
         return cursor.fetchall()
 
 
     # get all urls where is not MAC with status = 'SUCCESS'
     def get_urls_without_working_mac(self):
+        return list(self.iter_urls_without_working_mac())
+
+
+    def iter_urls_without_working_mac(self):
         cursor = self.conn.cursor()
         cursor.execute("""
             SELECT urls.url
@@ -209,23 +837,16 @@ class IPTV_Database:
             LEFT JOIN macs ON urls.id = macs.url_id AND macs.status = ?
             WHERE macs.id IS NULL
         """, (STATUS.SUCCESS.value,))
-        return [row[0] for row in cursor.fetchall()]
+        return (row[0] for row in self._iter_rows(cursor))
 
 
     def get_newest_working_mac_for_url(self, url):
+        url_id = self.get_url_id(url)
+        if url_id is None:
+            return None
+
         cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT macs.id
-            FROM macs
-            JOIN urls ON macs.url_id = urls.id
-            WHERE macs.status = ?
-            AND urls.url = ?
-            ORDER BY
-                CASE WHEN macs.last_updated IS NULL THEN 1 ELSE 0 END,
-                macs.last_updated DESC,
-                macs.id DESC
-            LIMIT 1
-        """, (STATUS.SUCCESS.value, url))
+        cursor.execute(self.NEWEST_WORKING_MAC_FOR_URL_SQL, (url_id, STATUS.SUCCESS.value))
 
         result = cursor.fetchone()
         if result:
@@ -237,34 +858,23 @@ class IPTV_Database:
     # get mac by id
     def get_mac_by_id(self, mac_id):
         cursor = self.conn.cursor()
-        cursor.execute("SELECT macs.id, macs.mac, macs.expiration, macs.status, macs.error, macs.adult, macs.german, macs.last_updated FROM macs WHERE id = ?", (mac_id,))
+        cursor.execute(f"SELECT {self.MAC_COLUMNS} FROM macs WHERE id = ?", (mac_id,))
         return cursor.fetchone()
 
     # Get for each URL the newest MAC with status = 1
     def get_url_and_newest_working_mac(self):
+        return list(self.iter_url_and_newest_working_mac())
+
+    def iter_url_and_newest_working_mac(self):
         cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT urls.url, macs.mac, macs.expiration, macs.german, macs.adult, macs.last_updated
-            FROM macs
-            JOIN urls ON macs.url_id = urls.id
-            WHERE macs.status = ?
-            AND macs.id = (
-                SELECT candidate.id
-                FROM macs AS candidate
-                WHERE candidate.url_id = macs.url_id
-                AND candidate.status = ?
-                ORDER BY
-                    CASE WHEN candidate.last_updated IS NULL THEN 1 ELSE 0 END,
-                    candidate.last_updated DESC,
-                    candidate.id DESC
-                LIMIT 1
-            )
-            ORDER BY urls.url
-        """, (STATUS.SUCCESS.value, STATUS.SUCCESS.value))
-        return cursor.fetchall()
+        cursor.execute(self.URL_AND_NEWEST_WORKING_MAC_SQL, (STATUS.SUCCESS.value,))
+        return self._iter_rows(cursor)
     
     # Get for each URL the working MACs
     def get_url_and_working_mac(self):
+        return list(self.iter_url_and_working_mac())
+
+    def iter_url_and_working_mac(self):
         cursor = self.conn.cursor()
         # Status constants
 
@@ -275,10 +885,13 @@ class IPTV_Database:
             WHERE macs.status = ?
             ORDER BY urls.url, macs.mac
         """, (STATUS.SUCCESS.value,))
-        return cursor.fetchall()
+        return self._iter_rows(cursor)
 
     # Get all SUCCESS MACs sorted by newest update first
     def get_all_success_macs_by_update_date(self):
+        return list(self.iter_all_success_macs_by_update_date())
+
+    def iter_all_success_macs_by_update_date(self):
         cursor = self.conn.cursor()
         cursor.execute("""
             SELECT urls.url, macs.mac, macs.expiration, macs.german, macs.adult, macs.last_updated
@@ -292,7 +905,7 @@ class IPTV_Database:
                 macs.last_updated DESC,
                 macs.id DESC
         """, (STATUS.SUCCESS.value,))
-        return cursor.fetchall()
+        return self._iter_rows(cursor)
 
     
     # Get all URLs in the database
@@ -302,13 +915,15 @@ class IPTV_Database:
         return [row[0] for row in cursor.fetchall()]
 
 
+    def get_url_count(self):
+        return self.conn.execute("SELECT COUNT(*) AS urls FROM urls").fetchone()[0]
+
+
     def insert_url(self, url):
 
         url = self.get_clean_url(url)
 
-        cursor = self.conn.cursor()
-        cursor.execute("INSERT OR IGNORE INTO urls (url) VALUES (?)", (url,))
-        self.conn.commit()
+        self._write(lambda conn: conn.execute("INSERT OR IGNORE INTO urls (url) VALUES (?)", (url,)))
         return self.get_url_id(url)
 
 
@@ -324,11 +939,184 @@ class IPTV_Database:
         status_value = status.value if status is not None else None
         last_updated = self._current_timestamp()
         
-        self.conn.execute(
+        self._write(lambda conn: conn.execute(
             "INSERT INTO macs (url_id, mac, expiration, status, error, german, adult, last_updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
             (url_id, mac, expiration, status_value, error, german, adult, last_updated)
+        ))
+
+
+    # Insert scraped (url, mac, expiration) entries in one transaction - URLs and MACs that
+    # already exist are kept as they are. Returns (inserted, skipped), entries without URL or
+    # MAC and duplicates count as skipped.
+    def bulk_insert_macs(self, entries):
+        rows = []
+        skipped = 0
+        for url, mac, expiration in entries:
+            if not url or not mac:
+                skipped += 1
+                continue
+            if hasattr(expiration, "isoformat"):
+                expiration = expiration.isoformat()
+            rows.append((self.get_clean_url(url), mac, expiration))
+        if not rows:
+            return 0, skipped
+
+        new_urls = sorted({url for url, _, _ in rows if url not in self._url_ids})
+        last_updated = self._current_timestamp()
+
+        def insert(conn):
+            conn.executemany("INSERT OR IGNORE INTO urls (url) VALUES (?)", [(url,) for url in new_urls])
+            url_ids = dict(self._url_ids)
+            for url in new_urls:
+                url_ids[url] = conn.execute("SELECT id FROM urls WHERE url = ?", (url,)).fetchone()[0]
+            changes = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO macs (url_id, mac, expiration, last_updated) VALUES (?, ?, ?, ?)",
+                [(url_ids[url], mac, expiration, last_updated) for url, mac, expiration in rows]
+            )
+            return url_ids, conn.total_changes - changes
+
+        url_ids, inserted = self._write(insert)
+        self._url_ids.update(url_ids)
+        return inserted, skipped + len(rows) - inserted
+
+    # EXPLAIN QUERY PLAN of the hot queries - returns (name, uses_index, plan lines) per query.
+    # A query counts as indexed if it never does a full scan of macs or channels.
+    def explain_hot_queries(self):
+        queries = {
+            "get_all_macs_by_url": (self.ALL_MACS_BY_URL_SQL, (0, Settings.MAX_FAILED_STATUS_ATTEMPTS)),
+            "get_all_other_macs_by_url": (self.ALL_OTHER_MACS_BY_URL_SQL, (0, Settings.MAX_FAILED_STATUS_ATTEMPTS, 0)),
+            "get_newest_working_mac_for_url": (self.NEWEST_WORKING_MAC_FOR_URL_SQL, (0, STATUS.SUCCESS.value)),
+            "get_url_and_newest_working_mac": (self.URL_AND_NEWEST_WORKING_MAC_SQL, (STATUS.SUCCESS.value,)),
+            "get_mac_id": ("SELECT id FROM macs WHERE url_id = ? AND mac = ?", (0, "")),
+            "get_channel_health_by_url": (self.CHANNEL_HEALTH_BY_URL_SQL, (0,)),
+        }
+        results = []
+        for name, (sql, params) in queries.items():
+            cursor = self.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = [row[3] for row in cursor.fetchall()]
+            full_scan = any(line.startswith(("SCAN macs", "SCAN channels")) and "USING" not in line for line in plan)
+            results.append((name, not full_scan, plan))
+        return results
+
+
+    # Seconds of the fastest of repeat passes over the per-URL queries of CHECK_macs.py for all URLs
+    # True if a read-only connection sees a database the migrations of this release were not applied to
+    def schema_outdated(self):
+        return schema_version(self.conn) < len(MIGRATIONS)
+
+
+    def time_hot_queries(self, repeat=5):
+        url_ids = [row[0] for row in self.conn.execute("SELECT id FROM urls").fetchall()]
+        best = None
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            for url_id in url_ids:
+                self.conn.execute(self.ALL_MACS_BY_URL_SQL, (url_id, Settings.MAX_FAILED_STATUS_ATTEMPTS)).fetchall()
+                self.conn.execute(self.NEWEST_WORKING_MAC_FOR_URL_SQL, (url_id, STATUS.SUCCESS.value)).fetchall()
+                self.conn.execute(self.CHANNEL_HEALTH_BY_URL_SQL, (url_id,)).fetchall()
+            elapsed = time.perf_counter() - start_time
+            best = elapsed if best is None else min(best, elapsed)
+        return best or 0.0
+
+
+    # Page counts and number of MACs - file_size is the size of the file after a WAL checkpoint
+    def get_storage_stats(self):
+        page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return {
+            "file_size": page_size * page_count,
+            "page_size": page_size,
+            "page_count": page_count,
+            "freelist_count": freelist_count,
+            "macs": self.conn.execute("SELECT COUNT(*) AS macs FROM macs").fetchone()[0],
+        }
+
+
+    def _dead_macs_params(self, failed_days, expired_days):
+        now = datetime.now()
+        return (
+            STATUS.SUCCESS.value,
+            Settings.MAX_FAILED_STATUS_ATTEMPTS,
+            (now - timedelta(days=failed_days)).strftime("%Y-%m-%d %H:%M:%S"),
+            (now - timedelta(days=expired_days)).strftime("%Y-%m-%d"),
         )
-        self.conn.commit()
+
+
+    def count_dead_macs(self, failed_days, expired_days):
+        return self.conn.execute(
+            f"SELECT COUNT(*) AS macs FROM macs WHERE {self.DEAD_MACS_WHERE}",
+            self._dead_macs_params(failed_days, expired_days)
+        ).fetchone()[0]
+
+
+    # Move dead MACs to macs_archive of the database archive_path - returns the number of MACs moved
+    def archive_dead_macs(self, archive_path, failed_days, expired_days):
+        params = self._dead_macs_params(failed_days, expired_days)
+
+        def archive(conn):
+            # ATTACH and DETACH are not allowed inside a transaction
+            conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+            try:
+                conn.execute(self.ARCHIVE_TABLE_SQL)
+                conn.execute(
+                    self.ARCHIVE_DEAD_MACS_SQL,
+                    (Settings.MAX_FAILED_STATUS_ATTEMPTS, self._current_timestamp()) + params
+                )
+                # in WAL mode the commit is atomic per file only - the archive is written first and
+                # INSERT OR REPLACE makes a repeated run after a partial commit harmless
+                cursor = conn.execute(f"DELETE FROM macs WHERE {self.DEAD_MACS_WHERE}", params)
+                conn.commit()
+                return cursor.rowcount
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.execute("DETACH DATABASE archive")
+
+        return self._write(archive)
+
+
+    # Delete finished runs started more than days ago with their run_macs and queue_jobs
+    def prune_runs(self, days):
+        cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+        def prune(conn):
+            old_runs = "SELECT id FROM runs WHERE status != 'RUNNING' AND started < ?"
+            conn.execute(f"DELETE FROM run_macs WHERE run_id IN ({old_runs})", (cutoff,))
+            conn.execute(f"DELETE FROM queue_jobs WHERE run_id IN ({old_runs})", (cutoff,))
+            return conn.execute("DELETE FROM runs WHERE status != 'RUNNING' AND started < ?", (cutoff,)).rowcount
+
+        return self._write(prune)
+
+
+    # Refresh the statistics of the query planner
+    def optimize(self):
+        def analyze(conn):
+            conn.execute("ANALYZE")
+            conn.execute("PRAGMA optimize")
+        self._write(analyze)
+
+
+    # Rebuild the file without free pages - needs free disk space of about the database size
+    def vacuum(self):
+        def vacuum(conn):
+            conn.execute("VACUUM")
+            # VACUUM of a WAL database goes through the WAL, the file shrinks with the checkpoint
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._write(vacuum)
+
 
     def close(self):
-        self.conn.close()
\ No newline at end of file
+        if self.conn is None:
+            return
+        try:
+            if self._writer is not None:
+                # writes all queued rows before the thread ends
+                self._writer.close()
+                self._writer = None
+        finally:
+            if not self.read_only:
+                atexit.unregister(self.flush_mac_status)
+            self.conn.close()
+            self.conn = None
\ No newline at end of file
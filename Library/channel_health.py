@@ -0,0 +1,104 @@
+# class to pick the channels a MAC check validates, based on the channel outcomes of a portal
+import random
+import threading
+from datetime import datetime, timedelta
+
+from Library.Settings import Settings
+
+
+# success/failure counts, last success and startup latency per channel name of one portal
+class ChannelHealth:
+    def __init__(self, rows=()):
+        self._lock = threading.Lock()
+        self.channels = {}
+        for row in rows:
+            self.channels[row.name] = {
+                "success_count": row.success_count or 0,
+                "failure_count": row.failure_count or 0,
+                "last_success": self.__parse_timestamp(row.last_success),
+                "startup_ms": row.startup_ms,
+                "cmd": row.cmd,
+                "genre_id": row.genre_id,
+            }
+
+
+    @staticmethod
+    def __parse_timestamp(value):
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return None
+
+
+    @staticmethod
+    def __is_recent(last_success, now):
+        return last_success is not None and now - last_success <= timedelta(hours=Settings.CHANNEL_HEALTH_RECENT_HOURS)
+
+
+    def known_channels(self, genre_id, loaded_names, now=None):
+        # channel data of the recently working channels of a genre that are not on the loaded
+        # pages - with a sample of the pages they would rarely be candidates otherwise
+        now = now or datetime.now()
+        with self._lock:
+            return [
+                {"id": f"known:{name}", "name": name, "cmd": health["cmd"], "logo": None}
+                for name, health in self.channels.items()
+                if health["cmd"] and health["genre_id"] == str(genre_id) and name not in loaded_names
+                and self.__is_recent(health["last_success"], now)
+            ]
+
+
+    def weight(self, name, now=None):
+        # unknown channels weigh 1, channels that played recently up to CHANNEL_HEALTH_RECENT_WEIGHT,
+        # channels that only ever failed less with every failure
+        with self._lock:
+            health = self.channels.get(name)
+        if health is None:
+            return 1.0
+
+        success_count = health["success_count"]
+        failure_count = health["failure_count"]
+        last_success = health["last_success"]
+        now = now or datetime.now()
+        if self.__is_recent(last_success, now):
+            success_ratio = success_count / max(1, success_count + failure_count)
+            return 1.0 + (Settings.CHANNEL_HEALTH_RECENT_WEIGHT - 1.0) * success_ratio
+        if success_count:
+            return 1.0
+        return 1.0 / (1 + failure_count)
+
+
+    def pick(self, channels, count):
+        # Weighted random sample without replacement - a channel is never picked twice
+        now = datetime.now()
+        keyed = []
+        for channel in channels:
+            weight = self.weight(channel.name, now)
+            keyed.append((random.random() ** (1.0 / weight), channel))
+        keyed.sort(key=lambda item: item[0], reverse=True)
+        return [channel for _, channel in keyed[:count]]
+
+
+    def record(self, name, success, startup_ms=None, cmd=None, genre_id=None):
+        with self._lock:
+            health = self.channels.setdefault(name, {
+                "success_count": 0,
+                "failure_count": 0,
+                "last_success": None,
+                "startup_ms": None,
+                "cmd": None,
+                "genre_id": None,
+            })
+            if cmd:
+                health["cmd"] = cmd
+                health["genre_id"] = genre_id
+            if success:
+                health["success_count"] += 1
+                health["last_success"] = datetime.now()
+                if startup_ms is not None:
+                    old = health["startup_ms"]
+                    health["startup_ms"] = startup_ms if old is None else (old * 3 + startup_ms) / 4
+            else:
+                health["failure_count"] += 1
@@ -0,0 +1,99 @@
+# class to stop checking the MACs of a portal host that is down
+import logging
+import time
+
+from Library.Settings import STATUS
+from Library.Settings import Settings
+
+
+# result message prefix of a failed login in CHECK_macs.py - identical login errors open the circuit
+LOGIN_FAILED_PREFIX = "Login failed"
+
+
+# Per host state of the MAC scheduler (only used from the scheduling thread): open after
+# CIRCUIT_BREAKER_FAILURES unreachable results or CIRCUIT_BREAKER_SAME_ERRORS identical login
+# errors, the MACs of the host are held for CIRCUIT_BREAKER_COOLDOWN_SECONDS, then one probe is
+# checked - it closes the circuit, or marks the host down if it fails too
+class HostCircuitBreaker:
+    def __init__(self):
+        self.hosts = {}
+
+
+    def __get(self, host):
+        return self.hosts.setdefault(host, {
+            "failures": 0,
+            "last_error": None,
+            "same_errors": 0,
+            "opened_at": None,
+            "probing": False,
+            "probe_failed": False,
+        })
+
+
+    def is_open(self, host):
+        state = self.hosts.get(host)
+        if state is None or state["opened_at"] is None or state["probing"]:
+            return False
+        return time.monotonic() - state["opened_at"] < Settings.CIRCUIT_BREAKER_COOLDOWN_SECONDS
+
+
+    def is_down(self, host):
+        # the probe after the cool-down failed - the remaining MACs of the host are not checked
+        state = self.hosts.get(host)
+        return state is not None and state["probe_failed"]
+
+
+    def cooldown_left(self, host):
+        # seconds until the probe of an open circuit - None if the circuit is not open
+        if not self.is_open(host):
+            return None
+        return Settings.CIRCUIT_BREAKER_COOLDOWN_SECONDS - (time.monotonic() - self.hosts[host]["opened_at"])
+
+
+    def acquire(self, host):
+        # True if a MAC of the host may be checked now - only one probe while the circuit is half open
+        state = self.hosts.get(host)
+        if state is None or state["opened_at"] is None:
+            return True
+        if state["probing"] or self.is_open(host):
+            return False
+        state["probing"] = True
+        logging.info(f"Host {host}: cool-down over, probing with one MAC")
+        return True
+
+
+    def record(self, host, status, message=""):
+        if not Settings.CIRCUIT_BREAKER_ENABLED:
+            return
+        state = self.__get(host)
+        probing = state["probing"]
+        state["probing"] = False
+
+        if status == STATUS.UNREACHABLE:
+            state["failures"] += 1
+            state["last_error"] = None
+            state["same_errors"] = 0
+            tripped = state["failures"] >= Settings.CIRCUIT_BREAKER_FAILURES
+        elif status == STATUS.ERROR and (message or "").startswith(LOGIN_FAILED_PREFIX):
+            state["failures"] = 0
+            if message == state["last_error"]:
+                state["same_errors"] += 1
+            else:
+                state["last_error"] = message
+                state["same_errors"] = 1
+            tripped = state["same_errors"] >= Settings.CIRCUIT_BREAKER_SAME_ERRORS
+        else:
+            # the portal answered - any other result closes the circuit
+            if state["opened_at"] is not None:
+                logging.info(f"Host {host}: reachable again, circuit closed")
+            self.hosts.pop(host, None)
+            return
+
+        if probing:
+            logging.warning(f"Host {host}: probe failed, remaining MACs not checked - {message}")
+            state["probe_failed"] = True
+            state["opened_at"] = time.monotonic()
+        elif tripped:
+            if state["opened_at"] is None:
+                logging.warning(f"Host {host}: circuit open for {Settings.CIRCUIT_BREAKER_COOLDOWN_SECONDS}s - {message}")
+            state["opened_at"] = time.monotonic()
@@ -0,0 +1,196 @@
+# Local working copy of the database. DB_PATH usually lies in a OneDrive folder whose sync client
+# locks and uploads the file after every commit. With DB_LOCAL_COPY_ENABLED the checker and the
+# scrapers work on DB_LOCAL_COPY_PATH instead and a DB_Snapshot thread writes the copy back with
+# the sqlite3 backup API every DB_SNAPSHOT_INTERVAL_SECONDS and at exit.
+#
+# Every snapshot raises sync_meta.generation. A copy is only written back while the synced file
+# still has the generation the copy was taken at, so a machine with a stale copy never overwrites
+# the snapshot of another machine.
+import atexit
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from Library.Settings import Settings
+from Library.Sqllite import connect_database
+from Library.migrations import migrate
+
+
+def read_generation(conn):
+    # (generation, machine, updated) of a database - generation 0 for files without sync_meta
+    try:
+        row = conn.execute("SELECT generation, machine, updated FROM sync_meta WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        return 0, None, None
+    return tuple(row) if row else (0, None, None)
+
+
+def get_generation(path):
+    conn = connect_database(path, read_only=True)
+    try:
+        return read_generation(conn)[0]
+    finally:
+        conn.close()
+
+
+def copy_database(source_path, target_path):
+    # consistent copy of a database that may be in use, also of its uncheckpointed WAL content
+    source = connect_database(source_path, read_only=True)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+# writes the local copy back every DB_SNAPSHOT_INTERVAL_SECONDS and on close() - refused once
+# another machine wrote a newer generation, the local copy is then set aside by use_local_copy()
+class DB_Snapshot(threading.Thread):
+    def __init__(self, local_path, synced_path, changed=True):
+        super().__init__(name="IPTV_DB_Snapshot", daemon=True)
+        self.local_path = local_path
+        self.synced_path = synced_path
+        self.machine = socket.gethostname()
+        self.stale = False
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._conn = connect_database(local_path)
+        # PRAGMA data_version changes with every commit of another connection, e.g. the DB_Writer
+        self._data_version = None if changed else self.__data_version()
+
+
+    def __data_version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+    def run(self):
+        while not self._stop_event.wait(Settings.DB_SNAPSHOT_INTERVAL_SECONDS):
+            self.snapshot()
+
+
+    def snapshot(self):
+        with self._lock:
+            if self.stale or self._conn is None:
+                return False
+            data_version = self.__data_version()
+            if data_version == self._data_version:
+                return True
+            if not self.__write_back():
+                return False
+            self._data_version = data_version
+            return True
+
+
+    def __write_back(self):
+        generation = read_generation(self._conn)[0]
+        synced_exists = os.path.exists(self.synced_path)
+        try:
+            synced = sqlite3.connect(self.synced_path, timeout=Settings.DB_BUSY_TIMEOUT_MS / 1000)
+        except sqlite3.Error as e:
+            logging.error(f"Database snapshot to {self.synced_path} failed: {e}")
+            return False
+
+        try:
+            if synced_exists:
+                synced_generation, machine, updated = read_generation(synced)
+                if synced_generation != generation:
+                    self.stale = True
+                    logging.error(
+                        f"Database snapshot refused: {self.synced_path} has generation {synced_generation} "
+                        f"(written by {machine} at {updated}), the local copy {self.local_path} is based on "
+                        f"generation {generation}. The local copy is kept and not written back."
+                    )
+                    return False
+
+            start_time = time.perf_counter()
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE sync_meta SET generation = ?, machine = ?, updated = ? WHERE id = 1",
+                    (generation + 1, self.machine, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                )
+            try:
+                self._conn.backup(synced)
+                # no WAL side files in the synced folder - the snapshot is a single file
+                synced.execute("PRAGMA journal_mode = DELETE")
+            except Exception:
+                with self._conn:
+                    self._conn.execute("UPDATE sync_meta SET generation = ? WHERE id = 1", (generation,))
+                raise
+            logging.info(f"Database snapshot {generation + 1} written to {self.synced_path} in {time.perf_counter() - start_time:.1f}s")
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Database snapshot to {self.synced_path} failed: {e}")
+            return False
+        finally:
+            synced.close()
+
+
+    def close(self):
+        # final snapshot - called at exit, after the IPTV_Database connections wrote their rows
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.snapshot()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        atexit.unregister(self.close)
+
+
+def _set_aside(path, suffix):
+    for ext in ("", "-wal", "-shm"):
+        if os.path.exists(path + ext):
+            os.replace(path + ext, f"{path}{suffix}{ext}")
+
+
+def use_local_copy():
+    # switch Settings.DB_PATH to the local working copy if DB_LOCAL_COPY_ENABLED is set.
+    # Returns the started DB_Snapshot thread or None.
+    if not Settings.DB_LOCAL_COPY_ENABLED:
+        return None
+    synced_path = Settings.DB_PATH
+    local_path = Settings.DB_LOCAL_COPY_PATH
+    if os.path.abspath(local_path) == os.path.abspath(synced_path):
+        logging.warning(f"DB_LOCAL_COPY_PATH is DB_PATH, working on {synced_path} directly")
+        return None
+
+    changed = True
+    if os.path.exists(synced_path):
+        synced_generation = get_generation(synced_path)
+        if os.path.exists(local_path):
+            local_generation = get_generation(local_path)
+            if local_generation != synced_generation:
+                # another machine wrote a snapshot after this copy was taken - nothing is overwritten,
+                # changes of the old copy that were never written back stay in the stale file
+                suffix = f".stale-{local_generation}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+                _set_aside(local_path, suffix)
+                logging.warning(
+                    f"Local database copy of generation {local_generation} is stale, {synced_path} has "
+                    f"generation {synced_generation}. Old copy kept as {local_path}{suffix}"
+                )
+        if not os.path.exists(local_path):
+            os.makedirs(os.path.dirname(os.path.abspath(local_path)), exist_ok=True)
+            start_time = time.perf_counter()
+            copy_database(synced_path, local_path)
+            changed = False
+            logging.info(f"Database {synced_path} copied to {local_path} in {time.perf_counter() - start_time:.1f}s")
+
+    # a synced file of an older release gets sync_meta here
+    conn = connect_database(local_path)
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+
+    Settings.DB_PATH = local_path
+    snapshot = DB_Snapshot(local_path, synced_path, changed)
+    snapshot.start()
+    atexit.register(snapshot.close)
+    logging.info(f"Working on the local database copy {local_path}, snapshots to {synced_path} every {Settings.DB_SNAPSHOT_INTERVAL_SECONDS} seconds")
+    return snapshot
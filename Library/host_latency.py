@@ -0,0 +1,94 @@
+# class to derive the request timeouts of a portal or stream host from its measured latency
+import threading
+from collections import defaultdict, deque
+
+from Library.Settings import Settings
+from Library.scheduler import get_host
+from Library.stats import RunStats
+
+
+# EWMA and p95 of the response time per host: read timeout HOST_TIMEOUT_FACTOR x p95, connect
+# timeout HOST_CONNECT_TIMEOUT_FACTOR x EWMA, clamped to their floor, ceiling and the default of
+# the request. Timeouts are no samples - a host with recent timeouts gets the default timeout
+# until its timeout count decayed with the following answers. EWMA and p95 are persisted.
+class HostLatency:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ewma = {}
+        self.p95 = {}
+        self.samples = defaultdict(lambda: deque(maxlen=Settings.HOST_LATENCY_WINDOW))
+        # timeouts per host, decayed by HOST_LATENCY_ALPHA with every answer
+        self.timeouts = defaultdict(float)
+        self.changed = set()
+
+
+    @staticmethod
+    def __clamp(value, floor, ceiling):
+        return max(floor, min(ceiling, value))
+
+
+    def timeout(self, url, default):
+        # (connect, read) timeout in seconds for a request to the host of url
+        if not Settings.HOST_TIMEOUT_ADAPTIVE:
+            return default, default
+        host = get_host(url)
+        with self._lock:
+            ewma = self.ewma.get(host)
+            p95 = self.__p95(host)
+            timed_out = self.timeouts.get(host, 0) >= 0.5
+        if ewma is None or p95 is None or timed_out:
+            return min(default, Settings.HOST_CONNECT_TIMEOUT_MAX_SECONDS), default
+        connect = self.__clamp(ewma * Settings.HOST_CONNECT_TIMEOUT_FACTOR,
+                               Settings.HOST_CONNECT_TIMEOUT_MIN_SECONDS, Settings.HOST_CONNECT_TIMEOUT_MAX_SECONDS)
+        read = self.__clamp(p95 * Settings.HOST_TIMEOUT_FACTOR,
+                            Settings.HOST_TIMEOUT_MIN_SECONDS, Settings.HOST_TIMEOUT_MAX_SECONDS)
+        return min(connect, default), min(read, default)
+
+
+    def __p95(self, host):
+        samples = self.samples.get(host)
+        if samples and len(samples) >= Settings.HOST_LATENCY_MIN_SAMPLES:
+            return RunStats.percentile(samples, 95)
+        # the value of an earlier run until enough requests of this run were measured
+        return self.p95.get(host)
+
+
+    def observe(self, url, seconds):
+        host = get_host(url)
+        with self._lock:
+            ewma = self.ewma.get(host)
+            alpha = Settings.HOST_LATENCY_ALPHA
+            self.ewma[host] = seconds if ewma is None else (1 - alpha) * ewma + alpha * seconds
+            self.samples[host].append(seconds)
+            if host in self.timeouts:
+                self.timeouts[host] *= 1 - alpha
+            if len(self.samples[host]) >= Settings.HOST_LATENCY_MIN_SAMPLES:
+                self.p95[host] = RunStats.percentile(self.samples[host], 95)
+            elif host not in self.p95:
+                self.p95[host] = seconds
+            self.changed.add(host)
+
+
+    def observe_timeout(self, url, timeout):
+        # counted apart from the samples - a dead host must not push up p95 and its timeouts
+        host = get_host(url)
+        with self._lock:
+            self.timeouts[host] += 1
+
+
+    # rows of host, ewma, p95 of the host_latency table
+    def load(self, rows):
+        with self._lock:
+            for row in rows:
+                if row.ewma is not None and row.p95 is not None:
+                    self.ewma[row.host] = row.ewma
+                    self.p95[row.host] = row.p95
+
+
+    # (host, ewma, p95, samples) of the hosts measured in this run
+    def rows(self):
+        with self._lock:
+            return [(host, self.ewma[host], self.p95[host], len(self.samples[host])) for host in sorted(self.changed)]
+
+
+host_latency = HostLatency()
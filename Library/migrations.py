@@ -0,0 +1,233 @@
+# Versioned schema of the IPTV database. PRAGMA user_version is the number of migrations applied,
+# so an up-to-date database costs one PRAGMA read per connection. New tables, columns and
+# indexes are added as a new function at the end of MIGRATIONS - never by changing an existing one.
+import logging
+
+from Library.Settings import Settings
+
+
+def column_exists(conn, table_name, column_name):
+    return any(row[1] == column_name for row in conn.execute(f"PRAGMA table_info({table_name})").fetchall())
+
+
+def add_column(conn, table_name, column_name, definition):
+    # ALTER TABLE ADD COLUMN fails for an existing column - see the note above MIGRATIONS
+    if not column_exists(conn, table_name, column_name):
+        conn.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}")
+
+
+def _baseline(conn):
+    # schema as it was created by create_tables on every connection - databases of all earlier
+    # releases start at user_version 0
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS urls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT UNIQUE
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS macs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url_id INTEGER,
+            mac TEXT,
+            expiration DATE,
+            status TEXT,
+            error TEXT,
+            adult BOOLEAN,
+            german BOOLEAN,
+            last_updated TEXT,
+            failed INTEGER DEFAULT 0,
+            FOREIGN KEY(url_id) REFERENCES urls(id),
+            UNIQUE(url_id, mac)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS channels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            mac_id INTEGER,
+            stream_id INTEGER,
+            name TEXT,
+            logo TEXT,
+            german BOOLEAN,
+            adult BOOLEAN, 
+            austrian BOOLEAN,
+            FOREIGN KEY(mac_id) REFERENCES macs(id),
+            FOREIGN KEY(stream_id) REFERENCES streams(id),
+            UNIQUE(mac_id, name)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS streams (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT,
+            failed INTEGER DEFAULT 0,
+            UNIQUE(url)
+        )
+    """)
+    add_column(conn, "macs", "last_updated", "TEXT")
+
+
+def _hot_query_indexes(conn):
+    # secondary indexes for the hot queries, the UNIQUE constraints cover urls.url and macs(url_id, mac)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_macs_url_status_updated ON macs(url_id, status, last_updated)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_macs_url_failed_expiration ON macs(url_id, failed, expiration)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_macs_status_updated ON macs(status, last_updated)")
+
+
+def _mac_tokens(conn):
+    # portal token of a MAC for the login with a stored token
+    add_column(conn, "macs", "token", "TEXT")
+    add_column(conn, "macs", "token_timestamp", "REAL")
+
+
+def _channel_health(conn):
+    # channel health per portal, see Library/channel_health.py
+    add_column(conn, "channels", "url_id", "INTEGER REFERENCES urls(id)")
+    add_column(conn, "channels", "success_count", "INTEGER DEFAULT 0")
+    add_column(conn, "channels", "failure_count", "INTEGER DEFAULT 0")
+    add_column(conn, "channels", "last_success", "TEXT")
+    add_column(conn, "channels", "last_checked", "TEXT")
+    add_column(conn, "channels", "startup_ms", "REAL")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_channels_url_name ON channels(url_id, name)")
+
+
+def _stream_verdicts(conn):
+    # working streams of earlier runs for the stream cache, see Library/stream_cache.py
+    add_column(conn, "streams", "last_success", "TEXT")
+    add_column(conn, "streams", "last_checked", "TEXT")
+    add_column(conn, "streams", "real_url", "TEXT")
+
+
+def _host_latency(conn):
+    # measured latency per host for the adaptive timeouts, see Library/host_latency.py
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS host_latency (
+            host TEXT PRIMARY KEY,
+            ewma REAL,
+            p95 REAL,
+            samples INTEGER DEFAULT 0,
+            last_updated TEXT
+        )
+    """)
+
+
+def _run_journal(conn):
+    # run journal of CHECK_macs.py - which MACs a run has finished, for --resume
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started TEXT,
+            finished TEXT,
+            status TEXT,
+            parameters TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS run_macs (
+            run_id INTEGER,
+            mac_id INTEGER,
+            status TEXT,
+            known_good BOOLEAN DEFAULT 0,
+            completed TEXT,
+            FOREIGN KEY(run_id) REFERENCES runs(id),
+            FOREIGN KEY(mac_id) REFERENCES macs(id),
+            PRIMARY KEY(run_id, mac_id)
+        )
+    """)
+
+
+def _queue_jobs(conn):
+    # leasable jobs of a run in queue mode, see QUEUE_check_macs.py
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS queue_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id INTEGER,
+            url_id INTEGER,
+            mac_id INTEGER,
+            priority REAL DEFAULT 0,
+            known_good BOOLEAN DEFAULT 0,
+            state TEXT,
+            worker TEXT,
+            lease_token TEXT,
+            lease_until REAL,
+            attempts INTEGER DEFAULT 0,
+            status TEXT,
+            error TEXT,
+            german BOOLEAN,
+            adult BOOLEAN,
+            collected BOOLEAN DEFAULT 0,
+            FOREIGN KEY(run_id) REFERENCES runs(id),
+            FOREIGN KEY(url_id) REFERENCES urls(id),
+            FOREIGN KEY(mac_id) REFERENCES macs(id),
+            UNIQUE(run_id, mac_id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_queue_jobs_run_state ON queue_jobs(run_id, state, priority)")
+
+
+def _sync_meta(conn):
+    # generation of the database file for the local working copy, see Library/db_sync.py
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sync_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER DEFAULT 0,
+            machine TEXT,
+            updated TEXT
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO sync_meta (id, generation) VALUES (1, 0)")
+
+
+def _run_kind(conn):
+    # CHECK_macs.py and queue runs are resumed and abandoned separately
+    add_column(conn, "runs", "kind", "TEXT DEFAULT 'check'")
+    conn.execute("UPDATE runs SET kind = 'queue' WHERE parameters LIKE '%\"queue\": true%'")
+
+
+def _channel_cmds(conn):
+    # cmd and genre of channels that need create_link - tried directly by ChannelHealth.known_channels
+    add_column(conn, "channels", "cmd", "TEXT")
+    add_column(conn, "channels", "genre_id", "TEXT")
+
+
+# MIGRATIONS[i] brings a database from user_version i to i + 1. Every step tolerates tables,
+# columns and indexes that exist already.
+MIGRATIONS = [
+    _baseline,
+    _hot_query_indexes,
+    _mac_tokens,
+    _channel_health,
+    _stream_verdicts,
+    _host_latency,
+    _run_journal,
+    _queue_jobs,
+    _sync_meta,
+    _run_kind,
+    _channel_cmds,
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    # apply the pending migrations in one transaction - returns the number of migrations applied
+    if schema_version(conn) >= len(MIGRATIONS):
+        return 0
+
+    # the write lock first, another process may be migrating the same file right now
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = schema_version(conn)
+        for number in range(version, len(MIGRATIONS)):
+            MIGRATIONS[number](conn)
+        conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    applied = max(0, len(MIGRATIONS) - version)
+    if applied:
+        logging.info(f"Database {Settings.DB_PATH} migrated from schema version {version} to {len(MIGRATIONS)}")
+    return applied
@@ -0,0 +1,330 @@
+# Offline stand-in for a Stalker portal and its stream server - used by BENCH_check_macs.py.
+# Speaks both APIs of the project:
+#   /portal.php                        (Library/stalker.py, CHECK_macs.py)
+#   /stalker_portal/server/load.php    (stalker.py)
+# and serves the streams behind create_link:
+#   /play/live.php?stream=<id>         302 redirect to the stream like real portals do
+#   /stream/<id>.ts                    MPEG-TS with PAT and PMT
+#   /stream/<id>.m3u8                  HLS media playlist with /stream/<id>/<n>.ts segments
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+TS_PACKET_SIZE = 188
+PMT_PID = 0x100
+VIDEO_PID = 0x101
+
+
+def _ts_packet(pid, payload, payload_unit_start=True):
+    header = bytes([0x47, (0x40 if payload_unit_start else 0x00) | (pid >> 8), pid & 0xFF, 0x10])
+    body = (bytes([0]) + payload) if payload_unit_start else payload
+    return (header + body).ljust(TS_PACKET_SIZE, b"\xff")
+
+
+def build_ts_payload(packets=200):
+    # one PAT, one PMT with an H.264 stream and filler packets on the video PID
+    pat = bytes([0x00, 0xB0, 13, 0, 1, 0xC1, 0, 0, 0, 1, 0xE0 | (PMT_PID >> 8), PMT_PID & 0xFF]) + b"\0\0\0\0"
+    elementary_stream = bytes([0x1B, 0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0x00])
+    pmt_body = bytes([0, 1, 0xC1, 0, 0, 0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0x00]) + elementary_stream
+    pmt = bytes([0x02, 0xB0, len(pmt_body) + 4]) + pmt_body + b"\0\0\0\0"
+    filler = b"".join(_ts_packet(VIDEO_PID, b"\0" * 16, payload_unit_start=False) for _ in range(packets))
+    return _ts_packet(0, pat) + _ts_packet(PMT_PID, pmt) + filler
+
+
+def _fraction(*parts):
+    # deterministic value in [0, 1) - the same MAC or stream behaves the same in every run
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") / 2 ** 32
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # probes close the connection as soon as they have seen enough bytes
+        logging.debug(f"Mock portal connection from {client_address} ended early")
+
+
+# portal with genres * pages * page_size channels, knobs: latency, error_rate, dead MACs,
+# dead/undecided streams, stream_format (ts/hls), need_profile - unknown tokens get "Authorization failed."
+class MockPortal:
+    RELEVANT_GENRE_NAMES = ("DE: SPORT", "DE: NEWS", "DE: MOVIES", "AT: ORF", "XXX: ADULT")
+    OTHER_GENRE_NAMES = ("UK: SPORT", "FR: GENERAL", "IT: CINEMA", "US: NEWS", "ES: DEPORTES", "PL: INFO")
+
+    def __init__(self, host="127.0.0.1", port=0, genres=8, relevant_genres=3, pages=3, page_size=14,
+                 latency_ms=20, latency_jitter_ms=10, error_rate=0.0, dead_macs=(), dead_mac_rate=0.0,
+                 dead_stream_rate=0.0, undecided_stream_rate=0.0, stream_format="ts", need_profile=False,
+                 seed=None):
+        self.host = host
+        self.port = port
+        self.genres = genres
+        self.relevant_genres = min(relevant_genres, genres)
+        self.pages = pages
+        self.page_size = page_size
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.dead_macs = {mac.upper() for mac in dead_macs}
+        self.dead_mac_rate = dead_mac_rate
+        self.dead_stream_rate = dead_stream_rate
+        self.undecided_stream_rate = undecided_stream_rate
+        self.stream_format = stream_format
+        self.need_profile = need_profile
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._issued_tokens = set()
+        self._active_tokens = set()
+        self.ts_payload = build_ts_payload()
+        self.requests = {}
+        self._server = None
+        self._thread = None
+
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+
+    def start(self):
+        portal = self
+
+        class Handler(MockPortalHandler):
+            pass
+        Handler.portal = portal
+
+        self._server = _MockHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"MockPortal-{self.port}", daemon=True)
+        self._thread.start()
+        logging.debug(f"Mock portal listening on {self.url}")
+        return self
+
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+    # --- behaviour -------------------------------------------------------------------------
+
+    def count_request(self, name):
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+
+    def delay(self):
+        with self._lock:
+            jitter = self._random.uniform(-self.latency_jitter_ms, self.latency_jitter_ms) if self.latency_jitter_ms else 0
+            fail = self._random.random() < self.error_rate
+        seconds = max(0, self.latency_ms + jitter) / 1000
+        if seconds:
+            time.sleep(seconds)
+        return fail
+
+
+    def noise(self, size):
+        with self._lock:
+            return self._random.randbytes(size)
+
+
+    def is_dead_mac(self, mac):
+        mac = (mac or "").upper()
+        return mac in self.dead_macs or _fraction(self.port, "mac", mac) < self.dead_mac_rate
+
+
+    def issue_token(self):
+        with self._lock:
+            token = "".join(self._random.choices("ABCDEF0123456789", k=32))
+            self._issued_tokens.add(token)
+            if not self.need_profile:
+                self._active_tokens.add(token)
+        return token
+
+
+    def activate_token(self, token):
+        with self._lock:
+            if token in self._issued_tokens:
+                self._active_tokens.add(token)
+                return True
+        return False
+
+
+    def is_token_active(self, token):
+        with self._lock:
+            return token in self._active_tokens
+
+
+    def genre_list(self):
+        names = list(self.RELEVANT_GENRE_NAMES[:self.relevant_genres])
+        other = self.OTHER_GENRE_NAMES
+        while len(names) < self.genres:
+            names.append(f"{other[len(names) % len(other)]} {len(names)}")
+        return [{"id": str(index + 1), "title": name, "alias": name.lower()} for index, name in enumerate(names)]
+
+
+    def channel_page(self, genre_id, page):
+        # Stalker pages are 1-based, p=0 returns the first page as well
+        page = max(1, page)
+        genre_id = int(genre_id) if str(genre_id).isdigit() else 1
+        total_items = self.pages * self.page_size
+        data = []
+        if page <= self.pages:
+            for i in range(self.page_size):
+                channel_id = genre_id * 10000 + (page - 1) * self.page_size + i
+                data.append({
+                    "id": str(channel_id),
+                    "name": f"Channel {genre_id}-{(page - 1) * self.page_size + i + 1}",
+                    "number": str(channel_id),
+                    "cmd": f"ffmpeg http://localhost/ch/{channel_id}_",
+                    "logo": "",
+                })
+        return {"total_items": total_items, "max_page_items": self.page_size, "cur_page": page, "data": data}
+
+
+    def stream_kind(self, stream_id):
+        value = _fraction(self.port, "stream", stream_id)
+        if value < self.dead_stream_rate:
+            return "dead"
+        if value < self.dead_stream_rate + self.undecided_stream_rate:
+            return "undecided"
+        return "ok"
+
+
+    def stream_path(self, stream_id):
+        return f"/stream/{stream_id}.m3u8" if self.stream_format == "hls" else f"/stream/{stream_id}.ts"
+
+
+class MockPortalHandler(BaseHTTPRequestHandler):
+
+    portal = None
+    protocol_version = "HTTP/1.1"
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        try:
+            if parsed.path.endswith(("/portal.php", "/server/load.php")):
+                self.handle_api(query)
+            elif parsed.path.endswith("/play/live.php"):
+                self.handle_play(query)
+            elif parsed.path.startswith("/stream/"):
+                self.handle_stream(parsed.path)
+            else:
+                self.send_body(404, b"Not found", "text/plain")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+    def send_body(self, code, body, content_type, headers=None):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def send_js(self, js):
+        self.send_body(200, json.dumps({"js": js}).encode("utf-8"), "text/javascript")
+
+
+    def request_mac(self):
+        for part in self.headers.get("Cookie", "").split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == "mac":
+                return unquote(value.strip('"'))
+        return None
+
+
+    def request_token(self):
+        authorization = self.headers.get("Authorization", "")
+        return authorization[len("Bearer "):] if authorization.startswith("Bearer ") else ""
+
+
+    def handle_api(self, query):
+        portal = self.portal
+        action = query.get("action", "")
+        portal.count_request(action or "unknown")
+        if portal.delay():
+            self.send_body(500, b"Internal Server Error", "text/plain")
+            return
+
+        if action == "handshake":
+            if portal.is_dead_mac(self.request_mac()):
+                self.send_js({})
+            else:
+                self.send_js({"token": portal.issue_token(), "random": portal.noise(16).hex()})
+            return
+
+        token = self.request_token()
+        if action == "get_profile":
+            if not portal.activate_token(token):
+                self.send_body(200, b"Authorization failed.", "text/html")
+                return
+            self.send_js({"id": 1, "name": self.request_mac(), "status": 0, "token": token})
+            return
+
+        if not portal.is_token_active(token):
+            self.send_body(200, b"Authorization failed.", "text/html")
+            return
+
+        if action == "get_main_info":
+            self.send_js({"mac": self.request_mac(), "phone": "2099-12-31 23:59:59"})
+        elif action == "get_genres":
+            self.send_js(portal.genre_list())
+        elif action == "get_ordered_list":
+            self.send_js(portal.channel_page(query.get("genre", "1"), int(query.get("p", "1") or 1)))
+        elif action == "create_link":
+            stream_id = "".join(ch for ch in query.get("cmd", "") if ch.isdigit()) or "0"
+            self.send_js({"id": stream_id, "cmd": f"ffmpeg {portal.url}/play/live.php?stream={stream_id}&extension=ts"})
+        else:
+            self.send_js({})
+
+
+    def handle_play(self, query):
+        portal = self.portal
+        portal.count_request("play")
+        portal.delay()
+        stream_id = query.get("stream", "0")
+        self.send_body(302, b"", "text/plain", {"Location": portal.url + portal.stream_path(stream_id)})
+
+
+    def handle_stream(self, path):
+        portal = self.portal
+        portal.count_request("stream")
+        portal.delay()
+        name = path[len("/stream/"):]
+        stream_id = name.split("/")[0].split(".")[0]
+        kind = portal.stream_kind(stream_id)
+        if kind == "dead":
+            self.send_body(404, b"Not found", "text/plain")
+        elif name.endswith(".m3u8"):
+            segments = "".join(f"#EXTINF:6.0,\n/stream/{stream_id}/{n}.ts\n" for n in range(3))
+            playlist = f"#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:6\n#EXT-X-MEDIA-SEQUENCE:0\n{segments}"
+            self.send_body(200, playlist.encode("utf-8"), "application/vnd.apple.mpegurl")
+        elif kind == "undecided":
+            self.send_body(200, portal.noise(4096), "video/mp2t")
+        else:
+            self.send_body(200, portal.ts_payload, "video/mp2t")
@@ -0,0 +1,91 @@
+# stages of the pipeline engine of CHECK_macs.py and the entry points of its validation processes
+import logging
+import queue
+import threading
+import time
+
+from Library.Settings import Settings
+from Library.stalker import configure_vlc_parallel, validate_stream_url
+from Library.stats import run_stats
+
+
+# one pipeline stage: a bounded input queue and worker threads calling handler(item) - the
+# handler hands the item to the next stage, exceptions go to on_error(item, exc)
+class PipelineStage:
+    def __init__(self, name, handler, workers, queue_size, on_error=None):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.on_error = on_error or (lambda item, exc: logging.error(f"Pipeline stage {name}: {exc}"))
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._lock = threading.Lock()
+        self._threads = []
+        self.busy = 0
+        self.processed = 0
+        self.max_depth = 0
+
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.__run, name=f"{self.name}-{index + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+
+    def put(self, item):
+        # blocks while the queue is full
+        self._queue.put((time.perf_counter(), item))
+        depth = self._queue.qsize()
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+
+
+    def depth(self):
+        return self._queue.qsize()
+
+
+    def status(self):
+        with self._lock:
+            busy = self.busy
+        return f"{self.name}: queued={self.depth()}, busy={busy}/{self.workers}"
+
+
+    def __run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            queued_at, item = entry
+            run_stats.record(f"queue_{self.name}", time.perf_counter() - queued_at)
+            with self._lock:
+                self.busy += 1
+            try:
+                self.handler(item)
+            except Exception as exc:
+                self.on_error(item, exc)
+            finally:
+                with self._lock:
+                    self.busy -= 1
+                    self.processed += 1
+
+
+    def stop(self):
+        # the queue is drained when the pipeline is finished, one stop marker per thread
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+# entry points of the processes of a validation process pool - each process validates one stream
+# at a time with its own VLC player, the statistics go back to the run_stats of the main process
+def init_validation_process(log_level, log_format):
+    logging.basicConfig(level=log_level, format=log_format)
+    configure_vlc_parallel(1)
+
+
+def validate_in_process(stream_url):
+    run_stats.reset()
+    status, message = validate_stream_url(stream_url)
+    return status, message, run_stats.snapshot()
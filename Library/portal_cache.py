@@ -0,0 +1,81 @@
+# class to share genre and channel listings of a portal between the MACs of one run
+import hashlib
+import threading
+import time
+
+from Library.Settings import Settings
+from Library.stats import run_stats
+
+
+# genre and channel lists per portal for PORTAL_CACHE_TTL_SECONDS - with PORTAL_CACHE_FINGERPRINT
+# only used while total_items and page 0 are unchanged
+class PortalCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._genres = {}
+        self._channels = {}
+
+
+    @staticmethod
+    def fingerprint(first_page_json):
+        js = (first_page_json or {}).get("js", {}) or {}
+        ids = ",".join(str(item.get("id")) for item in js.get("data", []) or [])
+        return hashlib.sha1(f"{js.get('total_items', 0)}|{ids}".encode("utf-8")).hexdigest()
+
+
+    def __lookup(self, entries, key, fingerprint=None, count_miss=True):
+        if not Settings.PORTAL_CACHE_ENABLED:
+            return None
+        with self._lock:
+            entry = entries.get(key)
+            if entry is not None:
+                timestamp, entry_fingerprint, data = entry
+                if time.monotonic() - timestamp > Settings.PORTAL_CACHE_TTL_SECONDS or \
+                        (fingerprint is not None and fingerprint != entry_fingerprint):
+                    del entries[key]
+                    entry = None
+            if entry is None:
+                if count_miss:
+                    run_stats.increment("portal_cache_miss")
+                return None
+        run_stats.increment("portal_cache_hit")
+        return data
+
+
+    def __store(self, entries, key, data, fingerprint=None):
+        if not Settings.PORTAL_CACHE_ENABLED:
+            return
+        with self._lock:
+            entries[key] = (time.monotonic(), fingerprint, data)
+
+
+    # raw 'js' list of get_genres
+    def get_genres(self, base_url):
+        return self.__lookup(self._genres, base_url)
+
+    def put_genres(self, base_url, genre_data):
+        self.__store(self._genres, base_url, genre_data)
+
+
+    # raw channel dicts of all get_ordered_list pages of a genre, or of a random sample of
+    # its pages (sampled=True) - a sampled lookup is answered by the complete list as well
+    def get_channels(self, base_url, genre_id, fingerprint=None, sampled=False):
+        if sampled:
+            data = self.__lookup(self._channels, (base_url, genre_id), fingerprint, count_miss=False)
+            if data is not None:
+                return data
+            return self.__lookup(self._channels, (base_url, genre_id, "sample"), fingerprint)
+        return self.__lookup(self._channels, (base_url, genre_id), fingerprint)
+
+    def put_channels(self, base_url, genre_id, channels_data, fingerprint=None, sampled=False):
+        key = (base_url, genre_id, "sample") if sampled else (base_url, genre_id)
+        self.__store(self._channels, key, channels_data, fingerprint)
+
+
+    def clear(self):
+        with self._lock:
+            self._genres.clear()
+            self._channels.clear()
+
+
+portal_cache = PortalCache()
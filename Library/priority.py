@@ -0,0 +1,73 @@
+# scores to check the most valuable URLs and MACs first, e.g. for runs with --budget-minutes
+from datetime import date, datetime
+
+from Library.Settings import STATUS
+from Library.Settings import Settings
+
+
+# value of checking a MAC again by its last status - unknown MACs and working ones are worth most
+STATUS_PRIORITY = {
+    None: 1.0,
+    STATUS.SUCCESS.value: 1.0,
+    STATUS.SKIPPED.value: 0.8,
+    STATUS.CONTENT.value: 0.5,
+    STATUS.ERROR.value: 0.4,
+    STATUS.UNREACHABLE.value: 0.4,
+    STATUS.LOGIN.value: 0.2,
+}
+
+
+def _parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(str(value)[:19], "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def staleness(last_updated, now):
+    # 0 for data checked just now up to 1 for data older than PRIORITY_STALE_HOURS or never checked
+    timestamp = _parse_timestamp(last_updated)
+    if timestamp is None:
+        return 1.0
+    return max(0.0, min(1.0, (now - timestamp).total_seconds() / 3600 / Settings.PRIORITY_STALE_HOURS))
+
+
+def mac_priority(mac_item, now=None):
+    now = now or datetime.now()
+    score = Settings.PRIORITY_WEIGHT_STALENESS * staleness(mac_item.last_updated, now)
+    score += Settings.PRIORITY_WEIGHT_STATUS * STATUS_PRIORITY.get((mac_item.status or "").strip().upper() or None, 0.5)
+    score -= Settings.PRIORITY_WEIGHT_FAILED * min(mac_item.failed or 0, Settings.MAX_FAILED_STATUS_ATTEMPTS) / max(1, Settings.MAX_FAILED_STATUS_ATTEMPTS)
+
+    expiration = _parse_date(mac_item.expiration)
+    if expiration is not None:
+        days_left = (expiration - now.date()).days
+        if days_left < 0:
+            score -= Settings.PRIORITY_WEIGHT_EXPIRATION
+        else:
+            # a MAC valid for a year or longer gets the full bonus
+            score += Settings.PRIORITY_WEIGHT_EXPIRATION * min(days_left, 365) / 365
+    return score
+
+
+def url_priority(url_history, now=None):
+    # url_history: row of macs, working_macs, last_checked, last_success of a portal
+    now = now or datetime.now()
+    if url_history is None or not url_history.macs:
+        return 0.0
+    score = Settings.PRIORITY_WEIGHT_STALENESS * staleness(url_history.last_checked, now)
+    score += Settings.PRIORITY_WEIGHT_PORTAL * (url_history.working_macs or 0) / url_history.macs
+    if url_history.last_success is not None:
+        # a portal that worked recently is likely to work again
+        score += Settings.PRIORITY_WEIGHT_PORTAL * (1.0 - staleness(url_history.last_success, now))
+    return score
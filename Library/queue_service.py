@@ -0,0 +1,171 @@
+# small HTTP service in front of the worker side queue methods of IPTV_Database - workers on
+# other machines lease, renew and report jobs through it, the SQLite file stays on the machine
+# of the coordinator (WAL locking does not work over network filesystems)
+import hmac
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from enum import Enum
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from Library.Settings import Settings
+
+
+# IPTV_Database methods a worker calls - the only ones the service answers
+QUEUE_SERVICE_METHODS = (
+    "get_unfinished_run",
+    "get_run_status",
+    "lease_jobs",
+    "renew_job_leases",
+    "report_job",
+    "get_channel_health_by_url",
+    "queue_channel_result",
+    "queue_mac_token",
+    "get_host_latencies",
+    "save_host_latencies",
+)
+
+
+def _encode(value):
+    # rows keep their column names, enums are sent as their value
+    if hasattr(value, "_asdict"):
+        return {"__row__": {name: _encode(item) for name, item in value._asdict().items()}}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict) and "__row__" in value:
+        row = value["__row__"]
+        return namedtuple("Row", row.keys())(*(_decode(item) for item in row.values()))
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+class _QueueHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class QueueServiceHandler(BaseHTTPRequestHandler):
+    db = None
+    protocol_version = "HTTP/1.1"
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def do_POST(self):
+        method = self.path.strip("/")
+        token = Settings.QUEUE_SERVICE_TOKEN
+        if token and not hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {token}"):
+            return self.send_json(403, {"error": "Authorization failed"})
+        if method not in QUEUE_SERVICE_METHODS:
+            return self.send_json(404, {"error": f"Unknown method {method}"})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0) or 0)) or b"{}")
+            result = getattr(self.db, method)(*request.get("args", []), **request.get("kwargs", {}))
+        except Exception as e:
+            logging.warning(f"Queue service: {method} failed - {e}")
+            return self.send_json(500, {"error": str(e)})
+        self.send_json(200, {"result": _encode(result)})
+
+
+    def send_json(self, code, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+# runs in the coordinator process on its IPTV_Database
+class QueueService:
+    def __init__(self, db, host="0.0.0.0", port=Settings.QUEUE_SERVICE_PORT):
+        self.db = db
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+    def start(self):
+        class Handler(QueueServiceHandler):
+            pass
+        Handler.db = self.db
+
+        self._server = _QueueHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"QueueService-{self.port}", daemon=True)
+        self._thread.start()
+        if not Settings.QUEUE_SERVICE_TOKEN:
+            logging.warning("Queue service without IPTV_QUEUE_TOKEN - any host that reaches the port can lease jobs")
+        logging.info(f"Queue service listening on {self.host}:{self.port}")
+        return self
+
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# stand-in for IPTV_Database in a worker on another machine - same method names and results
+class QueueClient:
+    def __init__(self, url, token=None):
+        self.url = url.rstrip("/")
+        self.token = Settings.QUEUE_SERVICE_TOKEN if token is None else token
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+    def __getattr__(self, name):
+        if name in QUEUE_SERVICE_METHODS:
+            return partial(self.call, name)
+        raise AttributeError(name)
+
+
+    def call(self, method, *args, **kwargs):
+        # the coordinator may be busy or restarting - QUEUE_SERVICE_RETRIES attempts before giving up
+        data = json.dumps({"args": _encode(list(args)), "kwargs": {name: _encode(value) for name, value in kwargs.items()}}).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        for attempt in range(Settings.QUEUE_SERVICE_RETRIES + 1):
+            try:
+                with urlopen(Request(f"{self.url}/{method}", data=data, headers=headers), timeout=Settings.QUEUE_SERVICE_TIMEOUT_SECONDS) as response:
+                    return _decode(json.loads(response.read())["result"])
+            except HTTPError:
+                raise
+            except OSError as e:
+                if attempt == Settings.QUEUE_SERVICE_RETRIES:
+                    raise
+                logging.warning(f"Queue service {self.url} not reachable ({getattr(e, 'reason', e)}), retrying")
+                time.sleep(Settings.QUEUE_POLL_SECONDS)
+
+
+    def close(self):
+        pass
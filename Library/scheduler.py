@@ -0,0 +1,235 @@
+# class to schedule the MAC checks of all URLs in one global pool
+import logging
+import time
+from collections import defaultdict, deque
+from urllib.parse import urlparse
+
+from Library.Settings import STATUS
+from Library.circuit_breaker import HostCircuitBreaker
+
+
+def get_host(url):
+    parsed_url = urlparse(url if "://" in url else f"http://{url}")
+    return (parsed_url.hostname or url).lower()
+
+
+class MAC_Job:
+    def __init__(self, task, counter, mac_item, known_good=False):
+        self.task = task
+        self.counter = counter
+        self.mac_item = mac_item
+        self.known_good = known_good
+
+    @property
+    def url(self):
+        return self.task.url
+
+    @property
+    def prefix(self):
+        if self.known_good:
+            return self.task.prefix
+        return f"{self.task.prefix} MAC[{self.counter}/{self.task.total_macs}]"
+
+
+class URL_Task:
+    # State of one URL: an optional known good MAC that is checked first and the remaining MACs
+    def __init__(self, index, total_urls, url, known_mac, macs):
+        self.index = index
+        self.url = url
+        self.host = get_host(url)
+        self.prefix = f"URL[{index}/{total_urls}]"
+        self.known_mac = known_mac
+        self.pending = deque(enumerate(macs, start=1))
+        self.total_macs = len(macs)
+        self.waiting_known = False
+        self.stopped = False
+        self.success = None
+        self.in_flight = 0
+        self.completed = 0
+        self.status_counts = {state.value: 0 for state in STATUS}
+        # ChannelHealth of the URL, shared by all its MAC jobs
+        self.channel_health = None
+
+    def is_done(self):
+        return self.known_mac is None and not self.waiting_known and not self.pending and self.in_flight == 0
+
+
+# Interleaves the MAC jobs of all URLs: at most max_workers jobs in flight overall and at most
+# max_per_host against one host, URLs are activated lazily in order. The MACs of a host with an
+# open circuit are held until its probe, after a failed probe they are reported as
+# STATUS.UNREACHABLE through on_result. After the optional deadline (time.monotonic()) no
+# further jobs are started. The callbacks load_task(index, url) -> URL_Task or None,
+# on_result(job, result), on_skipped(job) and on_finished(task) run on the scheduling thread.
+class MAC_Scheduler:
+    def __init__(self, urls, load_task, max_workers, max_per_host, process_all,
+                 on_result=None, on_skipped=None, on_finished=None, breaker=None, deadline=None):
+        self.urls = deque(enumerate(urls, start=1))
+        self.total_urls = len(urls)
+        self.load_task = load_task
+        self.max_workers = max(1, max_workers)
+        self.max_per_host = max(1, max_per_host)
+        self.process_all = process_all
+        self.on_result = on_result or (lambda job, result: None)
+        self.on_skipped = on_skipped or (lambda job: None)
+        self.on_finished = on_finished or (lambda task: None)
+        self.active = deque()
+        self.host_in_flight = defaultdict(int)
+        self.in_flight = 0
+        self.breaker = breaker or HostCircuitBreaker()
+        self.deadline = deadline
+        self.budget_exhausted = False
+
+
+    def has_capacity(self):
+        return self.in_flight < self.max_workers
+
+
+    def is_finished(self):
+        return not self.urls and not self.active and self.in_flight == 0
+
+
+    def next_job(self):
+        if not self.has_capacity():
+            return None
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            if not self.budget_exhausted:
+                self.budget_exhausted = True
+                logging.info("Time budget exhausted - no further MAC checks are started")
+            return None
+
+        # round robin over the active URLs
+        for _ in range(len(self.active)):
+            if not self.active:
+                break
+            task = self.active[0]
+            self.active.rotate(-1)
+            job = self.__take(task)
+            if job:
+                return job
+
+        # activate further URLs until one can supply a job
+        while self.urls:
+            index, url = self.urls.popleft()
+            task = self.load_task(index, url)
+            if task is None:
+                continue
+            self.active.append(task)
+            # a resumed run may already have a working MAC for the URL
+            if task.success == STATUS.SUCCESS and not self.process_all:
+                self.stop_task(task)
+            if self.__finish_if_done(task):
+                continue
+            job = self.__take(task)
+            if job:
+                return job
+
+        return None
+
+
+    def wait_seconds(self):
+        # seconds until a held host may be probed - None if no URL waits for a cool-down
+        if self.budget_exhausted:
+            return None
+        waits = [self.breaker.cooldown_left(task.host) for task in self.active
+                 if task.known_mac is not None or task.pending]
+        waits = [seconds for seconds in waits if seconds is not None]
+        if not waits:
+            return None
+        delay = min(waits)
+        if self.deadline is not None:
+            delay = min(delay, self.deadline - time.monotonic())
+        return max(0.1, delay)
+
+
+    def pending_macs(self):
+        # MACs not started yet: the pending ones of the active URLs, the URLs not activated are not counted
+        return sum(len(task.pending) + (1 if task.known_mac is not None else 0) for task in self.active)
+
+
+    def __take(self, task):
+        if task.waiting_known or task.stopped:
+            return None
+        if self.breaker.is_down(task.host):
+            self.short_circuit_task(task)
+            return None
+        if self.host_in_flight[task.host] >= self.max_per_host:
+            return None
+        if (task.known_mac is not None or task.pending) and not self.breaker.acquire(task.host):
+            return None
+
+        if task.known_mac is not None:
+            job = MAC_Job(task, 0, task.known_mac, known_good=True)
+            task.known_mac = None
+            task.waiting_known = True
+        elif task.pending:
+            counter, mac_item = task.pending.popleft()
+            job = MAC_Job(task, counter, mac_item)
+        else:
+            return None
+
+        task.in_flight += 1
+        self.host_in_flight[task.host] += 1
+        self.in_flight += 1
+        return job
+
+
+    def complete(self, job, result):
+        task = job.task
+        task.in_flight -= 1
+        self.host_in_flight[task.host] -= 1
+        self.in_flight -= 1
+
+        result_success = result[0]
+        self.breaker.record(task.host, result_success, result[1])
+        if job.known_good:
+            task.waiting_known = False
+        else:
+            task.completed += 1
+            result_key = result_success.value if isinstance(result_success, STATUS) else result_success
+            if result_key in task.status_counts:
+                task.status_counts[result_key] += 1
+
+        if result_success == STATUS.SUCCESS:
+            task.success = STATUS.SUCCESS
+        self.on_result(job, result)
+
+        # stop after the first working MAC of the URL
+        if task.success == STATUS.SUCCESS and not self.process_all and not task.stopped:
+            self.stop_task(task)
+
+        self.__finish_if_done(task)
+
+
+    def stop_task(self, task):
+        task.stopped = True
+        while task.pending:
+            counter, mac_item = task.pending.popleft()
+            task.completed += 1
+            task.status_counts[STATUS.SKIPPED.value] += 1
+            self.on_skipped(MAC_Job(task, counter, mac_item))
+
+
+    def short_circuit_task(self, task):
+        # the probe of the host failed - report the remaining MACs without checking them
+        result = (STATUS.UNREACHABLE, f"Host {task.host} unreachable, not checked", None, None)
+        if task.known_mac is not None:
+            job = MAC_Job(task, 0, task.known_mac, known_good=True)
+            task.known_mac = None
+            self.on_result(job, result)
+        while task.pending:
+            counter, mac_item = task.pending.popleft()
+            task.completed += 1
+            task.status_counts[STATUS.UNREACHABLE.value] += 1
+            self.on_result(MAC_Job(task, counter, mac_item), result)
+        self.__finish_if_done(task)
+
+
+    def __finish_if_done(self, task):
+        if task.is_done():
+            try:
+                self.active.remove(task)
+            except ValueError:
+                pass
+            self.on_finished(task)
+            return True
+        return False
@@ -1,27 +1,117 @@
 # class to handle the stalker functionality
 import logging
-import re
+import random
 import subprocess
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote, urlparse, urlunparse
 
 import requests
 from Library.Settings import STATUS
 from Library.Settings import Settings
-from Library.vlc_player import VLCPlayer
+from Library.vlc_player import VLCPlayer, VLCPlayerPool
+from Library.stream_probe import probe_stream
+from Library.stream_resolver import resolve_stream_url
+from Library.stats import run_stats
+from Library.host_latency import host_latency
+from Library.portal_cache import portal_cache
+from Library.stream_cache import stream_cache
 
 from colorama import init, Fore, Style
 
 
-_vlc_semaphore = threading.BoundedSemaphore(max(1, Settings.VLC_MAX_PARALLEL))
+_vlc_pool = VLCPlayerPool(max(1, Settings.VLC_MAX_PARALLEL))
+
+# says nothing about the stream, so this verdict is never cached
+VLC_SLOT_TIMEOUT_MESSAGE = "Timeout waiting for VLC validation slot"
 
 
 def configure_vlc_parallel(max_parallel):
-    global _vlc_semaphore
+    global _vlc_pool
     limit = max(1, int(max_parallel))
     Settings.VLC_MAX_PARALLEL = limit
-    _vlc_semaphore = threading.BoundedSemaphore(limit)
+    old_pool = _vlc_pool
+    _vlc_pool = VLCPlayerPool(limit)
+    old_pool.close()
+
+
+def clean_stream_url(stream_url):
+    # List of known prefixes to strip
+    known_prefixes = ["ffmpeg ", "ffrt3 "]  # Add any other prefixes here
+
+    # Strip any known prefix
+    for prefix in known_prefixes:
+        if stream_url.lower().startswith(prefix.lower()):
+            stream_url = stream_url[len(prefix):].strip()
+    return stream_url
+
+
+# Validate a stream URL - shared by the threaded and the asyncio check engine.
+# The native probe decides most streams, VLC only runs when the probe cannot decide.
+def validate_stream_url(stream_url):
+
+    stream_url = clean_stream_url(stream_url)
+
+    status, message = probe_stream_url(stream_url)
+    if status is not None:
+        return status, message
+
+    return validate_stream_url_with_vlc(stream_url)
+
+
+def probe_stream_url(stream_url):
+    if not Settings.STREAM_PROBE_ENABLED:
+        return None, "Stream probe disabled"
+
+    with run_stats.timer("probe"):
+        status, message = probe_stream(stream_url)
+    if status is not None:
+        run_stats.increment("validation_probe")
+    else:
+        logging.debug(f"{message} - falling back to VLC")
+    return status, message
+
+
+# Check if VLC can play the stream
+def validate_stream_url_with_vlc(stream_url):
+
+    run_stats.increment("validation_vlc")
+
+    # timed including the wait for a pooled player, so --vlc-workers contention shows up
+    with run_stats.timer("vlc"):
+        return _play_with_vlc(stream_url)
+
+
+def _play_with_vlc(stream_url):
+
+    vlc_player_instance = _vlc_pool.acquire(timeout=Settings.VLC_SEMAPHORE_TIMEOUT_SECONDS)
+    if vlc_player_instance is None:
+        return STATUS.ERROR, VLC_SLOT_TIMEOUT_MESSAGE
+
+    broken = True
+    try:
+        vlc_player_instance.set_media(stream_url)
+        vlc_player_instance.play()
+        for i in range(Settings.VLC_PLAYBACK_CHECK_ATTEMPTS):
+            is_playing = vlc_player_instance.is_playing()
+            playback_failed = vlc_player_instance.playback_failed()
+            if is_playing or playback_failed:
+                logging.debug(f"VLC playback status: is_playing={is_playing}, playback_failed={playback_failed}")
+                break
+            else:
+                logging.debug(f"Waiting for VLC to start playing the stream: {stream_url} (attempt {i+1})")
+                time.sleep(Settings.VLC_PLAYBACK_CHECK_INTERVAL_SECONDS)
+
+        result = vlc_player_instance.is_playing()
+        broken = False
+        if result:
+            return STATUS.SUCCESS, "VLC is playing the stream"
+        else:
+            return STATUS.ERROR, "VLC is not playing the stream"
+    finally:
+        # stops the player and recycles it if it reports State.Error
+        _vlc_pool.release(vlc_player_instance, broken=broken)
 
 
 class STK_Channel:
@@ -32,6 +122,7 @@ class STK_Channel:
         self.logo = logo
         self.channel_url = None
         self.real_url = None
+        self.verdict_cached = False
 
 
     def __enter__(self):
@@ -109,42 +200,11 @@ class STK_Channel:
             self.real_url = None
             return STATUS.ERROR, "No channel url set"
 
-        try:
-            headers = {
-            'User-Agent': 'Mozilla/5.0'
-            }
+        status, message, self.real_url = resolve_stream_url(self.channel_url)
+        if status != STATUS.SUCCESS:
+            logging.debug(f"[!] {message}")
+        return status, message
 
-            # Step 1: Send a GET request to the PHP proxy
-            response = requests.get(self.channel_url, headers=headers, stream=True, allow_redirects=True)
-
-            # Step 2: Check if the real URL is in the headers (e.g., via a Location redirect)
-            if response.history:
-                logging.debug("[*] Redirect chain detected:")
-                for resp in response.history:
-                    logging.debug(" →", resp.url)
-                logging.debug("[*] Final URL:", response.url)
-                self.real_url = response.url.strip()
-                return STATUS.SUCCESS, ""
-
-            # Step 3: Check for URL in the content (e.g., m3u8, mpd, etc.)
-            content_type = response.headers.get('Content-Type', '')
-            if 'application/vnd.apple.mpegurl' in content_type or '.m3u8' in response.text:
-                # Look for .m3u8 or similar URL in body
-                urls = re.findall(r'(https?://[^\s"\']+\.m3u8)', response.text)
-                if urls:
-                    logging.debug("[*] Stream URL found in response body")
-                    self.real_url = urls[0].strip()
-                    return STATUS.SUCCESS, ""
-
-            logging.debug("[!] Could not find real stream URL in headers or body")
-            self.real_url = None
-            return STATUS.ERROR, "Could not find real stream URL in headers or body"
-
-        except Exception as e:
-            logging.debug(f"[!] Error: {e}")
-            self.real_url = None
-            return STATUS.ERROR, f"Error at fetching real stream URL: {e}"
-    
 
     def get_url(self):
         # Get the channel url - preferred the real url or if not possible the url stored in channel
@@ -166,53 +226,72 @@ class STK_Channel:
 
 
 
-    def validate_url(self):
+    @staticmethod
+    def needs_create_link(cmd):
+        # the stream link of the MAC is created by the portal - the cmd itself holds no session
+        return bool(cmd) and "/ch/" in cmd and cmd.endswith("_")
 
-        # get the stream URL
-        status, message, stream_url = self.get_url()
+
+    def get_cached_verdict(self):
+        # A stream checked shortly before - also for another MAC - is neither resolved nor played again
+        server = self.genre.server
+        cached = stream_cache.get(clean_stream_url(self.channel_url), server.mac_address, server.authenticated)
+        if cached is None:
+            return None
+        self.real_url, status, message = cached
+        self.verdict_cached = True
+        return status, message
+
+
+    def get_cached_link_verdict(self):
+        # verdict of the stream another MAC got for this channel - create_link is not needed then
+        server = self.genre.server
+        cached = stream_cache.get_link(server.base_url, self.cmd, server.mac_address, server.authenticated)
+        if cached is None:
+            return None
+        self.channel_url, self.real_url, status, message = cached
+        self.verdict_cached = True
+        return status, message
+
+
+    def cache_verdict(self, status, message):
+        if message != VLC_SLOT_TIMEOUT_MESSAGE:
+            server = self.genre.server
+            stream_url = clean_stream_url(self.channel_url)
+            stream_cache.put(stream_url, self.real_url, status, message, mac=server.mac_address)
+            stream_cache.put_link(server.base_url, self.cmd, stream_url)
+
+
+    def prepare_url(self):
+        # the stream URL to validate - or None with the verdict if it is already decided
+        # (no stream link, cached verdict)
+        with run_stats.timer("resolve"):
+            if not self.channel_url:
+                verdict = self.get_cached_link_verdict()
+                if verdict is not None:
+                    return verdict[0], verdict[1], None
+                status, message = self.load_stream_url()
+                if status != STATUS.SUCCESS:
+                    return status, message, None
+            verdict = self.get_cached_verdict()
+            if verdict is not None:
+                return verdict[0], verdict[1], None
+            status, message, stream_url = self.get_url()
         if status != STATUS.SUCCESS:
-            return status, message
-        
-        # List of known prefixes to strip
-        known_prefixes = ["ffmpeg ", "ffrt3 "]  # Add any other prefixes here
+            return status, message, None
+        return status, message, stream_url
 
-        # Strip any known prefix
-       
-        for prefix in known_prefixes:
-            if stream_url.lower().startswith(prefix.lower()):
-                stream_url = stream_url[len(prefix):].strip()
 
-        # Log the final URL
-        #logging.info(f"{Fore.WHITE}Channel URL: {self.channel_url}")
-        #logging.info(f"Real URL: {self.real_url}")
-        #logging.info(f"Launching media player with cleaned URL: {stream_url}")
+    def validate_url(self):
 
-        # Check if VLC can play the stream
-        acquired = _vlc_semaphore.acquire(timeout=Settings.VLC_SEMAPHORE_TIMEOUT_SECONDS)
-        if not acquired:
-            return STATUS.ERROR, "Timeout waiting for VLC validation slot"
+        # get the stream URL
+        status, message, stream_url = self.prepare_url()
+        if stream_url is None:
+            return status, message
 
-        try:
-            with VLCPlayer(stream_url) as vlc_player_instance:
-                vlc_player_instance.play()
-                for i in range(Settings.VLC_PLAYBACK_CHECK_ATTEMPTS):
-                    is_playing = vlc_player_instance.is_playing()
-                    playback_failed = vlc_player_instance.playback_failed()
-                    if is_playing or playback_failed:
-                        logging.debug(f"VLC playback status: is_playing={is_playing}, playback_failed={playback_failed}")
-                        break
-                    else:
-                        logging.debug(f"Waiting for VLC to start playing the stream: {stream_url} (attempt {i+1})")
-                        time.sleep(Settings.VLC_PLAYBACK_CHECK_INTERVAL_SECONDS)
-
-                result = vlc_player_instance.is_playing()
-                if result:
-                    vlc_player_instance.stop()
-                    return STATUS.SUCCESS, "VLC is playing the stream"
-                else:
-                    return STATUS.ERROR, "VLC is not playing the stream"
-        finally:
-            _vlc_semaphore.release()
+        status, message = validate_stream_url(stream_url)
+        self.cache_verdict(status, message)
+        return status, message
 
 
 
@@ -222,9 +301,7 @@ class STK_Channel:
             # No command found for channel/episode
             return STATUS.ERROR, "No command found for channel/episode"
 
-        needs_create_link = False
-        if "/ch/" in cmd and cmd.endswith("_"):
-            needs_create_link = True
+        needs_create_link = self.needs_create_link(cmd)
 
         if needs_create_link:
             try:
@@ -252,19 +329,10 @@ class STK_Channel:
                     "Authorization": f"Bearer {token}",
                 }
                 create_link_url = f"{url}/portal.php?type=itv&action=create_link&cmd={cmd_encoded}&JsHttpRequest=1-xml"
-                response = self.genre.server.session.get(
-                    create_link_url,
-                    cookies=self.genre.server.cookies,
-                    headers=self.genre.server.headers,
-                    timeout=10,
-                )
-                response.raise_for_status()
-                json_response = response.json()
+                json_response = self.genre.server.get_json(create_link_url, timeout=10)
                 cmd_value = json_response.get("js", {}).get("cmd")
                 if cmd_value:
-                    if cmd.lower().startswith("ffmpeg"):
-                        cmd = cmd[6:].strip()
-                    self.channel_url = cmd_value
+                    self.channel_url = clean_stream_url(cmd_value)
                 else:
                     # Stream URL not found in the response.
                     return STATUS.ERROR, "No stream URL found for channel/episode"
@@ -283,6 +351,8 @@ class STK_Channel:
 
 
 class STK_Genre:
+    CHANNEL_CLASS = STK_Channel
+
     def __init__(self, server, name, category_type, catgeory_id):
         self.server = server
         self.name = name.upper()
@@ -309,78 +379,151 @@ class STK_Genre:
         return (self.is_adult() or self.is_german() or self.is_austrian())
     
 
-    def get_channels(self):
-        # Get live channels
+    def get_page_url(self, page):
+        return f"{self.server.base_url}/portal.php?type=itv&action=get_ordered_list&genre={self.category_id}&JsHttpRequest=1-xml&p={page}"
+
+
+    def build_channels(self, channels_data, channel_class=None):
+        # Remove duplicate channels based on 'id' and sort them by name
+        channel_class = channel_class or self.CHANNEL_CLASS
+        unique_channels = {}
+        for ch in channels_data:
+            cid = ch.get('id')
+            if cid and cid not in unique_channels:
+                unique_channels[cid] = channel_class(self, ch.get('name'), ch.get('cmd'), ch.get('logo'))
+        channels = list(unique_channels.values())
+        channels.sort(key=lambda x: x.name or "")
+        return channels
+
+
+    def select_pages(self, first_page_json, sample_pages=0):
+        # Pages to load after page 0 - all of them, or sample_pages random ones.
+        # Returns (pages, complete).
+        js = first_page_json.get("js", {})
+        total_items = int(js.get("total_items", 0) or 0)
+        items_per_page = len(js.get("data", []))
+        total_pages = (total_items + items_per_page - 1) // items_per_page if items_per_page else 1
+        remaining_pages = list(range(1, total_pages))
+        if sample_pages and len(remaining_pages) > sample_pages:
+            return sorted(random.sample(remaining_pages, sample_pages)), False
+        return remaining_pages, True
+
+
+    def __get_page(self, page):
+        channels_url = self.get_page_url(page)
+        logging.debug(f"Fetching page {page} URL: {channels_url}")
+        return self.server.get_json(channels_url, timeout=10)
+
+
+    def __get_pages(self, pages):
+        # Fetch pages with at most CHANNEL_PAGE_WORKERS requests in flight, results in page order
+        channels_data = []
+        workers = min(max(1, Settings.CHANNEL_PAGE_WORKERS), len(pages))
+        if workers <= 1:
+            page_results = [self.__get_page(p) for p in pages]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                page_results = list(executor.map(self.__get_page, pages))
+        for page_json in page_results:
+            channels_data.extend(page_json.get("js", {}).get("data", []))
+        return channels_data
+
+
+    def get_channels(self, sample_pages=0):
+        # Get live channels - from the portal cache if another MAC already listed this genre.
+        # With sample_pages only page 0 and sample_pages random pages are loaded, which is
+        # enough for callers that validate a few random channels.
         try:
-            channels = []
-            initial_url = f"{self.server.base_url}/portal.php?type=itv&action=get_ordered_list&genre={self.category_id}&JsHttpRequest=1-xml&p=0"
-            response = self.server.session.get(initial_url, cookies=self.server.cookies, headers=self.server.headers, timeout=10)
-            response.raise_for_status()
-            response_json = response.json()
-            if len(response_json.get("js", {})) > 0:
-                total_items = response_json.get("js", {}).get("total_items", 0)
-                items_per_page = len(response_json.get("js", {}).get("data", []))
-                total_pages = (total_items + items_per_page - 1) // items_per_page if items_per_page else 1
-                channels_data = response_json.get("js", {}).get("data", [])
-                channels.extend(channels_data)
-
-                # Fetch remaining pages in parallel
-                pages_to_fetch = list(range(1, total_pages))
-                if pages_to_fetch:
-                    future_to_page = {}
-                    for p in pages_to_fetch:
-                        channels_url = f"{self.server.base_url}/portal.php?type=itv&action=get_ordered_list&genre={self.category_id}&JsHttpRequest=1-xml&p={p}"
-                        logging.debug(f"Fetching page {p} URL: {channels_url}")
-                        
-                        response = self.server.session.get(channels_url, cookies=self.server.cookies, headers=self.server.headers, timeout=10)
-                        response.raise_for_status()
-                        response_json = response.json()
-                        page_channels = response_json.get("js", {}).get("data", [])
-                        channels.extend(page_channels)
-
-                # Remove duplicate channels based on 'id'
-                unique_channels = {}
-                for ch in channels:
-                    cid = ch.get('id')
-                    if cid and cid not in unique_channels:
-                        unique_channels[cid] = STK_Channel(self, ch.get('name'), ch.get('cmd'), ch.get('logo'))
-                        if ch.get('epg'):
-                            pass
-                channels = list(unique_channels.values())
-                channels.sort(key=lambda x: x.name)  # Sort channels by name
+            response_json = None
+            fingerprint = None
+            if Settings.PORTAL_CACHE_FINGERPRINT:
+                response_json = self.__get_page(0)
+                fingerprint = portal_cache.fingerprint(response_json)
+
+            channels_data = portal_cache.get_channels(self.server.base_url, self.category_id, fingerprint, sampled=sample_pages > 0)
+            if channels_data is None:
+                if response_json is None:
+                    response_json = self.__get_page(0)
+                if len(response_json.get("js", {})) > 0:
+                    pages, complete = self.select_pages(response_json, sample_pages)
+                    channels_data = list(response_json.get("js", {}).get("data", []))
+                    channels_data.extend(self.__get_pages(pages))
+                    run_stats.increment("channel_pages", len(pages) + 1)
+
+                    portal_cache.put_channels(self.server.base_url, self.category_id, channels_data, portal_cache.fingerprint(response_json), sampled=not complete)
+                else:
+                    # No channels found for this genre
+                    return STATUS.CONTENT, "No channels data found.", None
 
-            else:
-                # No channels found for this genre
-                return STATUS.CONTENT, "No channels data found.", None
+            channels = self.build_channels(channels_data)
         except Exception as e:
-            return STATUS.ERROR, f"An error occurred while retrieving channels: {str(e)}", None
+            return self.server.error_status(e), f"An error occurred while retrieving channels: {str(e)}", None
 
         return STATUS.SUCCESS, "", channels
 
+
+
 class STK_Server:
 
     STB_LANG = "en"
     STB_TIMEZONE = "Europe/London"
+    USER_AGENT = ("Mozilla/5.0 (QtEmbedded; U; Linux; C) "
+                  "AppleWebKit/533.3 (KHTML, like Gecko) "
+                  "MAG200 stbapp ver: 2 rev: 250 Safari/533.3")
 
+    # base URLs of portals that rejected a token without get_profile/get_main_info
+    FULL_LOGIN_HOSTS = set()
 
-    def __init__(self, hostname, mac_address):
+
+    def __init__(self, hostname, mac_address, token=None, token_timestamp=None):
 
         self.hostname = hostname
         self.mac_address = mac_address
-        self.token = None
-        self.token_timestamp = None
+        # a token of an earlier run is reused by login() until the portal rejects it
+        self.token = token
+        self.token_timestamp = token_timestamp
+        self.token_reused = False
+        self.fast_login = False
+        self.login_renewed = False
+        # set once the portal answered a request with the token of this MAC - before that a
+        # stream cached for another MAC says nothing about this one
+        self.authenticated = False
+        self._login_lock = threading.Lock()
+        self.cookies = None
+        self.headers = None
+
+        self.base_url = self.get_base_url(hostname)
+
+        self.session = requests.Session()
+
 
+    @staticmethod
+    def get_base_url(hostname):
         parsed_url = urlparse(hostname)
         if not parsed_url.scheme and not parsed_url.netloc:
             parsed_url = urlparse(f"http://{hostname}")
         elif not parsed_url.scheme:
             parsed_url = parsed_url._replace(scheme="http")
 
-        self.base_url = urlunparse(
+        return urlunparse(
             (parsed_url.scheme, parsed_url.netloc, "", "", "", "")
         )
 
-        self.session = requests.Session()
+
+    @staticmethod
+    def error_status(error):
+        # connection problems and server errors of the portal say nothing about the MAC
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return STATUS.UNREACHABLE
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None and error.response.status_code >= 500:
+            return STATUS.UNREACHABLE
+        return STATUS.ERROR
+
+
+    @staticmethod
+    def is_rejected_response(status_code, text):
+        # Stalker portals answer an unknown or expired token with "Authorization failed." (often HTTP 200)
+        return status_code in (401, 403) or "Authorization failed" in (text or "")[:200]
         
 
     def __enter__(self):
@@ -397,6 +540,19 @@ class STK_Server:
                 self.session = None
 
 
+    def request(self, url, cookies, headers, timeout=10):
+        # GET with the connect and read timeout learned for the host - timeout is the default
+        timeouts = host_latency.timeout(url, timeout)
+        start_time = time.perf_counter()
+        try:
+            response = self.session.get(url, cookies=cookies, headers=headers, timeout=timeouts)
+        except requests.exceptions.Timeout:
+            host_latency.observe_timeout(url, timeouts)
+            raise
+        host_latency.observe(url, time.perf_counter() - start_time)
+        return response
+
+
     # Reintroduce get_token for non-stalker portals
     def get_token(self):
         try:
@@ -407,27 +563,48 @@ class STK_Server:
                 "timezone": self.STB_TIMEZONE,
             }
             headers = {
-                "User-Agent": "Mozilla/5.0 (QtEmbedded; U; Linux; C) "
-                            "AppleWebKit/533.3 (KHTML, like Gecko) "
-                            "MAG200 stbapp ver: 2 rev: 250 Safari/533.3"
+                "User-Agent": self.USER_AGENT
             }
-            response = self.session.get(handshake_url, cookies=cookies, headers=headers, timeout=15)
+            response = self.request(handshake_url, cookies, headers, timeout=15)
             response.raise_for_status()
             token = response.json().get("js", {}).get("token")
             if token:
                 self.token = token
                 self.token_timestamp = time.time()
+                self.token_reused = False
+                self.set_auth()
                 return STATUS.SUCCESS, "Token retrieved"
             else:
                 logging.debug("Token not found in handshake response.")
+                self.token = None
+                self.token_timestamp = None
                 return STATUS.LOGIN, "Token not found in handshake response."
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            return STATUS.UNREACHABLE, f"Portal unreachable: {e}"
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code >= 500:
+                return STATUS.UNREACHABLE, f"Portal unreachable: {e}"
+            return STATUS.ERROR, f"Error getting token: {e}"
         except Exception as e:
             return STATUS.ERROR, f"Error getting token: {e}"
 
 
+    def set_auth(self):
+        self.cookies = {
+                    "mac": self.mac_address,
+                    "stb_lang": self.STB_LANG,
+                    "timezone": self.STB_TIMEZONE,
+                    "token": self.token,
+                }
+        self.headers = {
+                    "User-Agent": self.USER_AGENT,
+                    "Authorization": f"Bearer {self.token}",
+                }
+
+
     def is_token_valid(self):
-        # Assuming token is valid for 10 minutes
-        if self.token and (time.time() - self.token_timestamp) < 600:
+        # Tokens are kept for TOKEN_MAX_AGE_SECONDS - a rejected token is renewed earlier
+        if self.token and self.token_timestamp and (time.time() - self.token_timestamp) < Settings.TOKEN_MAX_AGE_SECONDS:
             return True
         return False
     
@@ -439,66 +616,152 @@ class STK_Server:
             return STATUS.SUCCESS, "Token is valid"
 
 
+    def needs_full_login(self):
+        return not Settings.LOGIN_FAST_MODE or self.base_url in self.FULL_LOGIN_HOSTS
+
 
     def login(self):
+        # Reuse the stored token - one get_profile instead of the handshake login
+        if Settings.TOKEN_REUSE_ENABLED and self.is_token_valid():
+            status, message = self.check_stored_token()
+            if status in (STATUS.SUCCESS, STATUS.UNREACHABLE):
+                return status, message
+
+        return self.handshake_login(full=self.needs_full_login())
+
+
+    def check_stored_token(self):
+        # One authenticated request before the stored token is relied on - the portal may be down
+        # and the genres and channels may come from the portal cache without any request.
+        # STATUS.LOGIN or ERROR: the token was rejected, a new one is needed.
+        status, message = self.confirm_token()
+        if status != STATUS.SUCCESS:
+            return status, message.replace("Token", "Stored token", 1)
+        self.token_reused = True
+        run_stats.increment("login_token_reused")
+        return STATUS.SUCCESS, "Login with stored token"
+
+
+    def confirm_token(self):
+        # get_profile with the token unless the portal already answered a request with it -
+        # STATUS.LOGIN if the portal rejects the token
+        if self.authenticated:
+            return STATUS.SUCCESS, ""
+        self.set_auth()
+        try:
+            profile_url = f"{self.base_url}/portal.php?type=stb&action=get_profile&JsHttpRequest=1-xml"
+            response = self.request(profile_url, self.cookies, self.headers)
+            if self.is_rejected_response(response.status_code, response.text):
+                logging.debug(f"Token rejected by {self.base_url}")
+                return STATUS.LOGIN, "Token rejected"
+            response.raise_for_status()
+        except Exception as e:
+            status = self.error_status(e)
+            if status == STATUS.UNREACHABLE:
+                return status, f"Portal unreachable: {e}"
+            return status, f"Token check failed: {e}"
+        self.authenticated = True
+        return STATUS.SUCCESS, ""
+
+
+    def handshake_login(self, full=True):
          # Non-stalker logic: use RequestThread
         status, message = self.get_token()
         if status != STATUS.SUCCESS:
             return status, message
 
-        self.cookies = {
-                    "mac": self.mac_address,
-                    "stb_lang": self.STB_LANG,
-                    "timezone": self.STB_TIMEZONE,
-                    "token": self.token,
-                }
-        self.headers = {
-                    "User-Agent": "Mozilla/5.0 (QtEmbedded; U; Linux; C) "
-                                "AppleWebKit/533.3 (KHTML, like Gecko) "
-                                "MAG200 stbapp ver: 2 rev: 250 Safari/533.3",
-                    "Authorization": f"Bearer {self.token}",
-                }
+        # Fast login: profile and account info are never used, most portals accept the token without them
+        self.fast_login = not full
+        if self.fast_login:
+            run_stats.increment("login_fast")
+            return STATUS.SUCCESS, "Login successful"
+        run_stats.increment("login_full")
 
         # Fetch profile and account info
         try:
             profile_url = f"{self.base_url}/portal.php?type=stb&action=get_profile&JsHttpRequest=1-xml"
-            response_profile = self.session.get(profile_url, cookies=self.cookies, headers=self.headers, timeout=10)
+            response_profile = self.request(profile_url, self.cookies, self.headers)
             response_profile.raise_for_status()
             profile_data = response_profile.json()
         except Exception as e:
             return STATUS.ERROR, f"Error fetching profile: {e}"
+        self.authenticated = True
 
         try:
             account_info_url = f"{self.base_url}/portal.php?type=account_info&action=get_main_info&JsHttpRequest=1-xml"
-            response_account_info = self.session.get(account_info_url, cookies=self.cookies, headers=self.headers, timeout=10)
+            response_account_info = self.request(account_info_url, self.cookies, self.headers)
             response_account_info.raise_for_status()
             account_info_data = response_account_info.json()
         except Exception as e:
             return STATUS.ERROR, f"Error fetching account info: {e}"
         
         return STATUS.SUCCESS, "Login successful"
+
+
+    def renew_login(self, rejected_token):
+        # Called when the portal rejects the token - once per server object: a new token with
+        # the full login (handshake, profile, account info) replaces a stored or fast login token.
+        # Parallel page requests share the renewal, a token renewed meanwhile is simply retried.
+        with self._login_lock:
+            if self.token and self.token != rejected_token:
+                return True
+            if self.login_renewed:
+                return False
+            self.login_renewed = True
+            logging.debug(f"Token rejected ({'stored' if self.token_reused else 'fast login' if self.fast_login else 'full login'}), renewing login for {self.base_url}")
+            run_stats.increment("login_renewed")
+            status, message = self.handshake_login(full=True)
+            if status != STATUS.SUCCESS:
+                logging.debug(f"Renewing login failed: {message}")
+                return False
+            return True
+
+
+    def get_json(self, url, timeout=10):
+        # GET a portal API url with the token of this server, renewing a rejected token once
+        fast_login = self.fast_login and not self.token_reused
+        token = self.token
+        response = self.request(url, self.cookies, self.headers, timeout)
+        if self.is_rejected_response(response.status_code, response.text) and self.renew_login(token):
+            response = self.request(url, self.cookies, self.headers, timeout)
+            if fast_login and not self.is_rejected_response(response.status_code, response.text):
+                # the portal needs profile and account info - do the full login for all further MACs
+                logging.info(f"Portal {self.base_url} needs the full login, fast login disabled for it")
+                self.FULL_LOGIN_HOSTS.add(self.base_url)
+        response.raise_for_status()
+        response_json = response.json()
+        self.authenticated = True
+        return response_json
     
 
+    def build_genres(self, genre_data, genre_class=None):
+        genre_class = genre_class or STK_Genre
+        genres = []
+        for i in genre_data:
+            genre = genre_class(
+                self,
+                name=i["title"],
+                category_type="IPTV",
+                catgeory_id=i["id"]
+            )
+            genres.append(genre)
+        return genres
+
+
     def get_genres(self):
-        # Get live genres
+        # Get live genres - from the portal cache if another MAC already listed them
         genres = None
         try:
-            genres_url = f"{self.base_url}/portal.php?type=itv&action=get_genres&JsHttpRequest=1-xml"
-            response = self.session.get(genres_url, cookies=self.cookies, headers=self.headers, timeout=10)
-            response.raise_for_status()
-            genre_data = response.json().get("js", [])
+            genre_data = portal_cache.get_genres(self.base_url)
+            if genre_data is None:
+                genres_url = f"{self.base_url}/portal.php?type=itv&action=get_genres&JsHttpRequest=1-xml"
+                genre_data = self.get_json(genres_url, timeout=10).get("js", [])
+                if genre_data:
+                    portal_cache.put_genres(self.base_url, genre_data)
             if genre_data:
-                genres = []
-                for i in genre_data:
-                    genre = STK_Genre(
-                        self,
-                        name=i["title"],
-                        category_type="IPTV",
-                        catgeory_id=i["id"]
-                    )
-                    genres.append(genre)
+                genres = self.build_genres(genre_data)
 
         except Exception as e:
-            return STATUS.ERROR, f"Error getting genres: {e}", None
+            return self.error_status(e), f"Error getting genres: {e}", None
         
-        return STATUS.SUCCESS, "", genres
\ No newline at end of file
+        return STATUS.SUCCESS, "", genres
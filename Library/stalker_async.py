@@ -0,0 +1,502 @@
+# asyncio variant of the stalker functionality - used by the asyncio check engine of CHECK_macs.py
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import quote, urljoin
+
+import aiohttp
+
+from Library.Settings import STATUS
+from Library.Settings import Settings
+from Library.host_latency import host_latency
+from Library.portal_cache import portal_cache
+from Library.stats import run_stats
+from Library.stream_resolver import HEADERS, REDIRECT_STATUS_CODES, find_m3u8_url, redirect_cache
+from Library.stalker import STK_Channel, STK_Genre, STK_Server, VLC_SLOT_TIMEOUT_MESSAGE, clean_stream_url, probe_stream_url, validate_stream_url_with_vlc
+
+
+def create_client_session(max_connections):
+    # One shared session for all MACs. The dummy cookie jar keeps the cookies of one MAC
+    # from leaking into the requests of another - cookies are passed per request instead.
+    connector = aiohttp.TCPConnector(limit=max(1, max_connections), ttl_dns_cache=300)
+    return aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+
+
+class STK_AsyncChannel:
+    def __init__(self, genre, name, cmd, logo):
+        self.genre = genre
+        self.name = name
+        self.cmd = cmd
+        self.logo = logo
+        self.channel_url = None
+        self.real_url = None
+        self.verdict_cached = False
+
+
+    # the stream cache is shared with the threaded engine
+    needs_create_link = staticmethod(STK_Channel.needs_create_link)
+    get_cached_verdict = STK_Channel.get_cached_verdict
+    get_cached_link_verdict = STK_Channel.get_cached_link_verdict
+    cache_verdict = STK_Channel.cache_verdict
+
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+    async def __load_real_stream_url(self):
+        logging.debug("Fetching real url...")
+        if not self.channel_url:
+            self.real_url = None
+            return STATUS.ERROR, "No channel url set"
+
+        self.real_url = redirect_cache.get(self.channel_url)
+        if self.real_url:
+            return STATUS.SUCCESS, ""
+
+        try:
+            status, message, self.real_url = await self.__resolve(self.channel_url)
+        except Exception as e:
+            logging.debug(f"[!] Error: {e}")
+            self.real_url = None
+            return STATUS.ERROR, f"Error at fetching real stream URL: {e}"
+
+        if status == STATUS.SUCCESS:
+            redirect_cache.put(self.channel_url, self.real_url)
+        else:
+            logging.debug(f"[!] {message}")
+        return status, message
+
+
+    async def __resolve(self, url):
+        # same bounds as resolve_stream_url of the threaded engine: timeout per hop, head of the body only
+        current_url = url
+        for hop in range(Settings.STREAM_RESOLVE_MAX_REDIRECTS + 1):
+            connect_timeout, read_timeout = (min(value, Settings.STREAM_RESOLVE_TIMEOUT_SECONDS) for value in
+                                             host_latency.timeout(current_url, Settings.STREAM_RESOLVE_TIMEOUT_SECONDS))
+            timeout = aiohttp.ClientTimeout(total=Settings.STREAM_RESOLVE_TIMEOUT_SECONDS, sock_connect=connect_timeout, sock_read=read_timeout)
+            start_time = time.perf_counter()
+            try:
+                response = await self.genre.server.session.get(current_url, headers=HEADERS, allow_redirects=False, timeout=timeout)
+            except asyncio.TimeoutError:
+                host_latency.observe_timeout(current_url, (connect_timeout, read_timeout))
+                raise
+            host_latency.observe(current_url, time.perf_counter() - start_time)
+
+            async with response:
+                location = response.headers.get('Location')
+                if response.status in REDIRECT_STATUS_CODES and location:
+                    current_url = urljoin(current_url, location.strip())
+                    continue
+
+                if response.status >= 400:
+                    return STATUS.ERROR, f"Real stream URL: HTTP {response.status}", None
+                if hop:
+                    return STATUS.SUCCESS, "", current_url
+
+                content_type = response.headers.get('Content-Type', '')
+                data = await response.content.read(Settings.STREAM_RESOLVE_MAX_BODY_BYTES)
+                # leaving the block releases the connection without reading the rest of a live stream
+                response.close()
+
+            m3u8_url = find_m3u8_url(data, content_type)
+            if m3u8_url:
+                return STATUS.SUCCESS, "", m3u8_url
+            return STATUS.ERROR, "Could not find real stream URL in headers or body", None
+
+        return STATUS.ERROR, f"More than {Settings.STREAM_RESOLVE_MAX_REDIRECTS} redirects", None
+
+
+    async def get_url(self):
+        # Get the channel url - preferred the real url or if not possible the url stored in channel
+        if self.real_url:
+            stream_url = self.real_url
+        else:
+            if not self.channel_url:
+                status, message = await self.load_stream_url()
+                if status != STATUS.SUCCESS:
+                    return status, message, None
+
+            status, message = await self.__load_real_stream_url()
+            if status == STATUS.SUCCESS:
+                stream_url = self.real_url
+            else:
+                stream_url = self.channel_url.strip()
+
+        return STATUS.SUCCESS, "", stream_url
+
+
+    async def validate_url(self):
+
+        # get the stream URL
+        with run_stats.timer("resolve"):
+            if not self.channel_url:
+                verdict = self.get_cached_link_verdict()
+                if verdict is not None:
+                    return verdict
+                status, message = await self.load_stream_url()
+                if status != STATUS.SUCCESS:
+                    return status, message
+            verdict = self.get_cached_verdict()
+            if verdict is not None:
+                return verdict
+            status, message, stream_url = await self.get_url()
+        if status != STATUS.SUCCESS:
+            return status, message
+
+        status, message = await self.__validate_stream_url(clean_stream_url(stream_url))
+        self.cache_verdict(status, message)
+        return status, message
+
+
+    async def __validate_stream_url(self, stream_url):
+
+        # The native probe only does bounded network reads and needs no VLC slot
+        status, message = await asyncio.to_thread(probe_stream_url, stream_url)
+        if status is not None:
+            return status, message
+
+        # The playback check blocks, so it runs in a worker thread. The slot is taken before
+        # the thread is started, so waiting MACs do not park threads of the default executor.
+        slots = self.genre.server.validation_slots
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=Settings.VLC_SEMAPHORE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            return STATUS.ERROR, VLC_SLOT_TIMEOUT_MESSAGE
+
+        try:
+            return await asyncio.to_thread(validate_stream_url_with_vlc, stream_url)
+        finally:
+            slots.release()
+
+
+    async def load_stream_url(self):
+        cmd = self.cmd
+        if not cmd:
+            # No command found for channel/episode
+            return STATUS.ERROR, "No command found for channel/episode"
+
+        needs_create_link = self.needs_create_link(cmd)
+
+        if needs_create_link:
+            try:
+                server = self.genre.server
+
+                # Refresh token if needed
+                status, message = await server.validate_token()
+                if status != STATUS.SUCCESS:
+                    return status, message
+
+                cmd_encoded = quote(cmd)
+                create_link_url = f"{server.base_url}/portal.php?type=itv&action=create_link&cmd={cmd_encoded}&JsHttpRequest=1-xml"
+                json_response = await server.get_json(create_link_url, timeout=10)
+                cmd_value = json_response.get("js", {}).get("cmd")
+                if cmd_value:
+                    self.channel_url = clean_stream_url(cmd_value)
+                else:
+                    # Stream URL not found in the response.
+                    return STATUS.ERROR, "No stream URL found for channel/episode"
+            except Exception as e:
+                # Error creating stream link
+                return STATUS.ERROR, "Error creating stream link: " + str(e)
+        else:
+            # Strip 'ffmpeg ' prefix if present
+            if cmd.startswith("ffmpeg "):
+                cmd = cmd[len("ffmpeg "):]
+
+            self.channel_url = cmd
+
+        return STATUS.SUCCESS, ""
+
+
+
+class STK_AsyncGenre(STK_Genre):
+    CHANNEL_CLASS = STK_AsyncChannel
+
+    async def __get_pages(self, pages):
+        # same bound as the threaded engine: at most CHANNEL_PAGE_WORKERS requests in flight
+        slots = asyncio.Semaphore(max(1, Settings.CHANNEL_PAGE_WORKERS))
+
+        async def get_page(page):
+            async with slots:
+                logging.debug(f"Fetching page {page} URL: {self.get_page_url(page)}")
+                return await self.server.get_json(self.get_page_url(page), timeout=10)
+
+        channels_data = []
+        for page_json in await asyncio.gather(*(get_page(p) for p in pages)):
+            channels_data.extend(page_json.get("js", {}).get("data", []))
+        return channels_data
+
+
+    async def get_channels(self, sample_pages=0):
+        # Get live channels - shares the portal cache with the threaded engine
+        try:
+            response_json = None
+            fingerprint = None
+            if Settings.PORTAL_CACHE_FINGERPRINT:
+                response_json = await self.server.get_json(self.get_page_url(0), timeout=10)
+                fingerprint = portal_cache.fingerprint(response_json)
+
+            channels_data = portal_cache.get_channels(self.server.base_url, self.category_id, fingerprint, sampled=sample_pages > 0)
+            if channels_data is None:
+                if response_json is None:
+                    response_json = await self.server.get_json(self.get_page_url(0), timeout=10)
+                if len(response_json.get("js", {})) > 0:
+                    pages, complete = self.select_pages(response_json, sample_pages)
+                    channels_data = list(response_json.get("js", {}).get("data", []))
+                    channels_data.extend(await self.__get_pages(pages))
+                    run_stats.increment("channel_pages", len(pages) + 1)
+
+                    portal_cache.put_channels(self.server.base_url, self.category_id, channels_data, portal_cache.fingerprint(response_json), sampled=not complete)
+                else:
+                    # No channels found for this genre
+                    return STATUS.CONTENT, "No channels data found.", None
+
+            channels = self.build_channels(channels_data)
+        except Exception as e:
+            return self.server.error_status(e), f"An error occurred while retrieving channels: {str(e) or type(e).__name__}", None
+
+        return STATUS.SUCCESS, "", channels
+
+
+
+class STK_AsyncServer:
+
+    STB_LANG = STK_Server.STB_LANG
+    STB_TIMEZONE = STK_Server.STB_TIMEZONE
+    USER_AGENT = STK_Server.USER_AGENT
+    # the same set as STK_Server - both engines learn which portals need the full login
+    FULL_LOGIN_HOSTS = STK_Server.FULL_LOGIN_HOSTS
+
+
+    def __init__(self, session, hostname, mac_address, token=None, token_timestamp=None, validation_slots=None):
+
+        self.session = session
+        # VLC slots shared by all MACs of the engine's event loop - without them only this server is bounded
+        self.validation_slots = validation_slots or asyncio.Semaphore(max(1, Settings.VLC_MAX_PARALLEL))
+        self.hostname = hostname
+        self.mac_address = mac_address
+        self.token = token
+        self.token_timestamp = token_timestamp
+        self.token_reused = False
+        self.fast_login = False
+        self.login_renewed = False
+        # see STK_Server.authenticated
+        self.authenticated = False
+        self._login_lock = asyncio.Lock()
+        self.cookies = None
+        self.headers = None
+
+        self.base_url = STK_Server.get_base_url(hostname)
+
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        # the client session is shared between all MACs and closed by the engine
+        self.session = None
+
+
+    async def __fetch_json(self, url, cookies, headers, timeout):
+        # returns None if the portal rejected the token - timeouts are the ones learned for the host
+        connect_timeout, read_timeout = host_latency.timeout(url, timeout)
+        start_time = time.perf_counter()
+        try:
+            async with self.session.get(
+                url,
+                cookies=cookies,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=connect_timeout + read_timeout, sock_connect=connect_timeout, sock_read=read_timeout),
+            ) as response:
+                text = await response.text(errors="ignore")
+        except asyncio.TimeoutError:
+            host_latency.observe_timeout(url, (connect_timeout, read_timeout))
+            raise
+        host_latency.observe(url, time.perf_counter() - start_time)
+        if STK_Server.is_rejected_response(response.status, text):
+            return None
+        response.raise_for_status()
+        # portals frequently answer with a wrong content type
+        return json.loads(text)
+
+
+    async def get_json(self, url, cookies=None, headers=None, timeout=10):
+        if cookies is not None or headers is not None:
+            response_json = await self.__fetch_json(url, cookies, headers, timeout)
+            if response_json is None:
+                raise aiohttp.ClientError("Authorization failed")
+            return response_json
+
+        # requests with the token of this server renew a rejected token once - see STK_Server.get_json
+        fast_login = self.fast_login and not self.token_reused
+        token = self.token
+        response_json = await self.__fetch_json(url, self.cookies, self.headers, timeout)
+        if response_json is None and await self.renew_login(token):
+            response_json = await self.__fetch_json(url, self.cookies, self.headers, timeout)
+            if fast_login and response_json is not None:
+                logging.info(f"Portal {self.base_url} needs the full login, fast login disabled for it")
+                self.FULL_LOGIN_HOSTS.add(self.base_url)
+        if response_json is None:
+            raise aiohttp.ClientError("Authorization failed")
+        self.authenticated = True
+        return response_json
+
+
+    async def get_token(self):
+        try:
+            handshake_url = f"{self.base_url}/portal.php?type=stb&action=handshake&JsHttpRequest=1-xml"
+            cookies = {
+                "mac": self.mac_address,
+                "stb_lang": self.STB_LANG,
+                "timezone": self.STB_TIMEZONE,
+            }
+            headers = {
+                "User-Agent": self.USER_AGENT
+            }
+            response_json = await self.get_json(handshake_url, cookies=cookies, headers=headers, timeout=15)
+            token = (response_json or {}).get("js", {}).get("token")
+            if token:
+                self.token = token
+                self.token_timestamp = time.time()
+                self.token_reused = False
+                self.set_auth()
+                return STATUS.SUCCESS, "Token retrieved"
+            else:
+                logging.debug("Token not found in handshake response.")
+                self.token = None
+                self.token_timestamp = None
+                return STATUS.LOGIN, "Token not found in handshake response."
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            return STATUS.UNREACHABLE, f"Portal unreachable: {e or type(e).__name__}"
+        except aiohttp.ClientResponseError as e:
+            if e.status >= 500:
+                return STATUS.UNREACHABLE, f"Portal unreachable: {e}"
+            return STATUS.ERROR, f"Error getting token: {e}"
+        except Exception as e:
+            return STATUS.ERROR, f"Error getting token: {e}"
+
+
+    set_auth = STK_Server.set_auth
+    is_token_valid = STK_Server.is_token_valid
+    needs_full_login = STK_Server.needs_full_login
+
+
+    async def validate_token(self):
+        if not self.is_token_valid():
+            return await self.get_token()
+        else:
+            logging.debug("Token is still valid.")
+            return STATUS.SUCCESS, "Token is valid"
+
+
+    @staticmethod
+    def error_status(error):
+        # see STK_Server.error_status
+        if isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+            return STATUS.UNREACHABLE
+        if isinstance(error, aiohttp.ClientResponseError) and error.status >= 500:
+            return STATUS.UNREACHABLE
+        return STATUS.ERROR
+
+
+    async def login(self):
+        if Settings.TOKEN_REUSE_ENABLED and self.is_token_valid():
+            status, message = await self.check_stored_token()
+            if status in (STATUS.SUCCESS, STATUS.UNREACHABLE):
+                return status, message
+
+        return await self.handshake_login(full=self.needs_full_login())
+
+
+    async def check_stored_token(self):
+        # see STK_Server.check_stored_token
+        status, message = await self.confirm_token()
+        if status != STATUS.SUCCESS:
+            return status, message.replace("Token", "Stored token", 1)
+        self.token_reused = True
+        run_stats.increment("login_token_reused")
+        return STATUS.SUCCESS, "Login with stored token"
+
+
+    async def confirm_token(self):
+        # see STK_Server.confirm_token
+        if self.authenticated:
+            return STATUS.SUCCESS, ""
+        self.set_auth()
+        try:
+            profile_url = f"{self.base_url}/portal.php?type=stb&action=get_profile&JsHttpRequest=1-xml"
+            if await self.__fetch_json(profile_url, self.cookies, self.headers, 10) is None:
+                logging.debug(f"Token rejected by {self.base_url}")
+                return STATUS.LOGIN, "Token rejected"
+        except Exception as e:
+            status = self.error_status(e)
+            if status == STATUS.UNREACHABLE:
+                return status, f"Portal unreachable: {e or type(e).__name__}"
+            return status, f"Token check failed: {e}"
+        self.authenticated = True
+        return STATUS.SUCCESS, ""
+
+
+    async def handshake_login(self, full=True):
+        status, message = await self.get_token()
+        if status != STATUS.SUCCESS:
+            return status, message
+
+        self.fast_login = not full
+        if self.fast_login:
+            run_stats.increment("login_fast")
+            return STATUS.SUCCESS, "Login successful"
+        run_stats.increment("login_full")
+
+        # Fetch profile and account info
+        try:
+            profile_url = f"{self.base_url}/portal.php?type=stb&action=get_profile&JsHttpRequest=1-xml"
+            await self.get_json(profile_url, cookies=self.cookies, headers=self.headers, timeout=10)
+        except Exception as e:
+            return STATUS.ERROR, f"Error fetching profile: {e}"
+        self.authenticated = True
+
+        try:
+            account_info_url = f"{self.base_url}/portal.php?type=account_info&action=get_main_info&JsHttpRequest=1-xml"
+            await self.get_json(account_info_url, cookies=self.cookies, headers=self.headers, timeout=10)
+        except Exception as e:
+            return STATUS.ERROR, f"Error fetching account info: {e}"
+
+        return STATUS.SUCCESS, "Login successful"
+
+
+    async def renew_login(self, rejected_token):
+        async with self._login_lock:
+            if self.token and self.token != rejected_token:
+                return True
+            if self.login_renewed:
+                return False
+            self.login_renewed = True
+            logging.debug(f"Token rejected ({'stored' if self.token_reused else 'fast login' if self.fast_login else 'full login'}), renewing login for {self.base_url}")
+            run_stats.increment("login_renewed")
+            status, message = await self.handshake_login(full=True)
+            if status != STATUS.SUCCESS:
+                logging.debug(f"Renewing login failed: {message}")
+                return False
+            return True
+
+
+    async def get_genres(self):
+        # Get live genres
+        genres = None
+        try:
+            genre_data = portal_cache.get_genres(self.base_url)
+            if genre_data is None:
+                genres_url = f"{self.base_url}/portal.php?type=itv&action=get_genres&JsHttpRequest=1-xml"
+                genre_data = (await self.get_json(genres_url, timeout=10)).get("js", [])
+                if genre_data:
+                    portal_cache.put_genres(self.base_url, genre_data)
+            if genre_data:
+                genres = STK_Server.build_genres(self, genre_data, STK_AsyncGenre)
+
+        except Exception as e:
+            return self.error_status(e), f"Error getting genres: {e or type(e).__name__}", None
+
+        return STATUS.SUCCESS, "", genres
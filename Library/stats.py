@@ -0,0 +1,82 @@
+# thread safe counters and phase timings for the run summary of CHECK_macs.py
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class RunStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.timings = defaultdict(list)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def get(self, name):
+        with self._lock:
+            return self.counters.get(name, 0)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.timings[name].append(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        # wall clock time of the block - also usable around awaits in a coroutine
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    @staticmethod
+    def percentile(values, pct):
+        if not values:
+            return None
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def timing_summary(self, name):
+        with self._lock:
+            values = list(self.timings.get(name, []))
+        return {
+            "count": len(values),
+            "total": sum(values),
+            "p50": self.percentile(values, 50),
+            "p95": self.percentile(values, 95),
+        }
+
+    def as_dict(self):
+        with self._lock:
+            counters = dict(self.counters)
+            names = list(self.timings.keys())
+        return {
+            "counters": counters,
+            "timings": {name: self.timing_summary(name) for name in names},
+        }
+
+    def snapshot(self):
+        # raw counters and timings, e.g. to pass them from a validation process to the main process
+        with self._lock:
+            return dict(self.counters), {name: list(values) for name, values in self.timings.items()}
+
+    def merge(self, snapshot):
+        counters, timings = snapshot
+        with self._lock:
+            for name, amount in counters.items():
+                self.counters[name] += amount
+            for name, values in timings.items():
+                self.timings[name].extend(values)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timings.clear()
+
+
+run_stats = RunStats()
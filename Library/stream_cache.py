@@ -0,0 +1,128 @@
+# class to share resolved stream URLs and validation verdicts between the MACs of one run
+import threading
+import time
+from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+from Library.Settings import STATUS
+from Library.Settings import Settings
+from Library.stats import run_stats
+
+
+# query parameters that only carry the session of one MAC - not part of the stream identity
+STREAM_SESSION_PARAMETERS = ("token", "play_token", "mac", "sn", "session", "uid")
+
+
+def stream_key(stream_url):
+    # normalized stream URL: stripped and without the per-MAC session parameters
+    if not stream_url:
+        return None
+    parsed_url = urlparse(stream_url.strip())
+    query = [(name, value) for name, value in parse_qsl(parsed_url.query, keep_blank_values=True)
+             if name.lower() not in STREAM_SESSION_PARAMETERS]
+    return urlunparse(parsed_url._replace(query=urlencode(query)))
+
+
+# verdicts per normalized stream URL and stream links per (portal, cmd) - a SUCCESS of another
+# MAC only counts for a MAC that made an authenticated request of its own
+class StreamCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = {}
+        self._links = {}
+
+
+    @staticmethod
+    def __ttl(status):
+        if status == STATUS.SUCCESS:
+            return Settings.STREAM_CACHE_TTL_SECONDS
+        return Settings.STREAM_CACHE_FAILURE_TTL_SECONDS
+
+
+    def __lookup(self, key, mac, authenticated):
+        # called with the lock held
+        entry = self._streams.get(key)
+        if entry is None:
+            return None
+        timestamp, real_url, status, message, entry_mac = entry
+        if time.monotonic() - timestamp > self.__ttl(status):
+            del self._streams[key]
+            return None
+        if status == STATUS.SUCCESS and not authenticated and entry_mac != mac:
+            return None
+        return real_url, status, message
+
+
+    # (real_url, status, message) of a stream or None
+    def get(self, stream_url, mac=None, authenticated=False):
+        if not Settings.STREAM_CACHE_ENABLED:
+            return None
+        with self._lock:
+            cached = self.__lookup(stream_key(stream_url), mac, authenticated)
+        if cached is None:
+            run_stats.increment("stream_cache_miss")
+            return None
+        run_stats.increment("stream_cache_hit")
+        real_url, status, message = cached
+        return real_url, status, f"{message} (cached)"
+
+
+    # (stream_url, real_url, status, message) of a channel command or None - a miss is counted by get
+    def get_link(self, base_url, cmd, mac=None, authenticated=False):
+        if not Settings.STREAM_CACHE_ENABLED or not cmd:
+            return None
+        with self._lock:
+            link = self._links.get((base_url, cmd))
+            if link is None:
+                return None
+            timestamp, stream_url = link
+            if time.monotonic() - timestamp > Settings.STREAM_CACHE_TTL_SECONDS:
+                del self._links[(base_url, cmd)]
+                return None
+            cached = self.__lookup(stream_key(stream_url), mac, authenticated)
+        if cached is None:
+            return None
+        run_stats.increment("stream_cache_hit")
+        run_stats.increment("stream_link_hit")
+        real_url, status, message = cached
+        return stream_url, real_url, status, f"{message} (cached)"
+
+
+    # mac: the MAC the verdict was found with, None for verdicts of earlier runs
+    def put(self, stream_url, real_url, status, message, timestamp=None, mac=None):
+        if not Settings.STREAM_CACHE_ENABLED or not stream_url:
+            return
+        with self._lock:
+            self._streams[stream_key(stream_url)] = (timestamp or time.monotonic(), real_url, status, message, mac)
+
+
+    def put_link(self, base_url, cmd, stream_url):
+        if not Settings.STREAM_CACHE_ENABLED or not cmd or not stream_url:
+            return
+        with self._lock:
+            self._links[(base_url, cmd)] = (time.monotonic(), stream_url)
+
+
+    # prime the cache with the working streams of earlier runs - rows of url, real_url, last_success
+    def load(self, rows):
+        now = datetime.now()
+        loaded = 0
+        for row in rows:
+            try:
+                age = (now - datetime.strptime(row.last_success, "%Y-%m-%d %H:%M:%S")).total_seconds()
+            except (TypeError, ValueError):
+                continue
+            if 0 <= age <= Settings.STREAM_CACHE_TTL_SECONDS:
+                self.put(row.url, row.real_url, STATUS.SUCCESS, "Stream worked in an earlier run",
+                         timestamp=time.monotonic() - age)
+                loaded += 1
+        return loaded
+
+
+    def clear(self):
+        with self._lock:
+            self._streams.clear()
+            self._links.clear()
+
+
+stream_cache = StreamCache()
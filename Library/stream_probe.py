@@ -0,0 +1,206 @@
+# Decode-free probe for HLS playlists and MPEG-TS streams.
+# Fetches a bounded number of bytes and decides without starting a player:
+#   (STATUS.SUCCESS, message) - stream delivers valid MPEG-TS with PAT and PMT
+#   (STATUS.ERROR, message)   - stream is definitely not playable
+#   (None, message)           - probe cannot decide, the caller falls back to VLC
+import logging
+from urllib.parse import urljoin
+
+import requests
+
+from Library.Settings import STATUS
+from Library.Settings import Settings
+
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+TS_MIN_SYNC_PACKETS = 5
+PAT_PID = 0x0000
+PAT_TABLE_ID = 0x00
+PMT_TABLE_ID = 0x02
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0'
+}
+
+
+def _read_bounded(response, max_bytes, stop=None):
+    # read at most max_bytes of the body; stop(data) may end the read early
+    data = bytearray()
+    try:
+        for chunk in response.iter_content(chunk_size=min(16 * 1024, max_bytes)):
+            if not chunk:
+                continue
+            data.extend(chunk)
+            if len(data) >= max_bytes or (stop and stop(data)):
+                break
+    except requests.exceptions.RequestException as e:
+        # a stalled live stream - judge what arrived so far
+        logging.debug(f"Stream probe read ended early: {e}")
+    return bytes(data[:max_bytes])
+
+
+def _find_sync_offset(data):
+    # offset of the first packet with TS_MIN_SYNC_PACKETS consecutive sync bytes, or None
+    needed = TS_PACKET_SIZE * (TS_MIN_SYNC_PACKETS - 1)
+    for offset in range(min(TS_PACKET_SIZE, len(data))):
+        if offset + needed >= len(data):
+            break
+        if all(data[offset + i * TS_PACKET_SIZE] == TS_SYNC_BYTE for i in range(TS_MIN_SYNC_PACKETS)):
+            return offset
+    return None
+
+
+def _iter_psi_sections(data, offset, pids):
+    # yield (pid, section) for packets on the given PIDs that start a PSI section
+    for start in range(offset, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+        packet = data[start:start + TS_PACKET_SIZE]
+        if packet[0] != TS_SYNC_BYTE:
+            return
+        payload_unit_start = packet[1] & 0x40
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        if not payload_unit_start or pid not in pids:
+            continue
+
+        adaptation_field_control = (packet[3] >> 4) & 0x03
+        position = 4
+        if adaptation_field_control in (0x02, 0x03):
+            position += 1 + packet[4]
+        if adaptation_field_control == 0x02 or position >= TS_PACKET_SIZE:
+            continue
+
+        pointer_field = packet[position]
+        section = packet[position + 1 + pointer_field:]
+        if len(section) >= 3:
+            yield pid, section
+
+
+def _parse_pat(section):
+    # returns the PMT PIDs listed in a PAT section
+    if section[0] != PAT_TABLE_ID:
+        return set()
+    section_length = ((section[1] & 0x0F) << 8) | section[2]
+    # 5 bytes header after section_length, 4 bytes CRC at the end
+    entries = section[8:min(len(section), 3 + section_length - 4)]
+    pmt_pids = set()
+    for i in range(0, len(entries) - 3, 4):
+        program_number = (entries[i] << 8) | entries[i + 1]
+        pid = ((entries[i + 2] & 0x1F) << 8) | entries[i + 3]
+        if program_number != 0:
+            pmt_pids.add(pid)
+    return pmt_pids
+
+
+def _parse_pmt(section):
+    # returns the number of elementary streams of a PMT section
+    if section[0] != PMT_TABLE_ID or len(section) < 12:
+        return 0
+    section_length = ((section[1] & 0x0F) << 8) | section[2]
+    program_info_length = ((section[10] & 0x0F) << 8) | section[11]
+    position = 12 + program_info_length
+    end = min(len(section), 3 + section_length - 4)
+    streams = 0
+    while position + 5 <= end:
+        es_info_length = ((section[position + 3] & 0x0F) << 8) | section[position + 4]
+        streams += 1
+        position += 5 + es_info_length
+    return streams
+
+
+def analyze_ts(data):
+    # Check sync bytes and PAT/PMT of an MPEG-TS buffer - returns (status or None, message)
+    offset = _find_sync_offset(data)
+    if offset is None:
+        return None, "No MPEG-TS sync bytes found"
+
+    pmt_pids = set()
+    for pid, section in _iter_psi_sections(data, offset, {PAT_PID}):
+        pmt_pids = _parse_pat(section)
+        if pmt_pids:
+            break
+    if not pmt_pids:
+        return None, "MPEG-TS without PAT in probed bytes"
+
+    for pid, section in _iter_psi_sections(data, offset, pmt_pids):
+        if _parse_pmt(section) > 0:
+            return STATUS.SUCCESS, "MPEG-TS with PAT and PMT"
+
+    return None, "MPEG-TS without PMT in probed bytes"
+
+
+def _has_pat_and_pmt(data):
+    return len(data) >= TS_PACKET_SIZE * TS_MIN_SYNC_PACKETS and analyze_ts(data)[0] == STATUS.SUCCESS
+
+
+def _is_playlist(data):
+    return data.lstrip(b"\xef\xbb\xbf \r\n\t").startswith(b"#EXTM3U")
+
+
+def _first_playlist_uri(playlist_text, base_url):
+    # returns (uri, is_variant) of the first variant stream or media segment
+    is_variant = False
+    for line in playlist_text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-STREAM-INF"):
+            is_variant = True
+            continue
+        if line.startswith("#"):
+            continue
+        return urljoin(base_url, line), is_variant
+    return None, False
+
+
+def _looks_like_html(data, content_type):
+    head = data.lstrip()[:64].lower()
+    return 'text/html' in content_type or head.startswith((b"<!doctype", b"<html", b"<?xml", b"{"))
+
+
+def _probe_url(session, url, max_bytes, depth=0):
+    timeout = Settings.STREAM_PROBE_TIMEOUT_SECONDS
+    with session.get(url, headers=HEADERS, stream=True, timeout=(timeout, timeout), allow_redirects=True) as response:
+        if response.status_code >= 400:
+            return STATUS.ERROR, f"Stream probe: HTTP {response.status_code}"
+
+        content_type = response.headers.get('Content-Type', '').lower()
+        data = _read_bounded(response, max_bytes, stop=_has_pat_and_pmt)
+        final_url = response.url
+
+    if not data:
+        return STATUS.ERROR, "Stream probe: empty response"
+
+    if _is_playlist(data):
+        if depth >= 2:
+            return None, "Stream probe: nested playlists"
+        uri, is_variant = _first_playlist_uri(data.decode("utf-8", errors="ignore"), final_url)
+        if not uri:
+            return None, "Stream probe: HLS playlist without segments"
+        logging.debug(f"Stream probe: following {'variant' if is_variant else 'segment'} {uri}")
+        return _probe_url(session, uri, max_bytes, depth + 1)
+
+    status, message = analyze_ts(data)
+    if status is not None:
+        return status, f"Stream probe: {message}"
+
+    if _looks_like_html(data, content_type):
+        return STATUS.ERROR, "Stream probe: response is not a media stream"
+
+    return None, f"Stream probe: {message}"
+
+
+def probe_stream(stream_url, session=None):
+    own_session = session is None
+    session = session or requests.Session()
+    try:
+        return _probe_url(session, stream_url, Settings.STREAM_PROBE_MAX_BYTES)
+    except requests.exceptions.Timeout as e:
+        return None, f"Stream probe: timeout: {e}"
+    except requests.exceptions.ConnectionError as e:
+        return STATUS.ERROR, f"Stream probe: connection failed: {e}"
+    except Exception as e:
+        # timeouts and anything unexpected are left to VLC
+        return None, f"Stream probe: {e}"
+    finally:
+        if own_session:
+            session.close()
@@ -0,0 +1,147 @@
+# Bounded resolver for the real URL behind the stream link of a channel.
+# Redirects are followed hop by hop with a timeout per hop and at most
+# STREAM_RESOLVE_MAX_BODY_BYTES of a body are read to find an m3u8 URL, so an endless
+# live stream can neither block a worker nor pull megabytes per check:
+#   (STATUS.SUCCESS, message, real_url) - redirect target or m3u8 URL found
+#   (STATUS.ERROR, message, None)       - no real URL, the caller uses the stream link itself
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urljoin, urlparse
+
+import requests
+
+from Library.Settings import STATUS
+from Library.Settings import Settings
+from Library.host_latency import host_latency
+from Library.stats import run_stats
+from Library.stream_probe import _read_bounded
+
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0'
+}
+
+M3U8_URL_PATTERN = re.compile(r'(https?://[^\s"\']+\.m3u8)')
+REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
+
+
+def find_m3u8_url(data, content_type=""):
+    # first m3u8 URL in the head of a body - only text bodies are searched
+    if data[:1] == b"\x47":
+        # MPEG-TS sync byte, the stream itself
+        return None
+    text = data.decode("utf-8", errors="ignore")
+    if 'mpegurl' not in content_type.lower() and '.m3u8' not in text:
+        return None
+    match = M3U8_URL_PATTERN.search(text)
+    return match.group(1).strip() if match else None
+
+
+# resolved real URL per stream link for STREAM_RESOLVE_CACHE_TTL_SECONDS, at most
+# STREAM_RESOLVE_CACHE_PER_HOST entries per host
+class RedirectCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+
+    def get(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            entries = self._hosts.get(host)
+            entry = entries.get(url) if entries else None
+            if entry is None:
+                return None
+            timestamp, real_url = entry
+            if time.monotonic() - timestamp > Settings.STREAM_RESOLVE_CACHE_TTL_SECONDS:
+                del entries[url]
+                return None
+        run_stats.increment("resolve_cache_hit")
+        return real_url
+
+
+    def put(self, url, real_url):
+        if Settings.STREAM_RESOLVE_CACHE_PER_HOST <= 0:
+            return
+        host = urlparse(url).netloc
+        with self._lock:
+            entries = self._hosts.setdefault(host, OrderedDict())
+            entries[url] = (time.monotonic(), real_url)
+            entries.move_to_end(url)
+            while len(entries) > Settings.STREAM_RESOLVE_CACHE_PER_HOST:
+                entries.popitem(last=False)
+
+
+    def clear(self):
+        with self._lock:
+            self._hosts.clear()
+
+
+redirect_cache = RedirectCache()
+
+
+def _resolve(session, url):
+    timeout = Settings.STREAM_RESOLVE_TIMEOUT_SECONDS
+    deadline = time.monotonic() + timeout * (Settings.STREAM_RESOLVE_MAX_REDIRECTS + 1)
+    current_url = url
+    for hop in range(Settings.STREAM_RESOLVE_MAX_REDIRECTS + 1):
+        if time.monotonic() > deadline:
+            return STATUS.ERROR, "Timeout resolving the real stream URL", None
+
+        # learned timeouts of the host, but never above the hard bound per hop
+        timeouts = tuple(min(value, timeout) for value in host_latency.timeout(current_url, timeout))
+        start_time = time.perf_counter()
+        try:
+            response = session.get(current_url, headers=HEADERS, stream=True, timeout=timeouts, allow_redirects=False)
+        except requests.exceptions.Timeout:
+            host_latency.observe_timeout(current_url, timeouts)
+            raise
+        host_latency.observe(current_url, time.perf_counter() - start_time)
+
+        with response:
+            location = response.headers.get('Location')
+            if response.status_code in REDIRECT_STATUS_CODES and location:
+                current_url = urljoin(current_url, location.strip())
+                logging.debug(f"[*] Redirect {hop + 1} → {current_url}")
+                continue
+
+            if response.status_code >= 400:
+                return STATUS.ERROR, f"Real stream URL: HTTP {response.status_code}", None
+            if hop:
+                # redirected - the body is the stream itself and is never read
+                return STATUS.SUCCESS, "", current_url
+
+            content_type = response.headers.get('Content-Type', '')
+            data = _read_bounded(response, Settings.STREAM_RESOLVE_MAX_BODY_BYTES)
+
+        m3u8_url = find_m3u8_url(data, content_type)
+        if m3u8_url:
+            logging.debug("[*] Stream URL found in response body")
+            return STATUS.SUCCESS, "", m3u8_url
+        return STATUS.ERROR, "Could not find real stream URL in headers or body", None
+
+    return STATUS.ERROR, f"More than {Settings.STREAM_RESOLVE_MAX_REDIRECTS} redirects", None
+
+
+def resolve_stream_url(url, session=None):
+    real_url = redirect_cache.get(url)
+    if real_url:
+        return STATUS.SUCCESS, "", real_url
+
+    own_session = session is None
+    session = session or requests.Session()
+    try:
+        status, message, real_url = _resolve(session, url)
+    except Exception as e:
+        logging.debug(f"[!] Error: {e}")
+        return STATUS.ERROR, f"Error at fetching real stream URL: {e}", None
+    finally:
+        if own_session:
+            session.close()
+
+    if status == STATUS.SUCCESS:
+        redirect_cache.put(url, real_url)
+    return status, message, real_url
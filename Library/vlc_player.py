@@ -1,5 +1,7 @@
 import os
 import sys
+import threading
+import time
 import vlc
 import logging
 
@@ -59,15 +61,26 @@ class VLCPlayer:
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
         # Release old instances safely
         if self.player:
             self.player.release()
+            self.player = None
         if self.instance:
             self.instance.release()
+            self.instance = None
 
     def set_media(self, media_path):
+        self.media_path = media_path
         media = self.instance.media_new(media_path)
         self.player.set_media(media)
+        # the player keeps its own reference
+        media.release()
+
+    def get_state(self):
+        return self.player.get_state()
 
     def play(self):
         #logging.info("VLC playback started.")
@@ -108,4 +121,70 @@ class VLCPlayer:
             return True
         return False
 
-    
\ No newline at end of file
+
+
+# bounded pool of warm VLC players, created on demand up to max_size - a broken player is replaced
+class VLCPlayerPool:
+    def __init__(self, max_size, silent=True):
+        self.max_size = max(1, int(max_size))
+        self.silent = silent
+        self._idle = []
+        # notified whenever a player becomes idle or a slot is freed by a discarded player
+        self._available = threading.Condition()
+        self._created = 0
+        self._closed = False
+
+    def acquire(self, timeout=None):
+        # returns an idle player, a new one while below max_size, or None after timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._available:
+            while not self._idle and self._created >= self.max_size:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._available.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+
+        try:
+            return VLCPlayer(silent=self.silent)
+        except Exception:
+            self.__free_slot()
+            raise
+
+    def release(self, player, broken=False):
+        try:
+            broken = broken or player.get_state() == vlc.State.Error
+            player.stop()
+        except Exception as e:
+            logging.debug(f"Error while stopping pooled VLC player: {e}")
+            broken = True
+
+        if broken or self._closed:
+            logging.debug("Recycling VLC player")
+            self.__discard(player)
+        else:
+            with self._available:
+                self._idle.append(player)
+                self._available.notify()
+
+    def __free_slot(self):
+        # a waiting acquire creates the replacement player
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+
+    def __discard(self, player):
+        try:
+            player.close()
+        except Exception as e:
+            logging.debug(f"Error while releasing pooled VLC player: {e}")
+        self.__free_slot()
+
+    def close(self):
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for player in idle:
+            self.__discard(player)
@@ -0,0 +1,99 @@
+import argparse
+import logging
+import os
+
+from Library.Settings import Settings
+from Library.Sqllite import IPTV_Database
+from Library.db_sync import use_local_copy
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Archive dead MACs, prune old runs, ANALYZE and VACUUM the IPTV database")
+    parser.add_argument("--archive-path", default=None, help="database file of the archived MACs (default: Settings.DB_ARCHIVE_PATH)")
+    parser.add_argument("--failed-days", type=int, default=Settings.DB_ARCHIVE_FAILED_DAYS, help="archive failed MACs not checked for this many days")
+    parser.add_argument("--expired-days", type=int, default=Settings.DB_ARCHIVE_EXPIRED_DAYS, help="archive MACs expired this many days ago")
+    parser.add_argument("--prune-runs-days", type=int, default=Settings.DB_PRUNE_RUNS_DAYS, help="delete finished runs started this many days ago")
+    parser.add_argument("--no-archive", action="store_true", help="keep dead MACs and old runs")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM regardless of the free pages")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be archived")
+    return parser.parse_args()
+
+
+def format_size(size):
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def percent_change(before, after):
+    return f"{100 * (after - before) / before:+.1f}%" if before else "n/a"
+
+
+def log_storage(label, stats):
+    free_percent = 100 * stats["freelist_count"] / stats["page_count"] if stats["page_count"] else 0
+    logging.info(
+        f"{label}: {format_size(stats['file_size'])}, {stats['page_count']} pages, "
+        f"{stats['freelist_count']} free ({free_percent:.1f}%), {stats['macs']} MACs"
+    )
+    return free_percent
+
+
+def main():
+    args = parse_args()
+    # resolved before use_local_copy - the archive stays next to the synced database
+    archive_path = args.archive_path or Settings.DB_ARCHIVE_PATH or os.path.join(
+        os.path.dirname(os.path.abspath(Settings.DB_PATH)), "IPTV_archive.db"
+    )
+    if not args.dry_run:
+        use_local_copy()
+
+    with IPTV_Database(read_only=args.dry_run) as db:
+        before = db.get_storage_stats()
+        log_storage("Before", before)
+        if args.dry_run and db.schema_outdated():
+            # the read-only dry run does not migrate - the queries below need the current schema
+            logging.warning("Dry run: the database schema is older than this release, run without --dry-run to migrate it first")
+            return 0
+        before_seconds = db.time_hot_queries()
+        logging.info(f"Hot queries for all URLs: {before_seconds * 1000:.1f} ms")
+
+        if args.dry_run:
+            dead = db.count_dead_macs(args.failed_days, args.expired_days)
+            logging.info(f"Dry run: {dead} dead MACs would be archived to {archive_path}")
+            return 0
+
+        if not args.no_archive:
+            moved = db.archive_dead_macs(archive_path, args.failed_days, args.expired_days)
+            logging.info(f"Archived {moved} dead MACs to {archive_path}")
+            pruned = db.prune_runs(args.prune_runs_days)
+            logging.info(f"Pruned {pruned} runs started more than {args.prune_runs_days} days ago")
+
+        db.optimize()
+        logging.info("ANALYZE and PRAGMA optimize done")
+
+        free_percent = log_storage("After pruning", db.get_storage_stats())
+        if args.vacuum or free_percent >= Settings.DB_VACUUM_FREE_PERCENT:
+            db.vacuum()
+            logging.info("VACUUM done")
+        else:
+            logging.info(f"No VACUUM, less than {Settings.DB_VACUUM_FREE_PERCENT}% free pages")
+
+        after = db.get_storage_stats()
+        after_seconds = db.time_hot_queries()
+
+    logging.info("------------------------------------------------")
+    log_storage("After", after)
+    logging.info(f"Hot queries for all URLs: {after_seconds * 1000:.1f} ms")
+    logging.info(
+        f"Size {format_size(before['file_size'])} -> {format_size(after['file_size'])} "
+        f"({percent_change(before['file_size'], after['file_size'])})"
+    )
+    logging.info(
+        f"Query time {before_seconds * 1000:.1f} ms -> {after_seconds * 1000:.1f} ms "
+        f"({percent_change(before_seconds, after_seconds)})"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -4,6 +4,7 @@ import re
 from datetime import datetime
 from bs4 import BeautifulSoup
 from Library import IPTV_Database
+from Library.db_sync import use_local_copy
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -103,17 +104,11 @@ def main():
 
     logging.info(f"Extracted {len(all_results)} entries.")
 
-    skipped_count = 0
-    inserted_count = 0
+    use_local_copy()
     with IPTV_Database() as db:
-        for counter, entry in enumerate(all_results, 1):
-            if db.get_mac_id(entry['url'], entry['mac']):
-                #logging.info(f"[{counter}/{len(all_results)}] EXISTS: {entry['url']} - {entry['mac']}")
-                skipped_count += 1
-                continue
-            logging.info(f"[{counter}/{len(all_results)}] INSERTING: {entry['url']} - {entry['mac']} - {entry['expiration']}")
-            db.insert_mac(entry['url'], entry['mac'], entry['expiration'], None, None)
-            inserted_count += 1
+        inserted_count, skipped_count = db.bulk_insert_macs(
+            (entry['url'], entry['mac'], entry['expiration']) for entry in all_results
+        )
 
     logging.info("------------------------------------------")
     logging.info(f"Inserted {inserted_count} new MACs, skipped {skipped_count} existing MACs.")
@@ -0,0 +1,265 @@
+import argparse
+import json
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from Library import IPTV_Database, Settings, STATUS, configure_vlc_parallel
+from Library.channel_health import ChannelHealth
+from Library.circuit_breaker import HostCircuitBreaker
+from Library.host_latency import host_latency
+from Library.priority import mac_priority, url_priority
+from Library.queue_service import QueueClient, QueueService
+from Library.scheduler import get_host
+from CHECK_macs import process_mac, normalize_status
+
+from colorama import init, Fore
+
+import logging
+logging.basicConfig(level=Settings.LOG_LEVEL, format=Settings.LOG_FORMAT)
+
+# Queue mode of CHECK_macs.py: one coordinator puts the (url, mac) jobs of a run into the
+# queue_jobs table, any number of worker processes lease jobs, check them with process_mac and
+# report the results back. Only the coordinator host opens the SQLite file: workers on that host
+# use DB_PATH directly, workers on other machines go through the lease service the coordinator
+# starts with --listen (Library/queue_service.py) - never open DB_PATH from a network share.
+# The coordinator writes the MAC status and the run journal and enforces the per URL rules
+# (known good MAC first, stop after the first working MAC, circuit breaker per host).
+
+# priority of a known good MAC - leased before everything else
+KNOWN_GOOD_PRIORITY = 1000000
+
+
+def build_jobs(db, urls, skip_statuses):
+    # (url_id, mac_id, priority, known_good, state) of all MACs to check and the url ids per host
+    url_history = db.get_url_history()
+    jobs = []
+    host_urls = {}
+    for url in urls:
+        url_id = db.get_url_id(url)
+        if url_id is None:
+            continue
+        host_urls.setdefault(get_host(url), set()).add(url_id)
+        url_score = url_priority(url_history.get(url))
+
+        known_mac_id = db.get_newest_working_mac_for_url(url)
+        if known_mac_id:
+            macs = db.iter_all_other_macs_by_url(url, known_mac_id)
+            jobs.append((url_id, known_mac_id, KNOWN_GOOD_PRIORITY + url_score, True, 'PENDING'))
+        else:
+            macs = db.iter_all_macs_by_url(url)
+
+        for mac_item in macs:
+            if skip_statuses and normalize_status(mac_item.status) in skip_statuses:
+                continue
+            # the other MACs of a URL wait for the result of its known good MAC
+            state = 'HELD' if known_mac_id else 'PENDING'
+            jobs.append((url_id, mac_item.id, url_score + mac_priority(mac_item), False, state))
+    return jobs, host_urls
+
+
+def run_coordinator(args, skip_statuses):
+    with IPTV_Database() as db:
+        urls = db.get_all_urls()
+        if args.url:
+            if args.url not in urls:
+                logging.error(f"URL '{args.url}' not found in the database.")
+                return
+            urls = [args.url]
+
+        run = db.get_unfinished_run('queue') if args.resume else None
+        if run is not None:
+            run_id = run.id
+            logging.info(f"Resuming run {run_id} started at {run.started} (parameters: {run.parameters})")
+        else:
+            parameters = {name: value for name, value in vars(args).items() if name not in ('resume', 'mode')}
+            run_id = db.start_run(json.dumps(dict(parameters, queue=True), sort_keys=True), 'queue')
+        logging.info(f"Run id: {run_id} - start workers with: QUEUE_check_macs.py worker --run-id {run_id}")
+
+        service = None
+        if args.listen:
+            host, _, port = args.listen.rpartition(":")
+            service = QueueService(db, host or "0.0.0.0", int(port)).start()
+
+        jobs, host_urls = build_jobs(db, urls, skip_statuses)
+        # a resumed run keeps its jobs, only new MACs are added
+        db.enqueue_jobs(run_id, jobs)
+        logging.info(f"Queued {len(jobs)} MAC checks of {len(urls)} URLs")
+
+        breaker = HostCircuitBreaker()
+        start_time = time.time()
+        last_progress = 0
+
+        def cancel(url_id, status, message, states=('PENDING', 'HELD', 'PAUSED')):
+            for mac_id in db.cancel_url_jobs(run_id, url_id, status, states):
+                db.queue_mac_status(mac_id, status, message)
+                db.queue_run_mac(run_id, mac_id, status)
+
+        def hold_host(host, url_ids):
+            # open circuit: hold the jobs during the cool-down, then let one probe through -
+            # only a failed probe cancels them, the HELD jobs of a known good MAC stay
+            if breaker.is_down(host):
+                for url_id in url_ids:
+                    cancel(url_id, STATUS.UNREACHABLE, f"Host {host} unreachable, not checked", ('PENDING', 'PAUSED'))
+            elif breaker.is_open(host):
+                if db.pause_url_jobs(run_id, url_ids):
+                    paused_hosts.add(host)
+            elif host in paused_hosts:
+                if host not in breaker.hosts:
+                    paused_hosts.discard(host)
+                    db.resume_url_jobs(run_id, url_ids)
+                elif breaker.acquire(host):
+                    db.resume_url_jobs(run_id, url_ids, 1)
+
+        paused_hosts = set()
+
+        while True:
+            released, given_up = db.reap_expired_leases(run_id, Settings.QUEUE_MAX_ATTEMPTS)
+            if released or given_up:
+                logging.warning(f"Expired leases: {released} jobs queued again, {given_up} given up")
+
+            for row in db.collect_job_results(run_id):
+                status = STATUS(row.status)
+                color = Fore.GREEN if status == STATUS.SUCCESS else (Fore.YELLOW if status == STATUS.UNREACHABLE else Fore.RED)
+                known = " (known good)" if row.known_good else ""
+                logging.info(f"{color}{row.url} {row.mac}{known} [{row.worker}] -> {status} - {row.error}")
+                db.queue_mac_status(row.mac_id, status, row.error, row.german, row.adult)
+                db.queue_run_mac(run_id, row.mac_id, status, row.known_good)
+
+                # stop after the first working MAC of the URL
+                if status == STATUS.SUCCESS and not args.process_all:
+                    cancel(row.url_id, STATUS.SKIPPED, "")
+                elif row.known_good:
+                    db.release_held_jobs(run_id, row.url_id)
+
+                breaker.record(get_host(row.url), status, row.error)
+
+            for host, url_ids in host_urls.items():
+                if host in breaker.hosts or host in paused_hosts:
+                    hold_host(host, url_ids)
+
+            counts = db.get_queue_counts(run_id)
+            open_jobs = counts.get('PENDING', 0) + counts.get('HELD', 0) + counts.get('PAUSED', 0) + counts.get('LEASED', 0)
+            if not open_jobs:
+                break
+            if time.time() - last_progress >= Settings.QUEUE_PROGRESS_SECONDS:
+                last_progress = time.time()
+                logging.info(f"{Fore.WHITE}Queue: " + ", ".join(f"{state.lower()}={count}" for state, count in sorted(counts.items())))
+            time.sleep(Settings.QUEUE_POLL_SECONDS)
+
+        global_status_counts = {state.value: 0 for state in STATUS}
+        global_status_counts.update(db.get_run_status_counts(run_id))
+        db.finish_run(run_id)
+
+        if service is not None:
+            # idle remote workers need one more poll to see the finished run
+            time.sleep(Settings.QUEUE_POLL_SECONDS * 2)
+            service.stop()
+
+    total_time = time.time() - start_time
+    logging.info("------------------------------------------------")
+    logging.info(
+        f"{Fore.WHITE}GLOBAL summary: "
+        + ", ".join(f"{state.lower()}={count}" for state, count in global_status_counts.items())
+        + f", total={sum(global_status_counts.values())}"
+    )
+    logging.info(f"Total time taken: {total_time:.0f} seconds")
+
+
+def run_worker(args):
+    configure_vlc_parallel(args.vlc_workers)
+    worker = args.worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    workers = max(1, args.workers)
+
+    with (QueueClient(args.server) if args.server else IPTV_Database()) as db:
+        run_id = args.run_id
+        while run_id is None:
+            run = db.get_unfinished_run('queue')
+            if run is not None:
+                run_id = run.id
+            else:
+                logging.info("No running coordinator yet, waiting...")
+                time.sleep(Settings.QUEUE_POLL_SECONDS)
+        logging.info(f"Worker {worker} for run {run_id} with {workers} parallel MAC checks")
+
+        if Settings.HOST_TIMEOUT_ADAPTIVE:
+            host_latency.load(db.get_host_latencies())
+
+        channel_health = {}
+        futures = {}
+        checked = 0
+        last_heartbeat = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                free = workers - len(futures)
+                if free > 0:
+                    for job in db.lease_jobs(run_id, worker, free, Settings.QUEUE_MAX_LEASES_PER_URL, Settings.QUEUE_LEASE_SECONDS):
+                        # ChannelHealth of the URL, shared by the jobs of this worker
+                        if job.url not in channel_health:
+                            channel_health[job.url] = ChannelHealth(db.get_channel_health_by_url(job.url))
+                        futures[executor.submit(process_mac, db, job.url, job.mac, job, channel_health[job.url])] = job
+
+                if not futures:
+                    if db.get_run_status(run_id) != 'RUNNING':
+                        break
+                    time.sleep(Settings.QUEUE_POLL_SECONDS)
+                    continue
+
+                done, _ = wait(list(futures.keys()), timeout=Settings.QUEUE_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = futures.pop(future)
+                    try:
+                        result_success, success_message, is_german, is_adult = future.result()
+                    except Exception as exc:
+                        result_success, success_message, is_german, is_adult = STATUS.ERROR, f"Unhandled error: {exc}", None, None
+                    checked += 1
+                    logging.info(f"{job.url} {job.mac} -> {result_success} - {success_message}")
+                    if not db.report_job(job.job_id, worker, result_success, success_message, is_german, is_adult):
+                        logging.warning(f"Lease of {job.url} {job.mac} expired, result dropped")
+
+                # renew the leases of the running checks
+                if time.monotonic() - last_heartbeat >= Settings.QUEUE_HEARTBEAT_SECONDS:
+                    db.renew_job_leases([job.job_id for job in futures.values()], worker, Settings.QUEUE_LEASE_SECONDS)
+                    last_heartbeat = time.monotonic()
+
+        # the next run starts with the timeouts learned by this worker
+        db.save_host_latencies(host_latency.rows())
+
+    logging.info(f"Worker {worker} finished: {checked} MACs checked")
+
+
+def main():
+    init(autoreset=True)  # Initialize colorama
+
+    parser = argparse.ArgumentParser(description='Check MACs for IPTV URLs with one coordinator and any number of worker processes, local or on other machines through the lease service of the coordinator.')
+    parser.add_argument('mode', choices=['coordinator', 'worker'], help='coordinator: queue the MACs of a run and collect the results, worker: check queued MACs.')
+    parser.add_argument('--url', type=str, help='coordinator: optional URL to check MACs for. If not provided, all URLs will be processed.')
+    parser.add_argument('--process-all', action='store_true', help='coordinator: process all MACs regardless of finding a working one.')
+    parser.add_argument('--skip-login', action='store_true', help='coordinator: skip MACs already marked with status LOGIN.')
+    parser.add_argument('--skip-error', action='store_true', help='coordinator: skip MACs already marked with status ERROR.')
+    parser.add_argument('--skip-content', action='store_true', help='coordinator: skip MACs already marked with status CONTENT.')
+    parser.add_argument('--resume', action='store_true', help='coordinator: continue the newest unfinished run and its queue.')
+    parser.add_argument('--listen', type=str, help=f'coordinator: serve the queue to remote workers on [host:]port (e.g. :{Settings.QUEUE_SERVICE_PORT}).')
+    parser.add_argument('--server', type=str, help=f'worker: lease jobs from the service of the coordinator (e.g. http://coordinator:{Settings.QUEUE_SERVICE_PORT}) instead of opening the database.')
+    parser.add_argument('--run-id', type=int, help='worker: run to work for (default: the newest unfinished run).')
+    parser.add_argument('--worker-id', type=str, help='worker: name in the queue (default: hostname:pid).')
+    parser.add_argument('--workers', type=int, default=10, help='worker: number of parallel MAC checks (default: 10).')
+    parser.add_argument('--vlc-workers', type=int, default=Settings.VLC_MAX_PARALLEL, help=f'worker: number of parallel VLC stream validations (default: {Settings.VLC_MAX_PARALLEL}).')
+    args = parser.parse_args()
+
+    if args.mode == 'coordinator':
+        skip_statuses = set()
+        if args.skip_login:
+            skip_statuses.add(STATUS.LOGIN.value)
+        if args.skip_error:
+            skip_statuses.add(STATUS.ERROR.value)
+        if args.skip_content:
+            skip_statuses.add(STATUS.CONTENT.value)
+        run_coordinator(args, skip_statuses)
+    else:
+        run_worker(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,16 @@
-import sqlite3
 from datetime import datetime
 
 from Library.Settings import STATUS, Settings
+from Library.Sqllite import connect_database
+from Library.migrations import migrate
 
 
 def main():
-    conn = sqlite3.connect(Settings.DB_PATH)
+    conn = connect_database(Settings.DB_PATH)
     try:
+        # e.g. macs.last_updated of databases created by older releases
+        migrate(conn)
         cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(macs)")
-        columns = {row[1] for row in cursor.fetchall()}
-        if "last_updated" not in columns:
-            cursor.execute("ALTER TABLE macs ADD COLUMN last_updated TEXT")
         cursor.execute(
             "UPDATE macs SET status = NULL, failed = 0, last_updated = ? WHERE status <> ?",
             (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), STATUS.SUCCESS.value)
@@ -1679,7 +1679,7 @@ class MainWindow(QMainWindow):
                 logging.debug("Progress bar reached 100% (Non-Stalker).")
 
     def load_profiles(self):
-        with IPTV_Database() as db:
+        with IPTV_Database(read_only=True) as db:
             macs = db.get_url_and_working_mac()
             if macs:
                 self.profiles = [{"name": "(" 